@@ -1,13 +1,13 @@
+import asyncio
 import dataclasses
-import io
 import json
 import logging
 import mimetypes
 import os
 import time
-from collections.abc import AsyncGenerator, Awaitable
+from collections.abc import AsyncGenerator, Awaitable, Iterable
 from pathlib import Path
-from typing import Any, Callable, Union, cast
+from typing import Any, Callable, Optional, Union, cast
 
 from azure.cognitiveservices.speech import (
     ResultReason,
@@ -34,24 +34,39 @@ from opentelemetry.instrumentation.openai import OpenAIInstrumentor
 from quart import (
     Blueprint,
     Quart,
+    Response,
     abort,
     current_app,
     jsonify,
     make_response,
     request,
-    send_file,
     send_from_directory,
 )
+from quart.json.provider import DefaultJSONProvider
 from quart_cors import cors
-
-from approaches.approach import Approach
+from redis.asyncio import Redis
+from werkzeug.datastructures import ContentRange
+from werkzeug.http import unquote_etag
+
+from approaches.answercache import (
+    AnswerCache,
+    AnswerCacheBackend,
+    InMemoryAnswerCacheBackend,
+    RedisAnswerCacheBackend,
+)
+from approaches.approach import Approach, Document, ExtraInfo, ThoughtStep
 from approaches.chatreadretrieveread import ChatReadRetrieveReadApproach
+from approaches.contextpacker import ContextPacker
+from approaches.embeddingcache import EmbeddingCache
+from approaches.imagecache import ImageSourceCache
 from approaches.promptmanager import PromptyManager
 from approaches.retrievethenread import RetrieveThenReadApproach
+from approaches.searchcache import SearchResultCache
 from chat_history.cosmosdb import chat_history_cosmosdb_bp
 from config import (
     CONFIG_AGENT_CLIENT,
     CONFIG_AGENTIC_RETRIEVAL_ENABLED,
+    CONFIG_ANSWER_CACHE,
     CONFIG_ASK_APPROACH,
     CONFIG_AUTH_CLIENT,
     CONFIG_CHAT_APPROACH,
@@ -80,12 +95,14 @@ from config import (
     CONFIG_SPEECH_SERVICE_TOKEN,
     CONFIG_SPEECH_SERVICE_VOICE,
     CONFIG_STREAMING_ENABLED,
+    CONFIG_UPLOAD_JOBS,
     CONFIG_USER_BLOB_MANAGER,
     CONFIG_USER_UPLOAD_ENABLED,
     CONFIG_VECTOR_SEARCH_ENABLED,
 )
 from core.authentication import AuthenticationHelper
 from core.sessionhelper import create_session_id
+from core.uploadjobs import DEFAULT_JOB_LOG_PATH, UploadJob, UploadJobs
 from decorators import authenticated, authenticated_path
 from error import error_dict, error_response
 from prepdocs import (
@@ -97,10 +114,15 @@ from prepdocs import (
     setup_openai_client,
     setup_search_info,
 )
-from prepdocslib.blobmanager import AdlsBlobManager, BlobManager
+from prepdocslib.blobcache import BlobCache
+from prepdocslib.blobmanager import (
+    AdlsBlobManager,
+    BaseBlobManager,
+    BlobManager,
+    BlobProperties,
+)
 from prepdocslib.embeddings import ImageEmbeddings
 from prepdocslib.filestrategy import UploadUserFileStrategy
-from prepdocslib.listfilestrategy import File
 
 bp = Blueprint("routes", __name__, static_folder="static")
 # Fix Windows registry issue with mimetypes
@@ -130,6 +152,55 @@ async def assets(path):
     return await send_from_directory(Path(__file__).resolve().parent / "static" / "assets", path)
 
 
+def content_blob_managers(auth_claims: dict[str, Any]) -> list[tuple[BaseBlobManager, Optional[str]]]:
+    """The blob managers that /content looks for files in, in order, with the user OID to pass to each of them"""
+    blob_managers: list[tuple[BaseBlobManager, Optional[str]]] = [
+        (current_app.config[CONFIG_GLOBAL_BLOB_MANAGER], None)
+    ]
+    if current_app.config[CONFIG_USER_UPLOAD_ENABLED]:
+        blob_managers.append((current_app.config[CONFIG_USER_BLOB_MANAGER], auth_claims["oid"]))
+    return blob_managers
+
+
+def get_content_etag(properties: BlobProperties) -> Optional[str]:
+    """The entity tag of a blob without the quotes that storage sends it with (its ETags are always strong)"""
+    etag = properties.get("etag")
+    return unquote_etag(etag)[0] if etag else None
+
+
+def is_content_not_modified(properties: BlobProperties) -> bool:
+    etag = get_content_etag(properties)
+    last_modified = properties.get("last_modified")
+    # If-None-Match takes precedence over If-Modified-Since
+    if request.if_none_match:
+        return etag is not None and request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified:
+        # HTTP dates are only precise to the second
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+
+def is_content_range_current(properties: BlobProperties) -> bool:
+    """Whether the If-Range condition (if any) holds, so the range can be sent rather than the whole file"""
+    if_range = request.if_range
+    if if_range.etag is not None:
+        return get_content_etag(properties) == if_range.etag
+    if if_range.date is not None:
+        last_modified = properties.get("last_modified")
+        return last_modified is not None and last_modified.replace(microsecond=0) <= if_range.date
+    return True
+
+
+def set_content_validators(response: Response, properties: BlobProperties):
+    if etag := get_content_etag(properties):
+        response.set_etag(etag)
+    if last_modified := properties.get("last_modified"):
+        response.last_modified = last_modified
+    # Browsers may keep the file, but must check that it's unchanged (and that the user still has access) to reuse it
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+
+
 @bp.route("/content/<path>")
 @authenticated_path
 async def content_file(path: str, auth_claims: dict[str, Any]):
@@ -138,7 +209,8 @@ async def content_file(path: str, auth_claims: dict[str, Any]):
     *** NOTE *** if you are using app services authentication, this route will return unauthorized to all users that are not logged in
     if AZURE_ENFORCE_ACCESS_CONTROL is not set or false, logged in users can access all files regardless of access control
     if AZURE_ENFORCE_ACCESS_CONTROL is set to true, logged in users can only access files they have access to
-    This is also slow and memory hungry.
+    Files are streamed from storage in chunks. Range requests (used by PDF viewers to load pages as they're shown)
+    and conditional requests with ETag or Last-Modified (used by browsers to revalidate cached files) are supported.
     """
     # Remove page number from path, filename-1.txt -> filename.txt
     # This shouldn't typically be necessary as browsers don't send hash fragments to servers
@@ -146,35 +218,62 @@ async def content_file(path: str, auth_claims: dict[str, Any]):
         path_parts = path.rsplit("#page=", 1)
         path = path_parts[0]
     current_app.logger.info("Opening file %s", path)
-    blob_manager: BlobManager = current_app.config[CONFIG_GLOBAL_BLOB_MANAGER]
-
-    # Get bytes and properties from the blob manager
-    result = await blob_manager.download_blob(path)
-
-    if result is None:
-        current_app.logger.info("Path not found in general Blob container: %s", path)
-        if current_app.config[CONFIG_USER_UPLOAD_ENABLED]:
-            user_oid = auth_claims["oid"]
-            user_blob_manager: AdlsBlobManager = current_app.config[CONFIG_USER_BLOB_MANAGER]
-            result = await user_blob_manager.download_blob(path, user_oid=user_oid)
-            if result is None:
-                current_app.logger.exception("Path not found in DataLake: %s", path)
+    blob_managers = content_blob_managers(auth_claims)
+
+    offset: Optional[int] = None
+    length: Optional[int] = None
+    if request.range or request.if_none_match or request.if_modified_since:
+        # Check the properties first, so that unchanged files aren't downloaded and ranges can be checked against the size
+        for blob_manager, user_oid in blob_managers:
+            if properties := await blob_manager.get_blob_properties(path, user_oid=user_oid):
+                blob_managers = [(blob_manager, user_oid)]
+                break
+        else:
+            abort(404)
+
+        if is_content_not_modified(properties):
+            response = Response(b"", status=304)
+            set_content_validators(response, properties)
+            return response
+
+        size = properties.get("size")
+        # Requests for several ranges are answered with the whole file, which RFC 9110 allows for unsupported ranges
+        requested_range = request.range if request.range and len(request.range.ranges) == 1 else None
+        if requested_range and size is not None and is_content_range_current(properties):
+            content_range = requested_range.range_for_length(size)
+            if content_range is None:
+                response = Response(b"", status=416)
+                response.content_range = ContentRange("bytes", None, None, size)
+                return response
+            offset, stop = content_range
+            length = stop - offset
+
+    result = None
+    for blob_manager, user_oid in blob_managers:
+        result = await blob_manager.open_blob(path, user_oid=user_oid, offset=offset, length=length)
+        if result is not None:
+            break
+        current_app.logger.info("Path not found in %s: %s", type(blob_manager).__name__, path)
 
     if not result:
         abort(404)
 
-    content, properties = result
-
-    if not properties or "content_settings" not in properties:
-        abort(404)
+    chunks, properties = result
 
     mime_type = properties["content_settings"]["content_type"]
     if mime_type == "application/octet-stream":
         mime_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
 
-    # Create a BytesIO object from the bytes
-    blob_file = io.BytesIO(content)
-    return await send_file(blob_file, mimetype=mime_type, as_attachment=False, attachment_filename=path)
+    response = Response(chunks, status=200 if offset is None else 206, mimetype=mime_type)
+    set_content_validators(response, properties)
+    response.accept_ranges = "bytes"
+    size = properties.get("size")
+    if offset is not None and length is not None and size is not None:
+        response.content_range = ContentRange("bytes", offset, offset + length, size)
+        response.content_length = length
+    elif size is not None:
+        response.content_length = size
+    return response
 
 
 @bp.route("/ask", methods=["POST"])
@@ -195,17 +294,101 @@ async def ask(auth_claims: dict[str, Any]):
         return error_response(error, "/ask")
 
 
+def json_default(o: Any) -> Any:
+    if isinstance(o, Document):
+        # Search results in the thought process are only serialized when the response is encoded
+        return o.serialize_for_results()
+    if dataclasses.is_dataclass(o) and not isinstance(o, type):
+        # Nested dataclasses are converted when the encoder reaches them, avoiding the deep copy of asdict
+        return {field.name: getattr(o, field.name) for field in dataclasses.fields(o)}
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
 class JSONEncoder(json.JSONEncoder):
     def default(self, o):
-        if dataclasses.is_dataclass(o) and not isinstance(o, type):
-            return dataclasses.asdict(o)
-        return super().default(o)
+        return json_default(o)
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Encodes the responses returned with jsonify, like JSONEncoder does for streamed responses."""
+
+    @staticmethod
+    def default(o: Any) -> Any:
+        try:
+            return json_default(o)
+        except TypeError:
+            # Dates, UUIDs and the other types that Quart supports
+            return DefaultJSONProvider.default(o)
+
+
+class NDJSONEncoder:
+    """
+    Encodes the events of a single response stream as lines of JSON, with the same output as json.dumps.
+
+    The context of a chat response is sent with the first event, and again with the token usage
+    and the follow-up questions. Its data points and thought descriptions (which hold the full prompt,
+    including any images as data URIs) don't change during the stream, so they are only encoded once.
+    """
+
+    def __init__(self):
+        self.encoder = JSONEncoder(ensure_ascii=False)
+        self.encoded: dict[int, tuple[Any, str]] = {}
+
+    def encode(self, event: dict[str, Any]) -> str:
+        if "context" not in event:
+            # Fast path for the events that carry the answer content
+            return self.encoder.encode(event) + "\n"
+        return self.encode_members((key, self.encode_value(value)) for key, value in event.items()) + "\n"
+
+    def encode_members(self, members: Iterable[tuple[str, str]]) -> str:
+        return "{" + ", ".join(f"{self.encoder.encode(key)}: {encoded}" for key, encoded in members) + "}"
+
+    def encode_value(self, value: Any) -> str:
+        if isinstance(value, ExtraInfo):
+            return self.encode_members(
+                (field.name, self.encode_extra_info_field(field.name, getattr(value, field.name)))
+                for field in dataclasses.fields(value)
+            )
+        if isinstance(value, dict) and "context" in value:
+            # The event with the follow-up questions nests the context of the first event
+            return self.encode_members((key, self.encode_value(item)) for key, item in value.items())
+        return self.encoder.encode(value)
+
+    def encode_extra_info_field(self, name: str, value: Any) -> str:
+        if name == "data_points":
+            return self.encode_once(value)
+        if name == "thoughts":
+            return "[" + ", ".join(self.encode_thought(thought) for thought in value) + "]"
+        return self.encoder.encode(value)
+
+    def encode_thought(self, thought: ThoughtStep) -> str:
+        # The props are encoded every time, as the token usage is added to them once the answer is complete
+        if isinstance(thought.description, (list, dict)):
+            description = self.encode_once(thought.description)
+        else:
+            description = self.encoder.encode(thought.description)
+        return self.encode_members(
+            [
+                ("title", self.encoder.encode(thought.title)),
+                ("description", description),
+                ("props", self.encoder.encode(thought.props)),
+            ]
+        )
+
+    def encode_once(self, value: Any) -> str:
+        # Values are kept alongside their encoding, so that their ids can't be reused while the stream is open
+        cached_value, encoded = self.encoded.get(id(value), (None, ""))
+        if cached_value is not value:
+            encoded = self.encoder.encode(value)
+            self.encoded[id(value)] = (value, encoded)
+        return encoded
 
 
 async def format_as_ndjson(r: AsyncGenerator[dict, None]) -> AsyncGenerator[str, None]:
+    encoder = NDJSONEncoder()
     try:
         async for event in r:
-            yield json.dumps(event, ensure_ascii=False, cls=JSONEncoder) + "\n"
+            yield encoder.encode(event)
     except Exception as error:
         logging.exception("Exception while generating response stream: %s", error)
         yield json.dumps(error_dict(error))
@@ -362,20 +545,34 @@ async def upload(auth_claims: dict[str, Any]):
         file = request_files.getlist("file")[0]
         adls_manager: AdlsBlobManager = current_app.config[CONFIG_USER_BLOB_MANAGER]
         file_url = await adls_manager.upload_blob(file, file.filename, user_oid)
-        ingester: UploadUserFileStrategy = current_app.config[CONFIG_INGESTER]
-        await ingester.add_file(File(content=file, url=file_url, acls={"oids": [user_oid]}), user_oid=user_oid)
-        return jsonify({"message": "File uploaded successfully"}), 200
+        upload_jobs: UploadJobs = current_app.config[CONFIG_UPLOAD_JOBS]
+        # The file is parsed, embedded and indexed in the background, so the request doesn't wait for it
+        job = await upload_jobs.submit(user_oid, file.filename, url=file_url)
+        return jsonify({"message": "File uploaded successfully", **job.to_dict()}), 202
     except Exception as error:
         current_app.logger.error("Error uploading file: %s", error)
         return jsonify({"message": "Error uploading file, check server logs for details.", "status": "failed"}), 500
 
 
+@bp.get("/upload_status/<job_id>")
+@authenticated
+async def upload_status(auth_claims: dict[str, Any], job_id: str):
+    upload_jobs: UploadJobs = current_app.config[CONFIG_UPLOAD_JOBS]
+    job = await upload_jobs.get(job_id, auth_claims["oid"])
+    if job is None:
+        return jsonify({"message": "Upload job not found", "status": "failed"}), 404
+    return jsonify(job.to_dict()), 200
+
+
 @bp.post("/delete_uploaded")
 @authenticated
 async def delete_uploaded(auth_claims: dict[str, Any]):
     request_json = await request.get_json()
     filename = request_json.get("filename")
     user_oid = auth_claims["oid"]
+    upload_jobs: UploadJobs = current_app.config[CONFIG_UPLOAD_JOBS]
+    # Jobs still ingesting the file would otherwise index it again after it's removed
+    await upload_jobs.cancel(user_oid, filename)
     adls_manager: AdlsBlobManager = current_app.config[CONFIG_USER_BLOB_MANAGER]
     await adls_manager.remove_blob(filename, user_oid)
     ingester: UploadUserFileStrategy = current_app.config[CONFIG_INGESTER]
@@ -464,6 +661,10 @@ async def setup_clients():
     RAG_SEND_TEXT_SOURCES = os.getenv("RAG_SEND_TEXT_SOURCES", "true").lower() == "true"
     RAG_SEND_IMAGE_SOURCES = os.getenv("RAG_SEND_IMAGE_SOURCES", "true").lower() == "true"
     USE_USER_UPLOAD = os.getenv("USE_USER_UPLOAD", "").lower() == "true"
+    # Uploaded files are ingested by this many background workers per process
+    UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS") or 2)
+    # The job log is a SQLite file shared by the app's worker processes, in the temp directory unless set
+    UPLOAD_JOB_LOG_PATH = os.getenv("UPLOAD_JOB_LOG_PATH") or DEFAULT_JOB_LOG_PATH
     ENABLE_LANGUAGE_PICKER = os.getenv("ENABLE_LANGUAGE_PICKER", "").lower() == "true"
     USE_SPEECH_INPUT_BROWSER = os.getenv("USE_SPEECH_INPUT_BROWSER", "").lower() == "true"
     USE_SPEECH_OUTPUT_BROWSER = os.getenv("USE_SPEECH_OUTPUT_BROWSER", "").lower() == "true"
@@ -471,6 +672,38 @@ async def setup_clients():
     USE_CHAT_HISTORY_BROWSER = os.getenv("USE_CHAT_HISTORY_BROWSER", "").lower() == "true"
     USE_CHAT_HISTORY_COSMOS = os.getenv("USE_CHAT_HISTORY_COSMOS", "").lower() == "true"
     USE_AGENTIC_RETRIEVAL = os.getenv("USE_AGENTIC_RETRIEVAL", "").lower() == "true"
+    USE_ANSWER_CACHE = os.getenv("USE_ANSWER_CACHE", "").lower() == "true"
+    # Uploads and deletions invalidate the answer cache, but other changes to the index (such as ACL changes
+    # with manageacl, or documents indexed by prepdocs) are only picked up once cached answers expire
+    ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS") or 300)
+    ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES") or 1000)
+    ANSWER_CACHE_SIMILARITY_THRESHOLD = os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD")
+    ANSWER_CACHE_REDIS_URL = os.getenv("ANSWER_CACHE_REDIS_URL")
+    QUERY_REWRITE_MODE = os.getenv("QUERY_REWRITE_MODE", "always").lower()
+    USE_SPECULATIVE_RETRIEVAL = os.getenv("USE_SPECULATIVE_RETRIEVAL", "").lower() == "true"
+    USE_EMBEDDING_CACHE = os.getenv("USE_EMBEDDING_CACHE", "true").lower() == "true"
+    EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES") or 1000)
+    USE_IMAGE_CACHE = os.getenv("USE_IMAGE_CACHE", "true").lower() == "true"
+    IMAGE_CACHE_MAX_MB = float(os.getenv("IMAGE_CACHE_MAX_MB") or 64)
+    IMAGE_CACHE_REVALIDATE_SECONDS = float(os.getenv("IMAGE_CACHE_REVALIDATE_SECONDS") or 300)
+    USE_BLOB_CACHE = os.getenv("USE_BLOB_CACHE", "").lower() == "true"
+    BLOB_CACHE_MAX_MB = float(os.getenv("BLOB_CACHE_MAX_MB") or 64)
+    BLOB_CACHE_MAX_BLOB_MB = float(os.getenv("BLOB_CACHE_MAX_BLOB_MB") or 8)
+    BLOB_CACHE_REVALIDATE_SECONDS = float(os.getenv("BLOB_CACHE_REVALIDATE_SECONDS") or 60)
+    # Blobs are also cached on disk when set, such as on a local disk that's kept across restarts
+    BLOB_CACHE_DIRECTORY = os.getenv("BLOB_CACHE_DIRECTORY")
+    BLOB_CACHE_MAX_DISK_MB = float(os.getenv("BLOB_CACHE_MAX_DISK_MB") or 1024)
+    # Token budget for the text sources in the answer prompt, which should leave room in the chat model's context window
+    CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET") or 0)
+    USE_SEARCH_CACHE = os.getenv("USE_SEARCH_CACHE", "").lower() == "true"
+    SEARCH_CACHE_TTL_SECONDS = float(os.getenv("SEARCH_CACHE_TTL_SECONDS") or 30)
+    SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES") or 1000)
+    # How long the decision whether a user may access a file is reused, set to 0 to check every request
+    PATH_AUTH_CACHE_TTL_SECONDS = float(os.getenv("PATH_AUTH_CACHE_TTL_SECONDS") or 60)
+    # How long the owner of a user's upload directory is trusted before checking it again, 0 to check every time
+    USER_DIRECTORY_CACHE_TTL_SECONDS = float(os.getenv("USER_DIRECTORY_CACHE_TTL_SECONDS") or 300)
+    # Stage timings are always recorded as metrics, this also adds them to the thought process of each answer
+    INCLUDE_STAGE_TIMINGS = os.getenv("INCLUDE_STAGE_TIMINGS", "").lower() == "true"
 
     # WEBSITE_HOSTNAME is always set by App Service, RUNNING_IN_PRODUCTION is set in main.bicep
     RUNNING_ON_AZURE = os.getenv("WEBSITE_HOSTNAME") is not None or os.getenv("RUNNING_IN_PRODUCTION") is not None
@@ -517,12 +750,24 @@ async def setup_clients():
         endpoint=AZURE_SEARCH_ENDPOINT, agent_name=AZURE_SEARCH_AGENT, credential=azure_credential
     )
 
+    # Frequently cited documents and images are shared by the global and user blob managers' cache
+    blob_cache = None
+    if USE_BLOB_CACHE:
+        blob_cache = BlobCache(
+            max_bytes=int(BLOB_CACHE_MAX_MB * 1024 * 1024),
+            max_blob_bytes=int(BLOB_CACHE_MAX_BLOB_MB * 1024 * 1024),
+            revalidate_seconds=BLOB_CACHE_REVALIDATE_SECONDS,
+            directory=BLOB_CACHE_DIRECTORY,
+            max_disk_bytes=int(BLOB_CACHE_MAX_DISK_MB * 1024 * 1024),
+        )
+
     # Set up the global blob storage manager (used for global content/images, but not user uploads)
     global_blob_manager = BlobManager(
         endpoint=f"https://{AZURE_STORAGE_ACCOUNT}.blob.core.windows.net",
         credential=azure_credential,
         container=AZURE_STORAGE_CONTAINER,
         image_container=AZURE_IMAGESTORAGE_CONTAINER,
+        blob_cache=blob_cache,
     )
     current_app.config[CONFIG_GLOBAL_BLOB_MANAGER] = global_blob_manager
 
@@ -546,6 +791,7 @@ async def setup_clients():
         require_access_control=AZURE_ENFORCE_ACCESS_CONTROL,
         enable_global_documents=AZURE_ENABLE_GLOBAL_DOCUMENT_ACCESS,
         enable_unauthenticated_access=AZURE_ENABLE_UNAUTHENTICATED_ACCESS,
+        path_auth_cache_ttl_seconds=PATH_AUTH_CACHE_TTL_SECONDS,
     )
 
     if USE_SPEECH_OUTPUT_AZURE:
@@ -571,6 +817,32 @@ async def setup_clients():
         openai_organization=OPENAI_ORGANIZATION,
     )
 
+    search_cache: Optional[SearchResultCache[Document]] = None
+    if USE_SEARCH_CACHE:
+        current_app.logger.info(
+            "USE_SEARCH_CACHE is true, caching search results for %s seconds", SEARCH_CACHE_TTL_SECONDS
+        )
+        search_cache = SearchResultCache(max_entries=SEARCH_CACHE_MAX_ENTRIES, ttl_seconds=SEARCH_CACHE_TTL_SECONDS)
+
+    answer_cache = None
+    if USE_ANSWER_CACHE:
+        answer_cache_backend: AnswerCacheBackend
+        if ANSWER_CACHE_REDIS_URL:
+            current_app.logger.info("USE_ANSWER_CACHE is true, caching answers in Redis")
+            answer_cache_backend = RedisAnswerCacheBackend(Redis.from_url(ANSWER_CACHE_REDIS_URL))
+        else:
+            current_app.logger.info("USE_ANSWER_CACHE is true, caching answers in memory")
+            answer_cache_backend = InMemoryAnswerCacheBackend(max_entries=ANSWER_CACHE_MAX_ENTRIES)
+        answer_cache = AnswerCache(
+            backend=answer_cache_backend,
+            ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+            similarity_threshold=(
+                float(ANSWER_CACHE_SIMILARITY_THRESHOLD) if ANSWER_CACHE_SIMILARITY_THRESHOLD else None
+            ),
+            max_similarity_entries=ANSWER_CACHE_MAX_ENTRIES,
+        )
+    current_app.config[CONFIG_ANSWER_CACHE] = answer_cache
+
     user_blob_manager = None
     if USE_USER_UPLOAD:
         current_app.logger.info("USE_USER_UPLOAD is true, setting up user upload feature")
@@ -582,6 +854,8 @@ async def setup_clients():
             endpoint=f"https://{AZURE_USERSTORAGE_ACCOUNT}.dfs.core.windows.net",
             container=AZURE_USERSTORAGE_CONTAINER,
             credential=azure_credential,
+            blob_cache=blob_cache,
+            directory_cache_ttl_seconds=USER_DIRECTORY_CACHE_TTL_SECONDS,
         )
         current_app.config[CONFIG_USER_BLOB_MANAGER] = user_blob_manager
 
@@ -620,6 +894,20 @@ async def setup_clients():
             vision_endpoint=AZURE_VISION_ENDPOINT,
             use_multimodal=USE_MULTIMODAL,
         )
+
+        answer_cache_invalidations: set[asyncio.Task] = set()
+
+        def on_content_changed():
+            # Uploaded and removed files change search results and who can access them, so cached results are discarded
+            if search_cache:
+                search_cache.invalidate()
+            auth_helper.invalidate_path_auth()
+            if answer_cache:
+                # Cached answers cite the changed content too. With Redis, this invalidates them in every worker.
+                invalidation = asyncio.create_task(answer_cache.invalidate())
+                answer_cache_invalidations.add(invalidation)
+                invalidation.add_done_callback(answer_cache_invalidations.discard)
+
         ingester = UploadUserFileStrategy(
             search_info=search_info,
             file_processors=file_processors,
@@ -627,9 +915,26 @@ async def setup_clients():
             image_embeddings=image_embeddings_service,
             search_field_name_embedding=AZURE_SEARCH_FIELD_NAME_EMBEDDING,
             blob_manager=user_blob_manager,
+            on_content_changed=on_content_changed,
         )
         current_app.config[CONFIG_INGESTER] = ingester
 
+        async def ingest_upload(job: UploadJob):
+            await ingester.add_uploaded_file(
+                job.filename, user_oid=job.user_oid, url=job.url, is_cancelled=lambda: upload_jobs.is_cancelled(job)
+            )
+
+        async def remove_upload(job: UploadJob):
+            await ingester.remove_file(job.filename, job.user_oid)
+
+        if UPLOAD_JOB_LOG_PATH == ":memory:":
+            current_app.logger.warning(
+                "UPLOAD_JOB_LOG_PATH is :memory:, so the status of upload jobs is only known to the process running them"
+            )
+        upload_jobs = UploadJobs(ingest_upload, remove_upload, workers=UPLOAD_WORKERS, log_path=UPLOAD_JOB_LOG_PATH)
+        await upload_jobs.start()
+        current_app.config[CONFIG_UPLOAD_JOBS] = upload_jobs
+
     image_embeddings_client = None
     if USE_MULTIMODAL:
         image_embeddings_client = ImageEmbeddings(AZURE_VISION_ENDPOINT, azure_ai_token_provider)
@@ -664,6 +969,22 @@ async def setup_clients():
     current_app.config[CONFIG_RAG_SEND_TEXT_SOURCES] = RAG_SEND_TEXT_SOURCES
     current_app.config[CONFIG_RAG_SEND_IMAGE_SOURCES] = RAG_SEND_IMAGE_SOURCES
 
+    # Query embeddings are deterministic, so repeated queries can reuse them for the lifetime of the process
+    embedding_cache = EmbeddingCache(max_entries=EMBEDDING_CACHE_MAX_ENTRIES) if USE_EMBEDDING_CACHE else None
+
+    image_cache = None
+    if USE_MULTIMODAL and USE_IMAGE_CACHE:
+        image_cache = ImageSourceCache(
+            max_bytes=int(IMAGE_CACHE_MAX_MB * 1024 * 1024), revalidate_seconds=IMAGE_CACHE_REVALIDATE_SECONDS
+        )
+
+    context_packer = None
+    if CONTEXT_TOKEN_BUDGET:
+        current_app.logger.info(
+            "CONTEXT_TOKEN_BUDGET is set, packing text sources into %d tokens", CONTEXT_TOKEN_BUDGET
+        )
+        context_packer = ContextPacker(model=OPENAI_CHATGPT_MODEL, token_budget=CONTEXT_TOKEN_BUDGET)
+
     prompt_manager = PromptyManager()
 
     # Set up the two default RAG approaches for /ask and /chat
@@ -693,6 +1014,12 @@ async def setup_clients():
         image_embeddings_client=image_embeddings_client,
         global_blob_manager=global_blob_manager,
         user_blob_manager=user_blob_manager,
+        answer_cache=answer_cache,
+        embedding_cache=embedding_cache,
+        image_cache=image_cache,
+        context_packer=context_packer,
+        search_cache=search_cache,
+        include_stage_timings=INCLUDE_STAGE_TIMINGS,
     )
 
     # ChatReadRetrieveReadApproach is used by /chat for multi-turn conversation
@@ -720,6 +1047,14 @@ async def setup_clients():
         image_embeddings_client=image_embeddings_client,
         global_blob_manager=global_blob_manager,
         user_blob_manager=user_blob_manager,
+        answer_cache=answer_cache,
+        embedding_cache=embedding_cache,
+        image_cache=image_cache,
+        context_packer=context_packer,
+        search_cache=search_cache,
+        include_stage_timings=INCLUDE_STAGE_TIMINGS,
+        speculative_retrieval=USE_SPECULATIVE_RETRIEVAL,
+        query_rewrite_mode=QUERY_REWRITE_MODE,
     )
 
 
@@ -727,12 +1062,18 @@ async def setup_clients():
 async def close_clients():
     await current_app.config[CONFIG_SEARCH_CLIENT].close()
     await current_app.config[CONFIG_GLOBAL_BLOB_MANAGER].close_clients()
+    await current_app.config[CONFIG_AUTH_CLIENT].close()
     if user_blob_manager := current_app.config.get(CONFIG_USER_BLOB_MANAGER):
         await user_blob_manager.close_clients()
+    if upload_jobs := current_app.config.get(CONFIG_UPLOAD_JOBS):
+        await upload_jobs.close()
+    if answer_cache := current_app.config.get(CONFIG_ANSWER_CACHE):
+        await answer_cache.close()
 
 
 def create_app():
     app = Quart(__name__)
+    app.json = JSONProvider(app)
     app.register_blueprint(bp)
     app.register_blueprint(chat_history_cosmosdb_bp)
 
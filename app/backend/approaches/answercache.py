@@ -0,0 +1,259 @@
+import dataclasses
+import hashlib
+import json
+import math
+import re
+from abc import ABC
+from collections.abc import Awaitable
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+from opentelemetry import metrics
+from redis.asyncio import Redis
+
+from core.cache import CacheStats, TTLCache
+
+meter = metrics.get_meter(__name__)
+answer_cache_lookups = meter.create_counter(
+    "answer_cache.lookups", description="Answer cache lookups, labelled by result (exact, similar or miss)"
+)
+
+# Overrides that only affect how the response is delivered, not its content
+NON_SEMANTIC_OVERRIDES = {"use_answer_cache"}
+
+
+def normalize_question(question: str) -> str:
+    """Lowercases the question, collapses whitespace and drops trailing punctuation."""
+    return re.sub(r"\s+", " ", question).strip().lower().rstrip("?!.。？！ ")
+
+
+def to_jsonable(value: Any) -> Any:
+    """
+    Converts dataclasses (such as ExtraInfo and ThoughtStep) and search results nested in dicts and lists
+    to plain JSON values.
+    """
+    if hasattr(value, "serialize_for_results"):
+        return to_jsonable(value.serialize_for_results())
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return {field.name: to_jsonable(getattr(value, field.name)) for field in dataclasses.fields(value)}
+    if isinstance(value, dict):
+        return {key: to_jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(item) for item in value]
+    return value
+
+
+def cosine_similarity(a: list[float], b: list[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class AnswerCacheBackend(ABC):
+    """
+    Storage for cached answers. Values are JSON-compatible dictionaries.
+    """
+
+    async def get(self, key: str) -> Optional[dict[str, Any]]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: dict[str, Any], ttl_seconds: float):
+        raise NotImplementedError
+
+    async def delete(self, key: str):
+        raise NotImplementedError
+
+    async def generation(self) -> int:
+        """Returns the current generation of the cache, which is part of every key"""
+        raise NotImplementedError
+
+    async def invalidate(self):
+        """Starts a new generation, so that answers cached before it are no longer served"""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class InMemoryAnswerCacheBackend(AnswerCacheBackend):
+    """
+    Stores answers in the memory of the current process, evicting the least recently used answers
+    once max_entries is reached.
+    """
+
+    def __init__(self, max_entries: int = 1000):
+        self.cache: TTLCache[str, dict[str, Any]] = TTLCache(max_entries=max_entries)
+        self.current_generation = 0
+
+    async def get(self, key: str) -> Optional[dict[str, Any]]:
+        return self.cache.get(key)
+
+    async def set(self, key: str, value: dict[str, Any], ttl_seconds: float):
+        self.cache.set(key, value, ttl_seconds=ttl_seconds)
+
+    async def delete(self, key: str):
+        self.cache.pop(key)
+
+    async def generation(self) -> int:
+        return self.current_generation
+
+    async def invalidate(self):
+        self.current_generation += 1
+        self.cache.clear()
+
+
+class RedisAnswerCacheBackend(AnswerCacheBackend):
+    """
+    Stores answers in any server that speaks the Redis protocol (such as Azure Cache for Redis),
+    so that answers are shared across workers and replicas.
+    Configure the server with an LRU maxmemory-policy (such as allkeys-lru) to bound its memory use.
+    The generation is kept in the server too, so that invalidating the cache in one worker invalidates it in all,
+    and the answers of past generations are left to expire.
+    """
+
+    def __init__(self, client: Redis, key_prefix: str = "answer-cache:"):
+        self.client = client
+        self.key_prefix = key_prefix
+
+    async def get(self, key: str) -> Optional[dict[str, Any]]:
+        value = await self.client.get(self.key_prefix + key)
+        if value is None:
+            return None
+        return json.loads(value)
+
+    async def set(self, key: str, value: dict[str, Any], ttl_seconds: float):
+        await self.client.set(self.key_prefix + key, json.dumps(value), px=int(ttl_seconds * 1000))
+
+    async def delete(self, key: str):
+        await self.client.delete(self.key_prefix + key)
+
+    async def generation(self) -> int:
+        value = await self.client.get(self.key_prefix + "generation")
+        return int(value) if value is not None else 0
+
+    async def invalidate(self):
+        await self.client.incr(self.key_prefix + "generation")
+
+    async def close(self):
+        await self.client.aclose()
+
+
+@dataclass
+class AnswerCacheLookup:
+    scope: str
+    question: str
+    key: str
+    answer: Optional[dict[str, Any]] = None
+    match: Optional[str] = None
+    similarity: Optional[float] = None
+    vector: Optional[list[float]] = None
+
+
+class AnswerCache:
+    """
+    Caches final answers from the RAG approaches so that repeated questions skip query rewriting,
+    retrieval and answer generation.
+
+    Answers are partitioned into scopes. A scope combines the approach, the past messages, the overrides
+    and the search filter built for the caller (which contains the caller's security filter), so an answer
+    is only ever served to callers that would have retrieved exactly the same sources.
+    Within a scope, answers are found either by exact match on the normalized question or, if a
+    similarity_threshold is set, by cosine similarity between question embeddings.
+    The similarity index is kept in the memory of each process, even when the answers live in Redis.
+
+    Scopes also include the generation of the backend, so invalidate() discards every cached answer,
+    such as when indexed content changes. Changes the app doesn't make itself (such as ACL changes with
+    manageacl, or documents indexed by prepdocs) are only picked up once the cached answers expire.
+    """
+
+    def __init__(
+        self,
+        backend: AnswerCacheBackend,
+        ttl_seconds: float = 300,
+        similarity_threshold: Optional[float] = None,
+        max_similarity_entries: int = 1000,
+    ):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.max_similarity_entries = max_similarity_entries
+        self.stats = CacheStats()
+        # Maps scope -> {exact key -> question embedding}
+        self.similarity_index: TTLCache[str, dict[str, list[float]]] = TTLCache(
+            max_entries=max_similarity_entries, ttl_seconds=ttl_seconds
+        )
+
+    @staticmethod
+    def build_scope(
+        approach: str,
+        past_messages: list[Any],
+        overrides: dict[str, Any],
+        search_filter: Optional[str],
+        user_oid: Optional[str] = None,
+    ) -> str:
+        scope = {
+            "approach": approach,
+            "past_messages": past_messages,
+            "overrides": {key: value for key, value in overrides.items() if key not in NON_SEMANTIC_OVERRIDES},
+            "filter": search_filter,
+            "oid": user_oid,
+        }
+        return hashlib.sha256(json.dumps(scope, sort_keys=True, default=str).encode()).hexdigest()
+
+    @staticmethod
+    def build_key(scope: str, question: str) -> str:
+        return hashlib.sha256(f"{scope}\n{question}".encode()).hexdigest()
+
+    async def lookup(
+        self,
+        scope: str,
+        question: str,
+        embed: Optional[Callable[[str], Awaitable[list[float]]]] = None,
+    ) -> AnswerCacheLookup:
+        normalized = normalize_question(question)
+        scope = f"{await self.backend.generation()}:{scope}"
+        lookup = AnswerCacheLookup(scope=scope, question=normalized, key=self.build_key(scope, normalized))
+
+        lookup.answer = await self.backend.get(lookup.key)
+        if lookup.answer is not None:
+            lookup.match = "exact"
+        elif self.similarity_threshold is not None and embed is not None:
+            lookup.vector = await embed(normalized)
+            best_key, best_similarity = None, self.similarity_threshold
+            for key, vector in (self.similarity_index.get(scope) or {}).items():
+                similarity = cosine_similarity(lookup.vector, vector)
+                if similarity >= best_similarity:
+                    best_key, best_similarity = key, similarity
+            if best_key is not None:
+                lookup.answer = await self.backend.get(best_key)
+                if lookup.answer is not None:
+                    lookup.match = "similar"
+                    lookup.similarity = best_similarity
+                else:
+                    # The answer expired or was evicted from the backend, so forget its embedding too
+                    (self.similarity_index.get(scope) or {}).pop(best_key, None)
+
+        if lookup.answer is None:
+            self.stats.misses += 1
+        else:
+            self.stats.hits += 1
+        answer_cache_lookups.add(1, {"result": lookup.match or "miss"})
+        return lookup
+
+    async def store(self, lookup: AnswerCacheLookup, answer: dict[str, Any]):
+        await self.backend.set(lookup.key, to_jsonable(answer), self.ttl_seconds)
+        if lookup.vector is not None:
+            scope_index = self.similarity_index.get(lookup.scope)
+            if scope_index is None:
+                scope_index = {}
+                self.similarity_index.set(lookup.scope, scope_index)
+            if len(scope_index) >= self.max_similarity_entries:
+                scope_index.pop(next(iter(scope_index)))
+            scope_index[lookup.key] = lookup.vector
+
+    async def invalidate(self):
+        await self.backend.invalidate()
+        self.similarity_index.clear()
+
+    async def close(self):
+        await self.backend.close()
@@ -1,3 +1,4 @@
+import asyncio
 import base64
 from abc import ABC
 from collections.abc import AsyncGenerator, Awaitable
@@ -31,26 +32,76 @@ from openai.types.chat import (
     ChatCompletionToolParam,
 )
 
+from approaches.answercache import AnswerCache, AnswerCacheLookup
+from approaches.contextpacker import ContextPacker
+from approaches.embeddingcache import EmbeddingCache
+from approaches.imagecache import ImageSourceCache
 from approaches.promptmanager import PromptManager
+from approaches.searchcache import SearchResultCache
+from approaches.stagetimings import StageTimings, measure_stage
 from core.authentication import AuthenticationHelper
-from prepdocslib.blobmanager import AdlsBlobManager, BlobManager
+from prepdocslib.blobmanager import AdlsBlobManager, BaseBlobManager, BlobManager
 from prepdocslib.embeddings import ImageEmbeddings
 
 
-@dataclass
 class Document:
-    id: Optional[str] = None
-    content: Optional[str] = None
-    category: Optional[str] = None
-    sourcepage: Optional[str] = None
-    sourcefile: Optional[str] = None
-    oids: Optional[list[str]] = None
-    groups: Optional[list[str]] = None
-    captions: Optional[list[QueryCaptionResult]] = None
-    score: Optional[float] = None
-    reranker_score: Optional[float] = None
-    search_agent_query: Optional[str] = None
-    images: Optional[list[dict[str, Any]]] = None
+    """
+    A search result. One is created for every hit of every search, so the fields are slotted
+    rather than kept in a per-instance dict. Results are only serialized (with serialize_for_results)
+    when the response that includes them is encoded.
+    """
+
+    __slots__ = (
+        "id",
+        "content",
+        "category",
+        "sourcepage",
+        "sourcefile",
+        "oids",
+        "groups",
+        "captions",
+        "score",
+        "reranker_score",
+        "search_agent_query",
+        "images",
+    )
+
+    def __init__(
+        self,
+        id: Optional[str] = None,
+        content: Optional[str] = None,
+        category: Optional[str] = None,
+        sourcepage: Optional[str] = None,
+        sourcefile: Optional[str] = None,
+        oids: Optional[list[str]] = None,
+        groups: Optional[list[str]] = None,
+        captions: Optional[list[QueryCaptionResult]] = None,
+        score: Optional[float] = None,
+        reranker_score: Optional[float] = None,
+        search_agent_query: Optional[str] = None,
+        images: Optional[list[dict[str, Any]]] = None,
+    ):
+        self.id = id
+        self.content = content
+        self.category = category
+        self.sourcepage = sourcepage
+        self.sourcefile = sourcefile
+        self.oids = oids
+        self.groups = groups
+        self.captions = captions
+        self.score = score
+        self.reranker_score = reranker_score
+        self.search_agent_query = search_agent_query
+        self.images = images
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Document):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"Document({fields})"
 
     def serialize_for_results(self) -> dict[str, Any]:
         result_dict = {
@@ -91,6 +142,10 @@ class ThoughtStep:
         if self.props:
             self.props["token_usage"] = TokenUsageProps.from_completion_usage(usage)
 
+    def update_stage_timings(self, timings: StageTimings) -> None:
+        if self.props is not None:
+            self.props["stage_timings_ms"] = timings.as_props()
+
 
 @dataclass
 class DataPoints:
@@ -147,6 +202,8 @@ class Approach(ABC):
     # Set a higher token limit for GPT reasoning models
     RESPONSE_DEFAULT_TOKEN_LIMIT = 1024
     RESPONSE_REASONING_DEFAULT_TOKEN_LIMIT = 8192
+    # Maximum number of image sources downloaded at the same time for a single request
+    MAX_CONCURRENT_IMAGE_DOWNLOADS = 8
 
     def __init__(
         self,
@@ -166,6 +223,12 @@ class Approach(ABC):
         image_embeddings_client: Optional[ImageEmbeddings] = None,
         global_blob_manager: Optional[BlobManager] = None,
         user_blob_manager: Optional[AdlsBlobManager] = None,
+        answer_cache: Optional[AnswerCache] = None,
+        embedding_cache: Optional[EmbeddingCache] = None,
+        image_cache: Optional[ImageSourceCache] = None,
+        context_packer: Optional[ContextPacker] = None,
+        search_cache: Optional[SearchResultCache[Document]] = None,
+        include_stage_timings: bool = False,
     ):
         self.search_client = search_client
         self.openai_client = openai_client
@@ -184,6 +247,12 @@ class Approach(ABC):
         self.image_embeddings_client = image_embeddings_client
         self.global_blob_manager = global_blob_manager
         self.user_blob_manager = user_blob_manager
+        self.answer_cache = answer_cache
+        self.embedding_cache = embedding_cache
+        self.image_cache = image_cache
+        self.context_packer = context_packer
+        self.search_cache = search_cache
+        self.include_stage_timings = include_stage_timings
 
     def build_filter(self, overrides: dict[str, Any], auth_claims: dict[str, Any]) -> Optional[str]:
         include_category = overrides.get("include_category")
@@ -214,57 +283,76 @@ class Approach(ABC):
     ) -> list[Document]:
         search_text = query_text if use_text_search else ""
         search_vectors = vectors if use_vector_search else []
-        if use_semantic_ranker:
-            results = await self.search_client.search(
-                search_text=search_text,
-                filter=filter,
-                top=top,
-                query_caption="extractive|highlight-false" if use_semantic_captions else None,
-                query_rewrites="generative" if use_query_rewriting else None,
-                vector_queries=search_vectors,
-                query_type=QueryType.SEMANTIC,
-                query_language=self.query_language,
-                query_speller=self.query_speller,
-                semantic_configuration_name="default",
-                semantic_query=query_text,
-            )
-        else:
-            results = await self.search_client.search(
-                search_text=search_text,
-                filter=filter,
-                top=top,
-                vector_queries=search_vectors,
-            )
 
-        documents: list[Document] = []
-        async for page in results.by_page():
-            async for document in page:
-                documents.append(
-                    Document(
-                        id=document.get("id"),
-                        content=document.get("content"),
-                        category=document.get("category"),
-                        sourcepage=document.get("sourcepage"),
-                        sourcefile=document.get("sourcefile"),
-                        oids=document.get("oids"),
-                        groups=document.get("groups"),
-                        captions=cast(list[QueryCaptionResult], document.get("@search.captions")),
-                        score=document.get("@search.score"),
-                        reranker_score=document.get("@search.reranker_score"),
-                        images=document.get("images"),
-                    )
+        async def run_search() -> list[Document]:
+            if use_semantic_ranker:
+                results = await self.search_client.search(
+                    search_text=search_text,
+                    filter=filter,
+                    top=top,
+                    query_caption="extractive|highlight-false" if use_semantic_captions else None,
+                    query_rewrites="generative" if use_query_rewriting else None,
+                    vector_queries=search_vectors,
+                    query_type=QueryType.SEMANTIC,
+                    query_language=self.query_language,
+                    query_speller=self.query_speller,
+                    semantic_configuration_name="default",
+                    semantic_query=query_text,
                 )
-
-            qualified_documents = [
-                doc
-                for doc in documents
-                if (
-                    (doc.score or 0) >= (minimum_search_score or 0)
-                    and (doc.reranker_score or 0) >= (minimum_reranker_score or 0)
+            else:
+                results = await self.search_client.search(
+                    search_text=search_text,
+                    filter=filter,
+                    top=top,
+                    vector_queries=search_vectors,
                 )
-            ]
 
-        return qualified_documents
+            documents: list[Document] = []
+            async for page in results.by_page():
+                async for document in page:
+                    documents.append(
+                        Document(
+                            id=document.get("id"),
+                            content=document.get("content"),
+                            category=document.get("category"),
+                            sourcepage=document.get("sourcepage"),
+                            sourcefile=document.get("sourcefile"),
+                            oids=document.get("oids"),
+                            groups=document.get("groups"),
+                            captions=cast(list[QueryCaptionResult], document.get("@search.captions")),
+                            score=document.get("@search.score"),
+                            reranker_score=document.get("@search.reranker_score"),
+                            images=document.get("images"),
+                        )
+                    )
+
+                qualified_documents = [
+                    doc
+                    for doc in documents
+                    if (
+                        (doc.score or 0) >= (minimum_search_score or 0)
+                        and (doc.reranker_score or 0) >= (minimum_reranker_score or 0)
+                    )
+                ]
+
+            return qualified_documents
+
+        with measure_stage("search"):
+            if not self.search_cache:
+                return await run_search()
+            cache_key = SearchResultCache.build_key(
+                search_text,
+                filter,
+                search_vectors,
+                top=top,
+                use_semantic_ranker=use_semantic_ranker,
+                semantic_query=query_text if use_semantic_ranker else None,
+                use_semantic_captions=use_semantic_ranker and use_semantic_captions,
+                use_query_rewriting=use_semantic_ranker and bool(use_query_rewriting),
+                minimum_search_score=minimum_search_score or 0,
+                minimum_reranker_score=minimum_reranker_score or 0,
+            )
+            return await self.search_cache.get_or_search(cache_key, run_search)
 
     async def run_agentic_retrieval(
         self,
@@ -277,23 +365,24 @@ class Approach(ABC):
         results_merge_strategy: Optional[str] = None,
     ) -> tuple[KnowledgeAgentRetrievalResponse, list[Document]]:
         # STEP 1: Invoke agentic retrieval
-        response = await agent_client.retrieve(
-            retrieval_request=KnowledgeAgentRetrievalRequest(
-                messages=[
-                    KnowledgeAgentMessage(
-                        role=str(msg["role"]), content=[KnowledgeAgentMessageTextContent(text=str(msg["content"]))]
-                    )
-                    for msg in messages
-                    if msg["role"] != "system"
-                ],
-                knowledge_source_params=[
-                    SearchIndexKnowledgeSourceParams(
-                        knowledge_source_name=search_index_name,
-                        filter_add_on=filter_add_on,
-                    )
-                ],
+        with measure_stage("search"):
+            response = await agent_client.retrieve(
+                retrieval_request=KnowledgeAgentRetrievalRequest(
+                    messages=[
+                        KnowledgeAgentMessage(
+                            role=str(msg["role"]), content=[KnowledgeAgentMessageTextContent(text=str(msg["content"]))]
+                        )
+                        for msg in messages
+                        if msg["role"] != "system"
+                    ],
+                    knowledge_source_params=[
+                        SearchIndexKnowledgeSourceParams(
+                            knowledge_source_name=search_index_name,
+                            filter_add_on=filter_add_on,
+                        )
+                    ],
+                )
             )
-        )
 
         # Map activity id -> agent's internal search query
         activities = response.activity
@@ -372,41 +461,85 @@ class Approach(ABC):
             DataPoints: with text (list[str]), images (list[str - base64 data URI]), citations (list[str]).
         """
 
-        def nonewlines(s: str) -> str:
-            return s.replace("\n", " ").replace("\r", " ")
-
         citations = []
         text_sources = []
-        image_sources = []
+        image_urls = []
         seen_urls = set()
 
-        for doc in results:
-            # Get the citation for the source page
-            citation = self.get_citation(doc.sourcepage)
-            if citation not in citations:
-                citations.append(citation)
-
-            # If semantic captions are used, extract captions; otherwise, use content
-            if include_text_sources:
-                if use_semantic_captions and doc.captions:
-                    text_sources.append(
-                        f"{citation}: {nonewlines(' . '.join([cast(str, c.text) for c in doc.captions]))}"
-                    )
-                else:
-                    text_sources.append(f"{citation}: {nonewlines(doc.content or '')}")
-
-            if download_image_sources and hasattr(doc, "images") and doc.images:
-                for img in doc.images:
-                    # Skip if we've already processed this URL
-                    if img["url"] in seen_urls or not img["url"]:
-                        continue
-                    seen_urls.add(img["url"])
-                    url = await self.download_blob_as_base64(img["url"], user_oid=user_oid)
-                    if url:
-                        image_sources.append(url)
-                    citations.append(self.get_image_citation(doc.sourcepage or "", img["url"]))
+        with measure_stage("source_assembly"):
+            for doc in results:
+                # Get the citation for the source page
+                citation = self.get_citation(doc.sourcepage)
+                if citation not in citations:
+                    citations.append(citation)
+
+                if include_text_sources:
+                    text_sources.append(self.get_text_source(doc, use_semantic_captions))
+
+                if download_image_sources and hasattr(doc, "images") and doc.images:
+                    for img in doc.images:
+                        # Skip if we've already processed this URL
+                        if img["url"] in seen_urls or not img["url"]:
+                            continue
+                        seen_urls.add(img["url"])
+                        image_urls.append(img["url"])
+                        citations.append(self.get_image_citation(doc.sourcepage or "", img["url"]))
+
+        # Download the images concurrently, with a bounded number of downloads in flight
+        download_slots = asyncio.Semaphore(self.MAX_CONCURRENT_IMAGE_DOWNLOADS)
+
+        async def download_image(url: str) -> Optional[str]:
+            async with download_slots:
+                return await self.download_blob_as_base64(url, user_oid=user_oid)
+
+        image_sources: list[str] = []
+        if image_urls:
+            with measure_stage("image_download"):
+                image_sources = [url for url in await asyncio.gather(*map(download_image, image_urls)) if url]
         return DataPoints(text=text_sources, images=image_sources, citations=citations)
 
+    def get_text_source(self, doc: Document, use_semantic_captions: bool) -> str:
+        def nonewlines(s: str) -> str:
+            return s.replace("\n", " ").replace("\r", " ")
+
+        citation = self.get_citation(doc.sourcepage)
+        # If semantic captions are used, extract captions; otherwise, use content
+        if use_semantic_captions and doc.captions:
+            return f"{citation}: {nonewlines(' . '.join([cast(str, c.text) for c in doc.captions]))}"
+        return f"{citation}: {nonewlines(doc.content or '')}"
+
+    def pack_sources(
+        self, results: list[Document], use_semantic_captions: bool, overrides: dict[str, Any]
+    ) -> tuple[list[Document], Optional[ThoughtStep]]:
+        """
+        Keeps the search results whose text sources fit in the token budget of the answer prompt.
+
+        Returns the packed results, from the highest to the lowest reranker score,
+        and a thought step reporting the tokens saved, or None if no context packer is configured.
+        """
+        # Only the text sources are packed, so there's nothing to pack when they aren't sent
+        if not self.context_packer or not results or not overrides.get("send_text_sources", True):
+            return results, None
+        token_budget = overrides.get("context_token_budget") or self.context_packer.token_budget
+        packed = self.context_packer.pack(
+            [self.get_text_source(doc, use_semantic_captions) for doc in results],
+            [doc.reranker_score if doc.reranker_score is not None else doc.score for doc in results],
+            token_budget,
+        )
+        thought = ThoughtStep(
+            "Packed sources into the token budget",
+            [self.get_citation(results[i].sourcepage) for i in packed.duplicates + packed.dropped],
+            {
+                "token_budget": token_budget,
+                "source_tokens": packed.source_tokens,
+                "packed_tokens": packed.packed_tokens,
+                "tokens_saved": packed.tokens_saved,
+                "duplicate_sources": len(packed.duplicates),
+                "dropped_sources": len(packed.dropped),
+            },
+        )
+        return [results[i] for i in packed.indexes], thought
+
     def get_citation(self, sourcepage: Optional[str]):
         return sourcepage or ""
 
@@ -441,17 +574,32 @@ class Approach(ABC):
             blob_path = blob_url
 
         # Download the blob using the appropriate client
-        result = None
+        blob_manager: BaseBlobManager
+        blob_user_oid: Optional[str] = None
         if ".dfs.core.windows.net" in blob_url and self.user_blob_manager:
-            result = await self.user_blob_manager.download_blob(blob_path, user_oid=user_oid)
+            blob_manager, blob_user_oid = self.user_blob_manager, user_oid
         elif self.global_blob_manager:
-            result = await self.global_blob_manager.download_blob(blob_path)
+            blob_manager = self.global_blob_manager
+        else:
+            return None
 
-        if result:
-            content, _ = result  # Unpack the tuple, ignoring properties
+        async def download() -> Optional[tuple[str, Optional[str]]]:
+            result = await blob_manager.download_blob(blob_path, user_oid=blob_user_oid)
+            if not result:
+                return None
+            content, properties = result
             img = base64.b64encode(content).decode("utf-8")
-            return f"data:image/png;base64,{img}"
-        return None
+            return f"data:image/png;base64,{img}", properties.get("etag")
+
+        if self.image_cache:
+            # Images in per-user storage are only cached for the user who is allowed to download them
+            return await self.image_cache.get_or_download(
+                (blob_user_oid or "", blob_url),
+                get_etag=lambda: blob_manager.get_blob_etag(blob_path, user_oid=blob_user_oid),
+                download=download,
+            )
+        result = await download()
+        return result[0] if result else None
 
     async def compute_text_embedding(self, q: str):
         SUPPORTED_DIMENSIONS_MODEL = {
@@ -466,13 +614,19 @@ class Approach(ABC):
         dimensions_args: ExtraArgs = (
             {"dimensions": self.embedding_dimensions} if SUPPORTED_DIMENSIONS_MODEL[self.embedding_model] else {}
         )
-        embedding = await self.openai_client.embeddings.create(
-            # Azure OpenAI takes the deployment name as the model name
-            model=self.embedding_deployment if self.embedding_deployment else self.embedding_model,
-            input=q,
-            **dimensions_args,
-        )
-        query_vector = embedding.data[0].embedding
+        # Azure OpenAI takes the deployment name as the model name
+        model = self.embedding_deployment if self.embedding_deployment else self.embedding_model
+
+        async def create_embedding() -> list[float]:
+            embedding = await self.openai_client.embeddings.create(model=model, input=q, **dimensions_args)
+            return embedding.data[0].embedding
+
+        with measure_stage("embedding"):
+            if self.embedding_cache:
+                cache_key = ("text", model, str(dimensions_args.get("dimensions", "")), q)
+                query_vector = await self.embedding_cache.get_or_create(cache_key, create_embedding)
+            else:
+                query_vector = await create_embedding()
         # This performs an oversampling due to how the search index was setup,
         # so we do not need to explicitly pass in an oversampling parameter here
         return VectorizedQuery(vector=query_vector, k_nearest_neighbors=50, fields=self.embedding_field)
@@ -480,9 +634,65 @@ class Approach(ABC):
     async def compute_multimodal_embedding(self, q: str):
         if not self.image_embeddings_client:
             raise ValueError("Approach is missing an image embeddings client for multimodal queries")
-        multimodal_query_vector = await self.image_embeddings_client.create_embedding_for_text(q)
+        image_embeddings_client = self.image_embeddings_client
+        with measure_stage("embedding"):
+            if self.embedding_cache:
+                multimodal_query_vector = await self.embedding_cache.get_or_create(
+                    ("multimodal", image_embeddings_client.endpoint, q),
+                    lambda: image_embeddings_client.create_embedding_for_text(q),
+                )
+            else:
+                multimodal_query_vector = await image_embeddings_client.create_embedding_for_text(q)
         return VectorizedQuery(vector=multimodal_query_vector, k_nearest_neighbors=50, fields="images/embedding")
 
+    async def compute_query_vectors(
+        self, q: str, search_text_embeddings: bool, search_image_embeddings: bool
+    ) -> list[VectorQuery]:
+        """Computes the text and multimodal embeddings of the query concurrently."""
+        embeddings: list[Awaitable[VectorQuery]] = []
+        if search_text_embeddings:
+            embeddings.append(self.compute_text_embedding(q))
+        if search_image_embeddings:
+            embeddings.append(self.compute_multimodal_embedding(q))
+        return list(await asyncio.gather(*embeddings))
+
+    async def lookup_cached_answer(
+        self, messages: list[ChatCompletionMessageParam], overrides: dict[str, Any], auth_claims: dict[str, Any]
+    ) -> Optional[AnswerCacheLookup]:
+        """
+        Looks up a previous answer to the same question, asked in the same conversation with the same overrides.
+        The search filter (including the caller's security filter) is part of the cache scope,
+        so answers are never shared between callers who can see different documents.
+        Returns None when the answer cache is disabled for this request.
+        """
+        question = messages[-1]["content"]
+        if not self.answer_cache or not overrides.get("use_answer_cache", True) or not isinstance(question, str):
+            return None
+        scope = AnswerCache.build_scope(
+            approach=type(self).__name__,
+            past_messages=messages[:-1],
+            overrides=overrides,
+            search_filter=self.build_filter(overrides, auth_claims),
+            # Images in user storage are downloaded with the user's identity, so those answers are per-user
+            user_oid=auth_claims.get("oid") if self.user_blob_manager else None,
+        )
+
+        async def embed(q: str) -> list[float]:
+            return (await self.compute_text_embedding(q)).vector
+
+        return await self.answer_cache.lookup(scope, question, embed=embed)
+
+    async def store_cached_answer(self, lookup: Optional[AnswerCacheLookup], answer: dict[str, Any]):
+        if self.answer_cache and lookup:
+            await self.answer_cache.store(lookup, answer)
+
+    def format_thought_step_for_cached_answer(self, lookup: AnswerCacheLookup) -> ThoughtStep:
+        return ThoughtStep(
+            "Answer served from cache",
+            lookup.question,
+            {"match": lookup.match, "similarity": lookup.similarity},
+        )
+
     def get_system_prompt_variables(self, override_prompt: Optional[str]) -> dict[str, str]:
         # Allows client to replace the entire prompt, or to inject into the existing prompt using >>>
         if override_prompt is None:
@@ -1,7 +1,9 @@
+import asyncio
 import json
 import re
-from collections.abc import AsyncGenerator, Awaitable
-from typing import Any, Optional, Union, cast
+import time
+from collections.abc import AsyncGenerator, Awaitable, Coroutine
+from typing import Any, Callable, Optional, Union, cast
 
 from azure.search.documents.agent.aio import KnowledgeAgentRetrievalClient
 from azure.search.documents.aio import SearchClient
@@ -14,12 +16,19 @@ from openai.types.chat import (
     ChatCompletionToolParam,
 )
 
+from approaches.answercache import AnswerCache, AnswerCacheLookup
 from approaches.approach import (
     Approach,
+    Document,
     ExtraInfo,
     ThoughtStep,
 )
+from approaches.contextpacker import ContextPacker
+from approaches.embeddingcache import EmbeddingCache
+from approaches.imagecache import ImageSourceCache
 from approaches.promptmanager import PromptManager
+from approaches.searchcache import SearchResultCache
+from approaches.stagetimings import measure_stage, start_stage_timings
 from core.authentication import AuthenticationHelper
 from prepdocslib.blobmanager import AdlsBlobManager, BlobManager
 from prepdocslib.embeddings import ImageEmbeddings
@@ -33,6 +42,19 @@ class ChatReadRetrieveReadApproach(Approach):
     """
 
     NO_RESPONSE = "0"
+    # Share of the words in the generated search query that must also appear in the user's question
+    # for the results of a speculative search with the user's question to be kept
+    SPECULATIVE_RETRIEVAL_MIN_OVERLAP = 0.8
+    # Words that suggest the question refers back to earlier messages, so it can't be searched on its own
+    FOLLOWUP_QUERY_WORDS = frozenset(
+        {
+            *("it", "its", "they", "them", "their", "theirs", "he", "him", "his", "she", "her", "hers"),
+            *("this", "that", "these", "those", "there", "same", "above", "previous", "former", "latter"),
+            *("else", "also", "another", "other", "more", "again", "instead", "one", "ones"),
+        }
+    )
+    # Minimum number of words in a question that is searched without rewriting in a conversation
+    SELF_CONTAINED_QUERY_MIN_WORDS = 5
 
     def __init__(
         self,
@@ -60,6 +82,14 @@ class ChatReadRetrieveReadApproach(Approach):
         image_embeddings_client: Optional[ImageEmbeddings] = None,
         global_blob_manager: Optional[BlobManager] = None,
         user_blob_manager: Optional[AdlsBlobManager] = None,
+        answer_cache: Optional[AnswerCache] = None,
+        embedding_cache: Optional[EmbeddingCache] = None,
+        image_cache: Optional[ImageSourceCache] = None,
+        context_packer: Optional[ContextPacker] = None,
+        search_cache: Optional[SearchResultCache[Document]] = None,
+        include_stage_timings: bool = False,
+        speculative_retrieval: bool = False,
+        query_rewrite_mode: str = "always",
     ):
         self.search_client = search_client
         self.search_index_name = search_index_name
@@ -88,6 +118,41 @@ class ChatReadRetrieveReadApproach(Approach):
         self.image_embeddings_client = image_embeddings_client
         self.global_blob_manager = global_blob_manager
         self.user_blob_manager = user_blob_manager
+        self.answer_cache = answer_cache
+        self.embedding_cache = embedding_cache
+        self.image_cache = image_cache
+        self.context_packer = context_packer
+        self.search_cache = search_cache
+        self.include_stage_timings = include_stage_timings
+        self.speculative_retrieval = speculative_retrieval
+        self.query_rewrite_mode = query_rewrite_mode
+
+    @staticmethod
+    def get_query_overlap(search_query: str, user_query: str) -> float:
+        search_words = set(re.findall(r"\w+", search_query.lower()))
+        if not search_words:
+            return 0.0
+        user_words = set(re.findall(r"\w+", user_query.lower()))
+        return len(search_words & user_words) / len(search_words)
+
+    def get_query_rewrite_skip_reason(
+        self, messages: list[ChatCompletionMessageParam], user_query: str, query_rewrite_mode: str
+    ) -> Optional[str]:
+        """
+        Returns why the search query doesn't need to be generated by the model, or None if it does.
+        With the "first_turn" mode, the user's question is searched directly when there is no chat history.
+        With the "auto" mode, it's also searched directly when it looks self-contained:
+        long enough, and without words that refer back to earlier messages.
+        """
+        if query_rewrite_mode not in ("first_turn", "auto"):
+            return None
+        if len(messages) == 1:
+            return "first_turn"
+        if query_rewrite_mode == "auto":
+            words = re.findall(r"\w+", user_query.lower())
+            if len(words) >= self.SELF_CONTAINED_QUERY_MIN_WORDS and self.FOLLOWUP_QUERY_WORDS.isdisjoint(words):
+                return "self_contained"
+        return None
 
     def get_search_query(self, chat_completion: ChatCompletion, user_query: str):
         response_message = chat_completion.choices[0].message
@@ -112,6 +177,14 @@ class ChatReadRetrieveReadApproach(Approach):
             return content, []
         return content.split("<<")[0], re.findall(r"<<([^>>]+)>>", content)
 
+    def get_cached_context(self, cache_lookup: AnswerCacheLookup, overrides: dict[str, Any]) -> dict[str, Any]:
+        assert cache_lookup.answer is not None
+        context = cache_lookup.answer["context"]
+        if not overrides.get("include_thoughts", True):
+            return {**context, "thoughts": []}
+        # Copy rather than mutate, as in-memory cache backends hand out the stored answer itself
+        return {**context, "thoughts": [*context["thoughts"], self.format_thought_step_for_cached_answer(cache_lookup)]}
+
     async def run_without_streaming(
         self,
         messages: list[ChatCompletionMessageParam],
@@ -119,10 +192,20 @@ class ChatReadRetrieveReadApproach(Approach):
         auth_claims: dict[str, Any],
         session_state: Any = None,
     ) -> dict[str, Any]:
+        timings = start_stage_timings(type(self).__name__)
+        cache_lookup = await self.lookup_cached_answer(messages, overrides, auth_claims)
+        if cache_lookup and cache_lookup.answer:
+            return {
+                "message": cache_lookup.answer["message"],
+                "context": self.get_cached_context(cache_lookup, overrides),
+                "session_state": session_state,
+            }
+
         extra_info, chat_coroutine = await self.run_until_final_call(
             messages, overrides, auth_claims, should_stream=False
         )
-        chat_completion_response: ChatCompletion = await cast(Awaitable[ChatCompletion], chat_coroutine)
+        with measure_stage("answer_completion"):
+            chat_completion_response: ChatCompletion = await cast(Awaitable[ChatCompletion], chat_coroutine)
         content = chat_completion_response.choices[0].message.content
         role = chat_completion_response.choices[0].message.role
         if overrides.get("suggest_followup_questions"):
@@ -131,11 +214,15 @@ class ChatReadRetrieveReadApproach(Approach):
         # Assume last thought is for generating answer
         if self.include_token_usage and extra_info.thoughts and chat_completion_response.usage:
             extra_info.thoughts[-1].update_token_usage(chat_completion_response.usage)
+        timings.record("total", timings.elapsed())
+        if self.include_stage_timings and extra_info.thoughts:
+            extra_info.thoughts[-1].update_stage_timings(timings)
         chat_app_response = {
             "message": {"content": content, "role": role},
             "context": extra_info,
             "session_state": session_state,
         }
+        await self.store_cached_answer(cache_lookup, {"message": chat_app_response["message"], "context": extra_info})
         return chat_app_response
 
     async def run_with_streaming(
@@ -145,6 +232,21 @@ class ChatReadRetrieveReadApproach(Approach):
         auth_claims: dict[str, Any],
         session_state: Any = None,
     ) -> AsyncGenerator[dict, None]:
+        timings = start_stage_timings(type(self).__name__)
+        cache_lookup = await self.lookup_cached_answer(messages, overrides, auth_claims)
+        if cache_lookup and cache_lookup.answer:
+            context = self.get_cached_context(cache_lookup, overrides)
+            followup_questions = context.get("followup_questions")
+            context["followup_questions"] = None
+            yield {"delta": {"role": "assistant"}, "context": context, "session_state": session_state}
+            yield {"delta": cache_lookup.answer["message"]}
+            if followup_questions:
+                yield {
+                    "delta": {"role": "assistant"},
+                    "context": {"context": context, "followup_questions": followup_questions},
+                }
+            return
+
         extra_info, chat_coroutine = await self.run_until_final_call(
             messages, overrides, auth_claims, should_stream=True
         )
@@ -153,37 +255,47 @@ class ChatReadRetrieveReadApproach(Approach):
 
         followup_questions_started = False
         followup_content = ""
+        answer_content = ""
+        usage = None
+        stream_start = time.perf_counter()
         async for event_chunk in await chat_coroutine:
             # "2023-07-01-preview" API version has a bug where first response has empty choices
-            event = event_chunk.model_dump()  # Convert pydantic model to dict
-            if event["choices"]:
+            if event_chunk.choices:
                 # No usage during streaming
-                completion = {
-                    "delta": {
-                        "content": event["choices"][0]["delta"].get("content"),
-                        "role": event["choices"][0]["delta"]["role"],
-                    }
-                }
+                # Read the delta directly, rather than converting the whole chunk with model_dump
+                delta = event_chunk.choices[0].delta
+                completion = {"delta": {"content": delta.content, "role": delta.role}}
                 # if event contains << and not >>, it is start of follow-up question, truncate
                 content = completion["delta"].get("content")
                 content = content or ""  # content may either not exist in delta, or explicitly be None
+                if content and "time_to_first_token" not in timings.durations:
+                    timings.record("time_to_first_token", timings.elapsed())
                 if overrides.get("suggest_followup_questions") and "<<" in content:
                     followup_questions_started = True
                     earlier_content = content[: content.index("<<")]
                     if earlier_content:
                         completion["delta"]["content"] = earlier_content
+                        answer_content += earlier_content
                         yield completion
                     followup_content += content[content.index("<<") :]
                 elif followup_questions_started:
                     followup_content += content
                 else:
+                    answer_content += content
                     yield completion
             else:
                 # Final chunk at end of streaming should contain usage
                 # https://cookbook.openai.com/examples/how_to_stream_completions#4-how-to-get-token-usage-data-for-streamed-chat-completion-response
-                if event_chunk.usage and extra_info.thoughts and self.include_token_usage:
-                    extra_info.thoughts[-1].update_token_usage(event_chunk.usage)
-                    yield {"delta": {"role": "assistant"}, "context": extra_info, "session_state": session_state}
+                usage = event_chunk.usage or usage
+
+        timings.record("stream", time.perf_counter() - stream_start)
+        timings.record("total", timings.elapsed())
+        if extra_info.thoughts and ((usage and self.include_token_usage) or self.include_stage_timings):
+            if usage and self.include_token_usage:
+                extra_info.thoughts[-1].update_token_usage(usage)
+            if self.include_stage_timings:
+                extra_info.thoughts[-1].update_stage_timings(timings)
+            yield {"delta": {"role": "assistant"}, "context": extra_info, "session_state": session_state}
 
         if followup_content:
             _, followup_questions = self.extract_followup_questions(followup_content)
@@ -191,6 +303,11 @@ class ChatReadRetrieveReadApproach(Approach):
                 "delta": {"role": "assistant"},
                 "context": {"context": extra_info, "followup_questions": followup_questions},
             }
+            extra_info.followup_questions = followup_questions
+
+        await self.store_cached_answer(
+            cache_lookup, {"message": {"content": answer_content, "role": "assistant"}, "context": extra_info}
+        )
 
     async def run(
         self,
@@ -232,18 +349,19 @@ class ChatReadRetrieveReadApproach(Approach):
         else:
             extra_info = await self.run_search_approach(messages, overrides, auth_claims)
 
-        messages = self.prompt_manager.render_prompt(
-            self.answer_prompt,
-            self.get_system_prompt_variables(overrides.get("prompt_template"))
-            | {
-                "include_follow_up_questions": bool(overrides.get("suggest_followup_questions")),
-                "past_messages": messages[:-1],
-                "user_query": original_user_query,
-                "text_sources": extra_info.data_points.text,
-                "image_sources": extra_info.data_points.images,
-                "citations": extra_info.data_points.citations,
-            },
-        )
+        with measure_stage("prompt_render"):
+            messages = self.prompt_manager.render_prompt(
+                self.answer_prompt,
+                self.get_system_prompt_variables(overrides.get("prompt_template"))
+                | {
+                    "include_follow_up_questions": bool(overrides.get("suggest_followup_questions")),
+                    "past_messages": messages[:-1],
+                    "user_query": original_user_query,
+                    "text_sources": extra_info.data_points.text,
+                    "image_sources": extra_info.data_points.images,
+                    "citations": extra_info.data_points.citations,
+                },
+            )
 
         chat_coroutine = cast(
             Union[Awaitable[ChatCompletion], Awaitable[AsyncStream[ChatCompletionChunk]]],
@@ -266,6 +384,9 @@ class ChatReadRetrieveReadApproach(Approach):
                 usage=None,
             )
         )
+        if not overrides.get("include_thoughts", True):
+            # Clients that don't show the thought process can skip its payload, which includes the whole prompt
+            extra_info.thoughts = []
         return (extra_info, chat_coroutine)
 
     async def run_search_approach(
@@ -291,57 +412,54 @@ class ChatReadRetrieveReadApproach(Approach):
         if not isinstance(original_user_query, str):
             raise ValueError("The most recent message content must be a string.")
 
-        query_messages = self.prompt_manager.render_prompt(
-            self.query_rewrite_prompt, {"user_query": original_user_query, "past_messages": messages[:-1]}
+        query_rewrite_mode = overrides.get("query_rewrite_mode", self.query_rewrite_mode)
+        query_rewrite_skip_reason = self.get_query_rewrite_skip_reason(
+            messages, original_user_query, query_rewrite_mode
         )
-        tools: list[ChatCompletionToolParam] = self.query_rewrite_tools
-
-        # STEP 1: Generate an optimized keyword search query based on the chat history and the last question
-
-        chat_completion = cast(
-            ChatCompletion,
-            await self.create_chat_completion(
-                self.chatgpt_deployment,
-                self.chatgpt_model,
-                messages=query_messages,
-                overrides=overrides,
-                response_token_limit=self.get_response_token_limit(
-                    self.chatgpt_model, 100
-                ),  # Setting too low risks malformed JSON, setting too high may affect performance
-                temperature=0.0,  # Minimize creativity for search query generation
-                tools=tools,
-                reasoning_effort=self.get_lowest_reasoning_effort(self.chatgpt_model),
-            ),
-        )
-
-        query_text = self.get_search_query(chat_completion, original_user_query)
-
-        # STEP 2: Retrieve relevant documents from the search index with the GPT optimized query
+        extra_search_props: dict[str, Any] = {}
+        if query_rewrite_mode != "always":
+            extra_search_props["query_rewrite"] = "skipped" if query_rewrite_skip_reason else "generated"
+
+        async def retrieve(query_text: str) -> list[Document]:
+            vectors: list[VectorQuery] = []
+            if use_vector_search:
+                vectors = await self.compute_query_vectors(query_text, search_text_embeddings, search_image_embeddings)
+            return await self.search(
+                top,
+                query_text,
+                search_index_filter,
+                vectors,
+                use_text_search,
+                use_vector_search,
+                use_semantic_ranker,
+                use_semantic_captions,
+                minimum_search_score,
+                minimum_reranker_score,
+                use_query_rewriting,
+            )
 
-        vectors: list[VectorQuery] = []
-        if use_vector_search:
-            if search_text_embeddings:
-                vectors.append(await self.compute_text_embedding(query_text))
-            if search_image_embeddings:
-                vectors.append(await self.compute_multimodal_embedding(query_text))
-
-        results = await self.search(
-            top,
-            query_text,
-            search_index_filter,
-            vectors,
-            use_text_search,
-            use_vector_search,
-            use_semantic_ranker,
-            use_semantic_captions,
-            minimum_search_score,
-            minimum_reranker_score,
-            use_query_rewriting,
-        )
+        if query_rewrite_skip_reason:
+            # Search with the user's question as is, saving a round-trip to the model
+            query_text = original_user_query
+            search_title = "Search using user query"
+            query_thought = ThoughtStep(
+                "Skipped search query generation",
+                original_user_query,
+                {"query_rewrite": "skipped", "reason": query_rewrite_skip_reason},
+            )
+            results = await retrieve(query_text)
+        else:
+            query_text, query_thought, results, speculative_props, kept_speculative = (
+                await self.generate_query_and_retrieve(messages, overrides, original_user_query, retrieve)
+            )
+            extra_search_props.update(speculative_props)
+            # Kept speculative results come from searching the user's question, not the generated query
+            search_title = "Search using user query" if kept_speculative else "Search using generated search query"
 
         # STEP 3: Generate a contextual and content specific answer using the search results and chat history
+        packed_results, packing_thought = self.pack_sources(results, use_semantic_captions, overrides)
         data_points = await self.get_sources_content(
-            results,
+            packed_results,
             use_semantic_captions,
             include_text_sources=send_text_sources,
             download_image_sources=send_image_sources,
@@ -350,17 +468,9 @@ class ChatReadRetrieveReadApproach(Approach):
         extra_info = ExtraInfo(
             data_points,
             thoughts=[
-                self.format_thought_step_for_chatcompletion(
-                    title="Prompt to generate search query",
-                    messages=query_messages,
-                    overrides=overrides,
-                    model=self.chatgpt_model,
-                    deployment=self.chatgpt_deployment,
-                    usage=chat_completion.usage,
-                    reasoning_effort=self.get_lowest_reasoning_effort(self.chatgpt_model),
-                ),
+                query_thought,
                 ThoughtStep(
-                    "Search using generated search query",
+                    search_title,
                     query_text,
                     {
                         "use_semantic_captions": use_semantic_captions,
@@ -372,16 +482,100 @@ class ChatReadRetrieveReadApproach(Approach):
                         "use_text_search": use_text_search,
                         "search_text_embeddings": search_text_embeddings,
                         "search_image_embeddings": search_image_embeddings,
+                        **extra_search_props,
                     },
                 ),
                 ThoughtStep(
                     "Search results",
-                    [result.serialize_for_results() for result in results],
+                    results,
                 ),
             ],
         )
+        if packing_thought:
+            extra_info.thoughts.append(packing_thought)
         return extra_info
 
+    async def generate_query_and_retrieve(
+        self,
+        messages: list[ChatCompletionMessageParam],
+        overrides: dict[str, Any],
+        original_user_query: str,
+        retrieve: Callable[[str], Coroutine[Any, Any, list[Document]]],
+    ) -> tuple[str, ThoughtStep, list[Document], dict[str, Any], bool]:
+        """
+        Generates the search query and retrieves its results, or keeps the results of the speculative search
+        with the user's question if the generated query is close enough to it.
+        Returns the query searched, the query generation thought, the results, the speculative retrieval props
+        and whether the speculative results were kept.
+        """
+        with measure_stage("prompt_render"):
+            query_messages = self.prompt_manager.render_prompt(
+                self.query_rewrite_prompt, {"user_query": original_user_query, "past_messages": messages[:-1]}
+            )
+        tools: list[ChatCompletionToolParam] = self.query_rewrite_tools
+
+        # With speculative retrieval, search with the user's question while the search query is being generated
+        speculative_search: Optional[asyncio.Task[list[Document]]] = None
+        if overrides.get("speculative_retrieval", self.speculative_retrieval):
+            speculative_search = asyncio.create_task(retrieve(original_user_query))
+            # Retrieve the outcome if the speculative search is discarded, so that its errors are not logged as unhandled
+            speculative_search.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+        # STEP 1: Generate an optimized keyword search query based on the chat history and the last question
+
+        try:
+            with measure_stage("query_rewrite"):
+                chat_completion = cast(
+                    ChatCompletion,
+                    await self.create_chat_completion(
+                        self.chatgpt_deployment,
+                        self.chatgpt_model,
+                        messages=query_messages,
+                        overrides=overrides,
+                        response_token_limit=self.get_response_token_limit(
+                            self.chatgpt_model, 100
+                        ),  # Setting too low risks malformed JSON, setting too high may affect performance
+                        temperature=0.0,  # Minimize creativity for search query generation
+                        tools=tools,
+                        reasoning_effort=self.get_lowest_reasoning_effort(self.chatgpt_model),
+                    ),
+                )
+        except BaseException:
+            if speculative_search:
+                speculative_search.cancel()
+            raise
+
+        query_text = self.get_search_query(chat_completion, original_user_query)
+        query_thought = self.format_thought_step_for_chatcompletion(
+            title="Prompt to generate search query",
+            messages=query_messages,
+            overrides=overrides,
+            model=self.chatgpt_model,
+            deployment=self.chatgpt_deployment,
+            usage=chat_completion.usage,
+            reasoning_effort=self.get_lowest_reasoning_effort(self.chatgpt_model),
+        )
+
+        # STEP 2: Retrieve relevant documents from the search index with the GPT optimized query
+
+        speculative_props: dict[str, Any] = {}
+        kept_speculative = False
+        if speculative_search:
+            query_overlap = self.get_query_overlap(query_text, original_user_query)
+            speculative_props = {"generated_search_query": query_text, "query_overlap": round(query_overlap, 2)}
+            if query_overlap >= self.SPECULATIVE_RETRIEVAL_MIN_OVERLAP:
+                speculative_props["speculative_retrieval"] = "kept"
+                kept_speculative = True
+                query_text = original_user_query
+                results = await speculative_search
+            else:
+                speculative_props["speculative_retrieval"] = "discarded"
+                speculative_search.cancel()
+                results = await retrieve(query_text)
+        else:
+            results = await retrieve(query_text)
+        return query_text, query_thought, results, speculative_props, kept_speculative
+
     async def run_agentic_retrieval_approach(
         self,
         messages: list[ChatCompletionMessageParam],
@@ -405,8 +599,9 @@ class ChatReadRetrieveReadApproach(Approach):
             results_merge_strategy=results_merge_strategy,
         )
 
+        packed_results, packing_thought = self.pack_sources(results, False, overrides)
         data_points = await self.get_sources_content(
-            results,
+            packed_results,
             use_semantic_captions=False,
             include_text_sources=send_text_sources,
             download_image_sources=send_image_sources,
@@ -426,7 +621,7 @@ class ChatReadRetrieveReadApproach(Approach):
                 ),
                 ThoughtStep(
                     f"Agentic retrieval results (top {top})",
-                    [result.serialize_for_results() for result in results],
+                    results,
                     {
                         "query_plan": (
                             [activity.as_dict() for activity in response.activity] if response.activity else None
@@ -437,4 +632,6 @@ class ChatReadRetrieveReadApproach(Approach):
                 ),
             ],
         )
+        if packing_thought:
+            extra_info.thoughts.append(packing_thought)
         return extra_info
@@ -0,0 +1,82 @@
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Optional
+
+import tiktoken
+
+# Sources are compared as overlapping runs of this many tokens
+SHINGLE_TOKENS = 8
+# Models that tiktoken doesn't know are counted with the encoding used by the rest of the app
+DEFAULT_ENCODING = "cl100k_base"
+
+
+@lru_cache
+def get_encoding(model: str) -> tiktoken.Encoding:
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+
+@dataclass
+class PackedContext:
+    # Indexes of the packed sources, from the highest to the lowest score
+    indexes: list[int] = field(default_factory=list)
+    source_tokens: int = 0
+    packed_tokens: int = 0
+    duplicates: list[int] = field(default_factory=list)
+    dropped: list[int] = field(default_factory=list)
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.source_tokens - self.packed_tokens
+
+
+class ContextPacker:
+    """
+    Packs the text sources for the answer prompt into a token budget.
+
+    Sources are counted with the tokenizer of the chat model, and added from the highest
+    to the lowest (reranker) score while they fit in the budget.
+    A source is left out as a near-duplicate when most of its text is already in the packed sources,
+    like the same text indexed twice or repeated on several pages. Neighbouring chunks of a document
+    only share the small overlap added when it's split, so they're both kept.
+    """
+
+    def __init__(self, model: str, token_budget: int, duplicate_threshold: float = 0.8):
+        self.encoding = get_encoding(model)
+        self.token_budget = token_budget
+        self.duplicate_threshold = duplicate_threshold
+
+    @staticmethod
+    def get_shingles(tokens: list[int]) -> set[tuple[int, ...]]:
+        if len(tokens) <= SHINGLE_TOKENS:
+            return {tuple(tokens)}
+        return {tuple(tokens[i : i + SHINGLE_TOKENS]) for i in range(len(tokens) - SHINGLE_TOKENS + 1)}
+
+    def pack(
+        self, sources: list[str], scores: list[Optional[float]], token_budget: Optional[int] = None
+    ) -> PackedContext:
+        token_budget = self.token_budget if token_budget is None else token_budget
+        packed = PackedContext()
+        packed_shingles: set[tuple[int, ...]] = set()
+
+        def rank(index: int) -> float:
+            # Sources without a score keep their search order, after the scored ones
+            score = scores[index]
+            return -score if score is not None else float("inf")
+
+        ranked = sorted(range(len(sources)), key=rank)
+        for index in ranked:
+            tokens = self.encoding.encode(sources[index], disallowed_special=())
+            packed.source_tokens += len(tokens)
+            shingles = self.get_shingles(tokens)
+            if shingles and len(shingles & packed_shingles) >= self.duplicate_threshold * len(shingles):
+                packed.duplicates.append(index)
+            elif packed.packed_tokens + len(tokens) > token_budget:
+                packed.dropped.append(index)
+            else:
+                packed.indexes.append(index)
+                packed.packed_tokens += len(tokens)
+                packed_shingles |= shingles
+        return packed
@@ -0,0 +1,48 @@
+from array import array
+from collections.abc import Awaitable
+from typing import Callable, Optional
+
+from opentelemetry import metrics
+
+from core.cache import AsyncCoalescer, CacheStats, TTLCache
+
+meter = metrics.get_meter(__name__)
+embedding_cache_lookups = meter.create_counter(
+    "embedding_cache.lookups",
+    description="Query embedding cache lookups, labelled by kind (text or multimodal) and result (hit, coalesced or miss)",
+)
+
+EmbeddingCacheKey = tuple[str, ...]
+
+
+class EmbeddingCache:
+    """
+    Caches query embeddings, so that repeated search queries skip the call to the embedding service.
+
+    Keys identify the kind of embedding, the model (and dimensions) and the exact query text.
+    Vectors are stored as float32 arrays, which is the precision the embedding services return,
+    and take about a quarter of the memory of a list of Python floats.
+    Concurrent requests for the same key share a single call to the embedding service.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: Optional[float] = None):
+        self.cache: TTLCache[EmbeddingCacheKey, array] = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self.in_flight: AsyncCoalescer[EmbeddingCacheKey, list[float]] = AsyncCoalescer()
+
+    @property
+    def stats(self) -> CacheStats:
+        return self.cache.stats
+
+    async def get_or_create(self, key: EmbeddingCacheKey, create: Callable[[], Awaitable[list[float]]]) -> list[float]:
+        vector = self.cache.get(key)
+        if vector is not None:
+            embedding_cache_lookups.add(1, {"kind": key[0], "result": "hit"})
+            return vector.tolist()
+        embedding_cache_lookups.add(1, {"kind": key[0], "result": "coalesced" if key in self.in_flight else "miss"})
+
+        async def create_and_store() -> list[float]:
+            vector = await create()
+            self.cache.set(key, array("f", vector))
+            return vector
+
+        return await self.in_flight.run(key, create_and_store)
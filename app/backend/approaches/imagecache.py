@@ -0,0 +1,84 @@
+from collections.abc import Awaitable
+from typing import Callable, Optional
+
+from opentelemetry import metrics
+
+from core.cache import TTLCache
+
+meter = metrics.get_meter(__name__)
+image_cache_lookups = meter.create_counter(
+    "image_cache.lookups",
+    description="Image source cache lookups, labelled by result (hit, revalidated or miss)",
+)
+
+# Identifies an image by the user it was downloaded for (for per-user storage) and its blob URL
+ImageCacheKey = tuple[str, str]
+
+
+class ImageSourceCache:
+    """
+    Caches the images sent to the model as base64 data URIs, so that figures cited by many answers
+    are served from memory instead of being downloaded from storage for every request.
+
+    Data URIs are keyed by image and blob ETag, and evicted once their total size exceeds max_bytes.
+    An image's ETag is trusted for revalidate_seconds after it was last checked. After that,
+    the cached data URI is only served again once the blob's current ETag has been checked to match.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, revalidate_seconds: float = 300, max_entries: int = 10000):
+        self.data_uris: TTLCache[tuple[ImageCacheKey, str], str] = TTLCache(
+            max_entries=max_entries, max_size=max_bytes, get_size=len
+        )
+        # Maps each image to the ETag of its cached data URI
+        self.etags: TTLCache[ImageCacheKey, str] = TTLCache(max_entries=max_entries)
+        # Maps each image to the ETag of its cached data URI, while that ETag doesn't need to be checked
+        self.fresh_etags: TTLCache[ImageCacheKey, str] = TTLCache(
+            max_entries=max_entries, ttl_seconds=revalidate_seconds
+        )
+
+    @property
+    def size(self) -> int:
+        return self.data_uris.size
+
+    async def get_or_download(
+        self,
+        key: ImageCacheKey,
+        get_etag: Callable[[], Awaitable[Optional[str]]],
+        download: Callable[[], Awaitable[Optional[tuple[str, Optional[str]]]]],
+    ) -> Optional[str]:
+        """
+        Returns the data URI of the image, from the cache if it's still current.
+
+        Args:
+            key: Identifies the image
+            get_etag: Gets the blob's current ETag
+            download: Downloads the image, returning its data URI and the blob's ETag, or None if not found
+        """
+        etag = self.fresh_etags.get(key)
+        if etag is not None and (data_uri := self.data_uris.get((key, etag))) is not None:
+            image_cache_lookups.add(1, {"result": "hit"})
+            return data_uri
+
+        etag = self.etags.get(key)
+        if etag is not None and (key, etag) in self.data_uris and await get_etag() == etag:
+            if (data_uri := self.data_uris.get((key, etag))) is not None:
+                self.fresh_etags.set(key, etag)
+                image_cache_lookups.add(1, {"result": "revalidated"})
+                return data_uri
+
+        image_cache_lookups.add(1, {"result": "miss"})
+        result = await download()
+        if result is None:
+            return None
+        data_uri, etag = result
+        if etag is not None:
+            self.set(key, etag, data_uri)
+        return data_uri
+
+    def set(self, key: ImageCacheKey, etag: str, data_uri: str):
+        previous_etag = self.etags.get(key)
+        if previous_etag is not None and previous_etag != etag:
+            self.data_uris.pop((key, previous_etag))
+        self.data_uris.set((key, etag), data_uri)
+        self.etags.set(key, etag)
+        self.fresh_etags.set(key, etag)
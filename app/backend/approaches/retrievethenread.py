@@ -6,12 +6,19 @@ from azure.search.documents.models import VectorQuery
 from openai import AsyncOpenAI
 from openai.types.chat import ChatCompletion, ChatCompletionMessageParam
 
+from approaches.answercache import AnswerCache
 from approaches.approach import (
     Approach,
+    Document,
     ExtraInfo,
     ThoughtStep,
 )
+from approaches.contextpacker import ContextPacker
+from approaches.embeddingcache import EmbeddingCache
+from approaches.imagecache import ImageSourceCache
 from approaches.promptmanager import PromptManager
+from approaches.searchcache import SearchResultCache
+from approaches.stagetimings import measure_stage, start_stage_timings
 from core.authentication import AuthenticationHelper
 from prepdocslib.blobmanager import AdlsBlobManager, BlobManager
 from prepdocslib.embeddings import ImageEmbeddings
@@ -50,6 +57,12 @@ class RetrieveThenReadApproach(Approach):
         image_embeddings_client: Optional[ImageEmbeddings] = None,
         global_blob_manager: Optional[BlobManager] = None,
         user_blob_manager: Optional[AdlsBlobManager] = None,
+        answer_cache: Optional[AnswerCache] = None,
+        embedding_cache: Optional[EmbeddingCache] = None,
+        image_cache: Optional[ImageSourceCache] = None,
+        context_packer: Optional[ContextPacker] = None,
+        search_cache: Optional[SearchResultCache[Document]] = None,
+        include_stage_timings: bool = False,
     ):
         self.search_client = search_client
         self.search_index_name = search_index_name
@@ -77,6 +90,12 @@ class RetrieveThenReadApproach(Approach):
         self.image_embeddings_client = image_embeddings_client
         self.global_blob_manager = global_blob_manager
         self.user_blob_manager = user_blob_manager
+        self.answer_cache = answer_cache
+        self.embedding_cache = embedding_cache
+        self.image_cache = image_cache
+        self.context_packer = context_packer
+        self.search_cache = search_cache
+        self.include_stage_timings = include_stage_timings
 
     async def run(
         self,
@@ -84,40 +103,54 @@ class RetrieveThenReadApproach(Approach):
         session_state: Any = None,
         context: dict[str, Any] = {},
     ) -> dict[str, Any]:
+        timings = start_stage_timings(type(self).__name__)
         overrides = context.get("overrides", {})
         auth_claims = context.get("auth_claims", {})
         use_agentic_retrieval = True if overrides.get("use_agentic_retrieval") else False
+        include_thoughts = overrides.get("include_thoughts", True)
         q = messages[-1]["content"]
         if not isinstance(q, str):
             raise ValueError("The most recent message content must be a string.")
 
+        cache_lookup = await self.lookup_cached_answer(messages, overrides, auth_claims)
+        if cache_lookup and cache_lookup.answer:
+            context = cache_lookup.answer["context"]
+            thoughts = [*context["thoughts"], self.format_thought_step_for_cached_answer(cache_lookup)]
+            return {
+                "message": cache_lookup.answer["message"],
+                "context": {**context, "thoughts": thoughts if include_thoughts else []},
+                "session_state": session_state,
+            }
+
         if use_agentic_retrieval:
             extra_info = await self.run_agentic_retrieval_approach(messages, overrides, auth_claims)
         else:
             extra_info = await self.run_search_approach(messages, overrides, auth_claims)
 
         # Process results
-        messages = self.prompt_manager.render_prompt(
-            self.answer_prompt,
-            self.get_system_prompt_variables(overrides.get("prompt_template"))
-            | {
-                "user_query": q,
-                "text_sources": extra_info.data_points.text,
-                "image_sources": extra_info.data_points.images or [],
-                "citations": extra_info.data_points.citations,
-            },
-        )
+        with measure_stage("prompt_render"):
+            messages = self.prompt_manager.render_prompt(
+                self.answer_prompt,
+                self.get_system_prompt_variables(overrides.get("prompt_template"))
+                | {
+                    "user_query": q,
+                    "text_sources": extra_info.data_points.text,
+                    "image_sources": extra_info.data_points.images or [],
+                    "citations": extra_info.data_points.citations,
+                },
+            )
 
-        chat_completion = cast(
-            ChatCompletion,
-            await self.create_chat_completion(
-                self.chatgpt_deployment,
-                self.chatgpt_model,
-                messages=messages,
-                overrides=overrides,
-                response_token_limit=self.get_response_token_limit(self.chatgpt_model, 1024),
-            ),
-        )
+        with measure_stage("answer_completion"):
+            chat_completion = cast(
+                ChatCompletion,
+                await self.create_chat_completion(
+                    self.chatgpt_deployment,
+                    self.chatgpt_model,
+                    messages=messages,
+                    overrides=overrides,
+                    response_token_limit=self.get_response_token_limit(self.chatgpt_model, 1024),
+                ),
+            )
         extra_info.thoughts.append(
             self.format_thought_step_for_chatcompletion(
                 title="Prompt to generate answer",
@@ -128,21 +161,26 @@ class RetrieveThenReadApproach(Approach):
                 usage=chat_completion.usage,
             )
         )
-        return {
+        timings.record("total", timings.elapsed())
+        if self.include_stage_timings:
+            extra_info.thoughts[-1].update_stage_timings(timings)
+        response = {
             "message": {
                 "content": chat_completion.choices[0].message.content,
                 "role": chat_completion.choices[0].message.role,
             },
             "context": {
-                "thoughts": extra_info.thoughts,
+                # Clients that don't show the thought process can skip its payload, which includes the whole prompt
+                "thoughts": extra_info.thoughts if include_thoughts else [],
                 "data_points": {
                     "text": extra_info.data_points.text or [],
                     "images": extra_info.data_points.images or [],
                     "citations": extra_info.data_points.citations or [],
                 },
             },
-            "session_state": session_state,
         }
+        await self.store_cached_answer(cache_lookup, response)
+        return {**response, "session_state": session_state}
 
     async def run_search_approach(
         self, messages: list[ChatCompletionMessageParam], overrides: dict[str, Any], auth_claims: dict[str, Any]
@@ -166,10 +204,7 @@ class RetrieveThenReadApproach(Approach):
 
         vectors: list[VectorQuery] = []
         if use_vector_search:
-            if search_text_embeddings:
-                vectors.append(await self.compute_text_embedding(q))
-            if search_image_embeddings:
-                vectors.append(await self.compute_multimodal_embedding(q))
+            vectors = await self.compute_query_vectors(q, search_text_embeddings, search_image_embeddings)
 
         results = await self.search(
             top,
@@ -185,15 +220,16 @@ class RetrieveThenReadApproach(Approach):
             use_query_rewriting,
         )
 
+        packed_results, packing_thought = self.pack_sources(results, use_semantic_captions, overrides)
         data_points = await self.get_sources_content(
-            results,
+            packed_results,
             use_semantic_captions,
             include_text_sources=send_text_sources,
             download_image_sources=send_image_sources,
             user_oid=auth_claims.get("oid"),
         )
 
-        return ExtraInfo(
+        extra_info = ExtraInfo(
             data_points,
             thoughts=[
                 ThoughtStep(
@@ -213,10 +249,13 @@ class RetrieveThenReadApproach(Approach):
                 ),
                 ThoughtStep(
                     "Search results",
-                    [result.serialize_for_results() for result in results],
+                    results,
                 ),
             ],
         )
+        if packing_thought:
+            extra_info.thoughts.append(packing_thought)
+        return extra_info
 
     async def run_agentic_retrieval_approach(
         self,
@@ -241,8 +280,9 @@ class RetrieveThenReadApproach(Approach):
             results_merge_strategy=results_merge_strategy,
         )
 
+        packed_results, packing_thought = self.pack_sources(results, False, overrides)
         data_points = await self.get_sources_content(
-            results,
+            packed_results,
             use_semantic_captions=False,
             include_text_sources=send_text_sources,
             download_image_sources=send_image_sources,
@@ -263,7 +303,7 @@ class RetrieveThenReadApproach(Approach):
                 ),
                 ThoughtStep(
                     f"Agentic retrieval results (top {top})",
-                    [result.serialize_for_results() for result in results],
+                    results,
                     {
                         "query_plan": (
                             [activity.as_dict() for activity in response.activity] if response.activity else None
@@ -274,4 +314,6 @@ class RetrieveThenReadApproach(Approach):
                 ),
             ],
         )
+        if packing_thought:
+            extra_info.thoughts.append(packing_thought)
         return extra_info
@@ -0,0 +1,80 @@
+import hashlib
+import json
+from array import array
+from collections.abc import Awaitable
+from typing import Any, Callable, Generic, Optional, TypeVar
+
+from azure.search.documents.models import VectorQuery
+from opentelemetry import metrics
+
+from core.cache import AsyncCoalescer, CacheStats, TTLCache
+
+meter = metrics.get_meter(__name__)
+search_cache_lookups = meter.create_counter(
+    "search_cache.lookups",
+    description="Search result cache lookups, labelled by result (hit, coalesced or miss)",
+)
+
+T = TypeVar("T")
+
+SearchCacheKey = tuple[Any, ...]
+
+
+def hash_vector_queries(vectors: list[VectorQuery]) -> str:
+    digest = hashlib.sha256()
+    for vector_query in vectors:
+        query = vector_query.as_dict()
+        vector = query.pop("vector", None)
+        digest.update(json.dumps(query, sort_keys=True).encode())
+        if vector is not None:
+            # Hashing the raw floats is much faster than serializing thousands of them as JSON
+            digest.update(array("d", vector).tobytes())
+    return digest.hexdigest()
+
+
+class SearchResultCache(Generic[T]):
+    """
+    Caches search results for a short time, so that identical searches (such as retries,
+    follow-up questions that search for the same query, and load tests) don't query the index again.
+
+    Keys combine the query text, the OData filter (which includes the security filters of the user),
+    a hash of the vector queries and the search options.
+    Concurrent identical searches share a single query to the index.
+    The whole cache is invalidated when the app changes the content of the index, such as for user uploads.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 30):
+        self.cache: TTLCache[SearchCacheKey, tuple[T, ...]] = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self.in_flight: AsyncCoalescer[tuple[int, SearchCacheKey], list[T]] = AsyncCoalescer()
+        # Incremented on every invalidation, so that searches that overlap a change to the index aren't stored
+        self.generation = 0
+
+    @property
+    def stats(self) -> CacheStats:
+        return self.cache.stats
+
+    @staticmethod
+    def build_key(
+        query_text: Optional[str], filter: Optional[str], vectors: list[VectorQuery], **options: Any
+    ) -> SearchCacheKey:
+        return (query_text or "", filter or "", hash_vector_queries(vectors), *sorted(options.items()))
+
+    async def get_or_search(self, key: SearchCacheKey, search: Callable[[], Awaitable[list[T]]]) -> list[T]:
+        results = self.cache.get(key)
+        if results is not None:
+            search_cache_lookups.add(1, {"result": "hit"})
+            return list(results)
+        generation = self.generation
+        search_cache_lookups.add(1, {"result": "coalesced" if (generation, key) in self.in_flight else "miss"})
+
+        async def search_and_store() -> list[T]:
+            results = await search()
+            if generation == self.generation:
+                self.cache.set(key, tuple(results))
+            return results
+
+        return list(await self.in_flight.run((generation, key), search_and_store))
+
+    def invalidate(self):
+        self.generation += 1
+        self.cache.clear()
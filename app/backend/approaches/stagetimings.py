@@ -0,0 +1,65 @@
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from opentelemetry import metrics, trace
+
+tracer = trace.get_tracer(__name__)
+meter = metrics.get_meter(__name__)
+stage_duration = meter.create_histogram(
+    "rag.stage.duration",
+    unit="ms",
+    description="Duration of each stage of answering a question, labelled by stage and approach",
+)
+
+
+class StageTimings:
+    """
+    Collects how long each stage of answering a question takes (prompt rendering, query rewriting, embedding,
+    search, source assembly, image download, the answer completion and streaming).
+
+    Stages that run more than once per request, like the text and image embeddings, add up.
+    Every duration is also recorded in the rag.stage.duration histogram.
+    """
+
+    def __init__(self, approach: str):
+        self.approach = approach
+        self.start = time.perf_counter()
+        self.durations: dict[str, float] = {}
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def record(self, stage: str, seconds: float):
+        self.durations[stage] = self.durations.get(stage, 0) + seconds
+        stage_duration.record(seconds * 1000, {"stage": stage, "approach": self.approach})
+
+    def as_props(self) -> dict[str, float]:
+        return {stage: round(seconds * 1000, 1) for stage, seconds in self.durations.items()}
+
+
+# The timings of the request being answered, so that shared helpers like Approach.search can record their stage
+current_stage_timings: ContextVar[Optional[StageTimings]] = ContextVar("current_stage_timings", default=None)
+
+
+def start_stage_timings(approach: str) -> StageTimings:
+    timings = StageTimings(approach)
+    current_stage_timings.set(timings)
+    return timings
+
+
+@contextmanager
+def measure_stage(stage: str) -> Iterator[None]:
+    timings = current_stage_timings.get()
+    with tracer.start_as_current_span(f"rag.{stage}"):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if timings:
+                timings.record(stage, seconds)
+            else:
+                stage_duration.record(seconds * 1000, {"stage": stage})
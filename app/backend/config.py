@@ -35,3 +35,5 @@ CONFIG_RAG_SEARCH_TEXT_EMBEDDINGS = "rag_search_text_embeddings"
 CONFIG_RAG_SEARCH_IMAGE_EMBEDDINGS = "rag_search_image_embeddings"
 CONFIG_RAG_SEND_TEXT_SOURCES = "rag_send_text_sources"
 CONFIG_RAG_SEND_IMAGE_SOURCES = "rag_send_image_sources"
+CONFIG_ANSWER_CACHE = "answer_cache"
+CONFIG_UPLOAD_JOBS = "upload_jobs"
@@ -1,15 +1,18 @@
 # Refactored from https://github.com/Azure-Samples/ms-identity-python-on-behalf-of
 
+import asyncio
 import base64
+import hashlib
 import json
 import logging
-from typing import Any, Optional
+import time
+from functools import lru_cache
+from typing import Any, Callable, Optional
 
 import aiohttp
 import jwt
 from azure.search.documents.aio import SearchClient
 from azure.search.documents.indexes.models import SearchIndex
-from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric import rsa
 from msal import ConfidentialClientApplication
 from msal.token_cache import TokenCache
@@ -20,6 +23,8 @@ from tenacity import (
     wait_random_exponential,
 )
 
+from core.cache import AsyncCoalescer, TTLCache
+
 
 # AuthError is raised when the authentication token sent by the client UI cannot be parsed or there is an authentication error accessing the graph API
 class AuthError(Exception):
@@ -31,8 +36,115 @@ class AuthError(Exception):
         return self.error or ""
 
 
+@lru_cache(maxsize=1024)
+def build_groups_security_filter(groups: frozenset[str]) -> str:
+    # Sorted, so that the filter (and the caches keyed by it) doesn't depend on the order of the groups
+    return "groups/any(g:search.in(g, '{}'))".format(", ".join(sorted(groups)))
+
+
+class JwksCache:
+    """
+    Caches the signing keys of Entra ID (the JWKS document at key_url) by key id,
+    as RSA public keys that are built once, when the document is downloaded.
+
+    Once the keys are older than refresh_seconds, they are refreshed in the background while the current keys are used.
+    A token signed with an unknown key (such as after a key rollover) refreshes the keys right away,
+    at most once every min_refresh_seconds, so that tokens with made-up key ids can't trigger a download on every request.
+    """
+
+    def __init__(
+        self,
+        key_url: str,
+        refresh_seconds: float = 3600,
+        min_refresh_seconds: float = 60,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        self.key_url = key_url
+        self.refresh_seconds = refresh_seconds
+        self.min_refresh_seconds = min_refresh_seconds
+        self.timer = timer
+        self.keys: dict[str, rsa.RSAPublicKey] = {}
+        self.refreshed_at: Optional[float] = None
+        self.in_flight: AsyncCoalescer[str, None] = AsyncCoalescer()
+        self.background_refresh: Optional[asyncio.Task[None]] = None
+
+    @staticmethod
+    def build_public_key(key: dict[str, Any]) -> rsa.RSAPublicKey:
+        public_numbers = rsa.RSAPublicNumbers(
+            e=int.from_bytes(base64.urlsafe_b64decode(key["e"] + "=="), byteorder="big"),
+            n=int.from_bytes(base64.urlsafe_b64decode(key["n"] + "=="), byteorder="big"),
+        )
+        return public_numbers.public_key()
+
+    async def download_jwks(self) -> Any:
+        jwks = None
+        async for attempt in AsyncRetrying(
+            retry=retry_if_exception_type(AuthError),
+            wait=wait_random_exponential(min=15, max=60),
+            stop=stop_after_attempt(5),
+        ):
+            with attempt:
+                async with aiohttp.ClientSession() as session:
+                    async with session.get(url=self.key_url) as resp:
+                        resp_status = resp.status
+                        if resp_status in [500, 502, 503, 504]:
+                            raise AuthError(
+                                error=f"Failed to get keys info: {await resp.text()}", status_code=resp_status
+                            )
+                        jwks = await resp.json()
+        return jwks
+
+    async def refresh(self):
+        async def download_keys():
+            jwks = await self.download_jwks()
+            if not jwks or "keys" not in jwks:
+                raise AuthError("Unable to get keys to validate auth token.", 401)
+            keys = {}
+            for key in jwks["keys"]:
+                if key.get("kty") != "RSA" or "kid" not in key:
+                    continue
+                try:
+                    keys[key["kid"]] = self.build_public_key(key)
+                except (KeyError, ValueError):
+                    logging.warning("Skipping invalid signing key %s", key["kid"])
+            self.keys = keys
+            self.refreshed_at = self.timer()
+
+        # Concurrent requests share a single download
+        await self.in_flight.run(self.key_url, download_keys)
+
+    def start_background_refresh(self):
+        if self.background_refresh and not self.background_refresh.done():
+            return
+
+        def log_failure(task: asyncio.Task[None]):
+            if not task.cancelled() and task.exception():
+                logging.warning("Failed to refresh the signing keys, using the current keys", exc_info=task.exception())
+
+        self.background_refresh = asyncio.create_task(self.refresh())
+        self.background_refresh.add_done_callback(log_failure)
+
+    async def get_key(self, kid: str) -> Optional[rsa.RSAPublicKey]:
+        if self.refreshed_at is None:
+            await self.refresh()
+        else:
+            age = self.timer() - self.refreshed_at
+            if kid not in self.keys and age >= self.min_refresh_seconds:
+                await self.refresh()
+            elif age >= self.refresh_seconds:
+                self.start_background_refresh()
+        return self.keys.get(kid)
+
+
 class AuthenticationHelper:
     scope: str = "https://graph.microsoft.com/.default"
+    # On-behalf-of tokens are reused until this many seconds before they expire
+    OBO_TOKEN_EXPIRY_MARGIN_SECONDS = 300
+    OBO_TOKEN_CACHE_MAX_ENTRIES = 1000
+    # Group memberships read from Microsoft Graph are reused for this long, so changes take up to this long to apply
+    GROUPS_CACHE_TTL_SECONDS = 300
+    GROUPS_CACHE_MAX_ENTRIES = 1000
+    PATH_AUTH_CACHE_MAX_ENTRIES = 10000
 
     def __init__(
         self,
@@ -45,6 +157,7 @@ class AuthenticationHelper:
         require_access_control: bool = False,
         enable_global_documents: bool = False,
         enable_unauthenticated_access: bool = False,
+        path_auth_cache_ttl_seconds: float = 0,
     ):
         self.use_authentication = use_authentication
         self.server_app_id = server_app_id
@@ -61,6 +174,24 @@ class AuthenticationHelper:
         self.valid_audiences = [f"api://{server_app_id}", str(server_app_id)]
         # See https://learn.microsoft.com/entra/identity-platform/access-tokens#validate-the-issuer for more information on token validation
         self.key_url = f"{self.authority}/discovery/v2.0/keys"
+        self.jwks_cache = JwksCache(self.key_url)
+        # Keyed by a hash of the user's token, rather than the token itself
+        self.obo_token_cache: TTLCache[str, dict[str, Any]] = TTLCache(max_entries=self.OBO_TOKEN_CACHE_MAX_ENTRIES)
+        self.obo_token_exchanges: AsyncCoalescer[str, dict[str, Any]] = AsyncCoalescer()
+        self.groups_cache: TTLCache[str, frozenset[str]] = TTLCache(
+            max_entries=self.GROUPS_CACHE_MAX_ENTRIES, ttl_seconds=self.GROUPS_CACHE_TTL_SECONDS
+        )
+        self.groups_reads: AsyncCoalescer[str, frozenset[str]] = AsyncCoalescer()
+        self.graph_session: Optional[aiohttp.ClientSession] = None
+        # Whether a user may access a file, by (oid, hash of the groups, path)
+        self.path_auth_cache: Optional[TTLCache[tuple[str, str, str], bool]] = (
+            TTLCache(max_entries=self.PATH_AUTH_CACHE_MAX_ENTRIES, ttl_seconds=path_auth_cache_ttl_seconds)
+            if path_auth_cache_ttl_seconds > 0
+            else None
+        )
+        self.path_auth_checks: AsyncCoalescer[tuple[int, tuple[str, str, str]], bool] = AsyncCoalescer()
+        # Incremented on every invalidation, so that checks that overlap a change to the index aren't stored
+        self.path_auth_generation = 0
 
         if self.use_authentication:
             field_names = [field.name for field in search_index.fields] if search_index else []
@@ -154,7 +285,7 @@ class AuthenticationHelper:
             "oids/any(g:search.in(g, '{}'))".format(auth_claims.get("oid", "")) if use_oid_security_filter else None
         )
         groups_security_filter = (
-            "groups/any(g:search.in(g, '{}'))".format(", ".join(auth_claims.get("groups", [])))
+            build_groups_security_filter(frozenset(auth_claims.get("groups", [])))
             if use_groups_security_filter
             else None
         )
@@ -179,34 +310,86 @@ class AuthenticationHelper:
         return security_filter
 
     @staticmethod
-    async def list_groups(graph_resource_access_token: dict) -> list[str]:
+    async def list_groups(
+        graph_resource_access_token: dict, session: Optional[aiohttp.ClientSession] = None
+    ) -> list[str]:
+        if session is None:
+            async with aiohttp.ClientSession() as session:
+                return await AuthenticationHelper.list_groups(graph_resource_access_token, session)
+
         headers = {"Authorization": "Bearer " + graph_resource_access_token["access_token"]}
         groups = []
-        async with aiohttp.ClientSession(headers=headers) as session:
-            resp_json = None
-            resp_status = None
-            async with session.get(url="https://graph.microsoft.com/v1.0/me/transitiveMemberOf?$select=id") as resp:
-                resp_json = await resp.json()
-                resp_status = resp.status
-                if resp_status != 200:
-                    raise AuthError(error=json.dumps(resp_json), status_code=resp_status)
-
-            while resp_status == 200:
-                value = resp_json["value"]
-                for group in value:
-                    groups.append(group["id"])
-                next_link = resp_json.get("@odata.nextLink")
-                if next_link:
-                    async with session.get(url=next_link) as resp:
-                        resp_json = await resp.json()
-                        resp_status = resp.status
-                else:
-                    break
+        resp_json = None
+        resp_status = None
+        async with session.get(
+            url="https://graph.microsoft.com/v1.0/me/transitiveMemberOf?$select=id", headers=headers
+        ) as resp:
+            resp_json = await resp.json()
+            resp_status = resp.status
             if resp_status != 200:
                 raise AuthError(error=json.dumps(resp_json), status_code=resp_status)
 
+        while resp_status == 200:
+            value = resp_json["value"]
+            for group in value:
+                groups.append(group["id"])
+            next_link = resp_json.get("@odata.nextLink")
+            if next_link:
+                async with session.get(url=next_link, headers=headers) as resp:
+                    resp_json = await resp.json()
+                    resp_status = resp.status
+            else:
+                break
+        if resp_status != 200:
+            raise AuthError(error=json.dumps(resp_json), status_code=resp_status)
+
         return groups
 
+    async def get_groups(self, oid: str, graph_resource_access_token: dict) -> frozenset[str]:
+        """
+        Reads the groups that the user is a (transitive) member of from Microsoft Graph, through a shared session.
+        The groups are cached by user, and concurrent reads for the same user are shared.
+        """
+        groups = self.groups_cache.get(oid)
+        if groups is not None:
+            return groups
+
+        async def read_groups() -> frozenset[str]:
+            if self.graph_session is None:
+                self.graph_session = aiohttp.ClientSession()
+            groups = frozenset(await self.list_groups(graph_resource_access_token, self.graph_session))
+            self.groups_cache.set(oid, groups)
+            return groups
+
+        return await self.groups_reads.run(oid, read_groups)
+
+    async def close(self):
+        if self.graph_session:
+            await self.graph_session.close()
+            self.graph_session = None
+
+    async def acquire_token_on_behalf_of(self, auth_token: str) -> dict[str, Any]:
+        """
+        Exchanges the user's token for a Microsoft Graph token with the on-behalf-of flow.
+        MSAL is synchronous, so the exchange runs in a worker thread rather than blocking the event loop.
+        Tokens are cached until shortly before they expire, and concurrent exchanges of the same token are shared.
+        """
+        cache_key = hashlib.sha256(auth_token.encode()).hexdigest()
+        token = self.obo_token_cache.get(cache_key)
+        if token is not None:
+            return token
+
+        async def exchange_token() -> dict[str, Any]:
+            token = await asyncio.to_thread(
+                self.confidential_client.acquire_token_on_behalf_of, user_assertion=auth_token, scopes=[self.scope]
+            )
+            ttl_seconds = int(token.get("expires_in", 0)) - self.OBO_TOKEN_EXPIRY_MARGIN_SECONDS
+            if "error" not in token and ttl_seconds > 0:
+                self.obo_token_cache.set(cache_key, token, ttl_seconds=ttl_seconds)
+            return token
+
+        return await self.obo_token_exchanges.run(cache_key, exchange_token)
+
     async def get_auth_claims_if_enabled(self, headers: dict) -> dict[str, Any]:
         if not self.use_authentication:
             return {}
@@ -220,16 +403,14 @@ class AuthenticationHelper:
 
             # Use the on-behalf-of-flow to acquire another token for use with Microsoft Graph
             # See https://learn.microsoft.com/entra/identity-platform/v2-oauth2-on-behalf-of-flow for more information
-            graph_resource_access_token = self.confidential_client.acquire_token_on_behalf_of(
-                user_assertion=auth_token, scopes=["https://graph.microsoft.com/.default"]
-            )
+            graph_resource_access_token = await self.acquire_token_on_behalf_of(auth_token)
             if "error" in graph_resource_access_token:
                 raise AuthError(error=str(graph_resource_access_token), status_code=401)
 
             # Read the claims from the response. The oid and groups claims are used for security filtering
             # https://learn.microsoft.com/entra/identity-platform/id-token-claims-reference
             id_token_claims = graph_resource_access_token["id_token_claims"]
-            auth_claims = {"oid": id_token_claims["oid"], "groups": id_token_claims.get("groups", [])}
+            auth_claims = {"oid": id_token_claims["oid"], "groups": list(id_token_claims.get("groups", []))}
 
             # A groups claim may have been omitted either because it was not added in the application manifest for the API application,
             # or a groups overage claim may have been emitted.
@@ -242,7 +423,7 @@ class AuthenticationHelper:
             )
             if missing_groups_claim or has_group_overage_claim:
                 # Read the user's groups from Microsoft Graph
-                auth_claims["groups"] = await AuthenticationHelper.list_groups(graph_resource_access_token)
+                auth_claims["groups"] = sorted(await self.get_groups(auth_claims["oid"], graph_resource_access_token))
             return auth_claims
         except AuthError as e:
             logging.exception("Exception getting authorization information - " + json.dumps(e.error))
@@ -267,6 +448,28 @@ class AuthenticationHelper:
         if fragment_index != -1:
             path = path[:fragment_index]
 
+        if self.path_auth_cache is None:
+            return await self.search_path_auth(path, security_filter, search_client)
+
+        groups_hash = hashlib.sha256("\n".join(sorted(auth_claims.get("groups", []))).encode()).hexdigest()
+        cache_key = (auth_claims.get("oid", ""), groups_hash, path)
+        allowed = self.path_auth_cache.get(cache_key)
+        if allowed is not None:
+            return allowed
+        path_auth_cache = self.path_auth_cache
+        generation = self.path_auth_generation
+
+        async def check_and_store() -> bool:
+            allowed = await self.search_path_auth(path, security_filter, search_client)
+            if generation == self.path_auth_generation:
+                path_auth_cache.set(cache_key, allowed)
+            return allowed
+
+        # The citations of an answer are often requested together, so concurrent checks of a path are shared
+        return await self.path_auth_checks.run((generation, cache_key), check_and_store)
+
+    @staticmethod
+    async def search_path_auth(path: str, security_filter: str, search_client: SearchClient) -> bool:
         # Filter down to only chunks that are from the specific source file
         # Sourcepage is used for GPT-4V
         # Replace ' with '' to escape the single quote for the filter
@@ -284,58 +487,30 @@ class AuthenticationHelper:
 
         return allowed
 
-    async def create_pem_format(self, jwks, token):
-        unverified_header = jwt.get_unverified_header(token)
-        for key in jwks["keys"]:
-            if key["kid"] == unverified_header["kid"]:
-                # Construct the RSA public key
-                public_numbers = rsa.RSAPublicNumbers(
-                    e=int.from_bytes(base64.urlsafe_b64decode(key["e"] + "=="), byteorder="big"),
-                    n=int.from_bytes(base64.urlsafe_b64decode(key["n"] + "=="), byteorder="big"),
-                )
-                public_key = public_numbers.public_key()
-
-                # Convert to PEM format
-                pem_key = public_key.public_bytes(
-                    encoding=serialization.Encoding.PEM, format=serialization.PublicFormat.SubjectPublicKeyInfo
-                )
-                rsa_key = pem_key
-                return rsa_key
+    def invalidate_path_auth(self):
+        """Discards the cached access checks, such as when the app changes the content of the index."""
+        self.path_auth_generation += 1
+        if self.path_auth_cache is not None:
+            self.path_auth_cache.clear()
 
     # See https://github.com/Azure-Samples/ms-identity-python-on-behalf-of/blob/939be02b11f1604814532fdacc2c2eccd198b755/FlaskAPI/helpers/authorization.py#L44
     async def validate_access_token(self, token: str):
         """
         Validate an access token is issued by Entra
         """
-        jwks = None
-        async for attempt in AsyncRetrying(
-            retry=retry_if_exception_type(AuthError),
-            wait=wait_random_exponential(min=15, max=60),
-            stop=stop_after_attempt(5),
-        ):
-            with attempt:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(url=self.key_url) as resp:
-                        resp_status = resp.status
-                        if resp_status in [500, 502, 503, 504]:
-                            raise AuthError(
-                                error=f"Failed to get keys info: {await resp.text()}", status_code=resp_status
-                            )
-                        jwks = await resp.json()
-
-        if not jwks or "keys" not in jwks:
-            raise AuthError("Unable to get keys to validate auth token.", 401)
-
         rsa_key = None
         issuer = None
         audience = None
         try:
+            unverified_header = jwt.get_unverified_header(token)
             unverified_claims = jwt.decode(token, options={"verify_signature": False})
             issuer = unverified_claims.get("iss")
             audience = unverified_claims.get("aud")
-            rsa_key = await self.create_pem_format(jwks, token)
         except jwt.PyJWTError as exc:
             raise AuthError("Unable to parse authorization token.", 401) from exc
+        kid = unverified_header.get("kid")
+        if kid:
+            rsa_key = await self.jwks_cache.get_key(kid)
         if not rsa_key:
             raise AuthError("Unable to find appropriate key", 401)
 
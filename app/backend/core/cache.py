@@ -0,0 +1,149 @@
+import asyncio
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Hashable, Iterator
+from dataclasses import dataclass
+from typing import Callable, Generic, Optional, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def as_dict(self) -> dict[str, float]:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "hit_rate": self.hit_rate}
+
+
+class TTLCache(Generic[K, V]):
+    """
+    In-process cache with least-recently-used eviction and an optional per-entry time-to-live.
+    With max_size, entries are also evicted once the total size of the values (as measured by get_size)
+    exceeds it, and values larger than max_size are not stored at all.
+    It is not thread-safe, and is meant to be shared by coroutines running on a single event loop.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl_seconds: Optional[float] = None,
+        timer: Callable[[], float] = time.monotonic,
+        max_size: Optional[int] = None,
+        get_size: Callable[[V], int] = lambda value: 1,
+    ):
+        if max_entries <= 0:
+            raise ValueError("max_entries must be greater than 0")
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.timer = timer
+        self.max_size = max_size
+        self.get_size = get_size
+        self.size = 0
+        self.stats = CacheStats()
+        self._entries: OrderedDict[K, tuple[V, Optional[float], int]] = OrderedDict()
+
+    def _is_expired(self, expires_at: Optional[float]) -> bool:
+        return expires_at is not None and expires_at <= self.timer()
+
+    def _remove(self, key: K) -> V:
+        value, _, size = self._entries.pop(key)
+        self.size -= size
+        return value
+
+    def get(self, key: K) -> Optional[V]:
+        entry = self._entries.get(key)
+        if entry is None or self._is_expired(entry[1]):
+            if entry is not None:
+                self._remove(key)
+            self.stats.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats.hits += 1
+        return entry[0]
+
+    def set(self, key: K, value: V, ttl_seconds: Optional[float] = None):
+        if key in self._entries:
+            self._remove(key)
+        size = self.get_size(value)
+        if self.max_size is not None and size > self.max_size:
+            return
+        ttl = ttl_seconds if ttl_seconds is not None else self.ttl_seconds
+        expires_at = self.timer() + ttl if ttl is not None else None
+        self._entries[key] = (value, expires_at, size)
+        self.size += size
+        while len(self._entries) > self.max_entries or (self.max_size is not None and self.size > self.max_size):
+            self._remove(next(iter(self._entries)))
+            self.stats.evictions += 1
+
+    def pop(self, key: K) -> Optional[V]:
+        return self._remove(key) if key in self._entries else None
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def items(self) -> Iterator[tuple[K, V]]:
+        """Iterates over unexpired entries, without affecting their recency or the hit/miss counters."""
+        for key, (value, expires_at, _) in list(self._entries.items()):
+            if self._is_expired(expires_at):
+                self._remove(key)
+            else:
+                yield key, value
+
+    def __contains__(self, key: object) -> bool:
+        entry = self._entries.get(key)  # type: ignore[arg-type]
+        return entry is not None and not self._is_expired(entry[1])
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class AsyncCoalescer(Generic[K, V]):
+    """
+    Runs at most one computation per key at a time.
+    Callers that ask for a key while its computation is in flight wait for, and share, its result.
+    """
+
+    def __init__(self):
+        self._in_flight: dict[K, asyncio.Future[V]] = {}
+
+    async def run(self, key: K, compute: Callable[[], Awaitable[V]]) -> V:
+        while (future := self._in_flight.get(key)) is not None:
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # Retry if the caller running the computation was cancelled, rather than this caller
+                if not future.cancelled():
+                    raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as error:
+            future.set_exception(error)
+            # Mark the exception as retrieved, since there may be no other callers waiting for it
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+        future.set_result(result)
+        return result
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._in_flight
+
+    def __len__(self) -> int:
+        return len(self._in_flight)
@@ -0,0 +1,404 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from collections.abc import Awaitable
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, Callable, Optional
+
+# A file on the local disk, so that all the worker processes of the app share the job log
+DEFAULT_JOB_LOG_PATH = os.path.join(tempfile.gettempdir(), "upload_jobs.sqlite3")
+
+
+class UploadJobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+@dataclass
+class UploadJob:
+    user_oid: str
+    filename: str
+    url: Optional[str] = None
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: UploadJobStatus = UploadJobStatus.QUEUED
+    attempts: int = 0
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "filename": self.filename,
+            "status": self.status.value,
+            "attempts": self.attempts,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class UploadJobLog:
+    """
+    Records upload jobs in a SQLite database, so that their status survives restarts and is shared by the app's
+    worker processes that use the same file. A ":memory:" database is private to the process, so it's only fit
+    for tests and single-process apps.
+
+    Each unfinished job is leased by the process that runs it, which renews the lease while it's alive,
+    so that jobs whose process has stopped can be claimed and resumed by another one.
+    A cancelled job stays cancelled, so that the process running it finds out when it next saves the job.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS upload_jobs (
+            id TEXT PRIMARY KEY,
+            user_oid TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            url TEXT,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL,
+            error TEXT,
+            created_at REAL NOT NULL,
+            finished_at REAL,
+            owner TEXT,
+            leased_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS upload_jobs_status ON upload_jobs (status, leased_at);
+        CREATE INDEX IF NOT EXISTS upload_jobs_finished_at ON upload_jobs (finished_at);
+    """
+
+    UNFINISHED = (UploadJobStatus.QUEUED.value, UploadJobStatus.RUNNING.value)
+
+    def __init__(self, path: str = DEFAULT_JOB_LOG_PATH):
+        # Statements are run from worker threads (one at a time) and committed as soon as they're executed
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock:
+            if path != ":memory:":
+                # Lets the other processes read the status of jobs while one of them is writing
+                self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript(self.SCHEMA)
+
+    @staticmethod
+    def to_job(row: sqlite3.Row) -> UploadJob:
+        return UploadJob(
+            id=row["id"],
+            user_oid=row["user_oid"],
+            filename=row["filename"],
+            url=row["url"],
+            status=UploadJobStatus(row["status"]),
+            attempts=row["attempts"],
+            error=row["error"],
+            created_at=row["created_at"],
+            finished_at=row["finished_at"],
+        )
+
+    def save(self, job: UploadJob, owner: str) -> bool:
+        """Saves the job, unless it has been cancelled. Returns whether it was saved."""
+        with self.lock:
+            cursor = self.connection.execute(
+                """
+                INSERT INTO upload_jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    url = excluded.url,
+                    status = excluded.status,
+                    attempts = excluded.attempts,
+                    error = excluded.error,
+                    finished_at = excluded.finished_at,
+                    owner = excluded.owner,
+                    leased_at = excluded.leased_at
+                WHERE upload_jobs.status != ?
+                """,
+                (
+                    job.id,
+                    job.user_oid,
+                    job.filename,
+                    job.url,
+                    job.status.value,
+                    job.attempts,
+                    job.error,
+                    job.created_at,
+                    job.finished_at,
+                    owner,
+                    time.time(),
+                    UploadJobStatus.CANCELLED.value,
+                ),
+            )
+        return cursor.rowcount > 0
+
+    def get(self, job_id: str) -> Optional[UploadJob]:
+        with self.lock:
+            row = self.connection.execute("SELECT * FROM upload_jobs WHERE id = ?", (job_id,)).fetchone()
+        return self.to_job(row) if row else None
+
+    def cancel(self, user_oid: str, filename: str):
+        """Cancels the user's unfinished jobs for the file"""
+        with self.lock:
+            self.connection.execute(
+                "UPDATE upload_jobs SET status = ?, finished_at = ? WHERE user_oid = ? AND filename = ? AND status IN (?, ?)",
+                (UploadJobStatus.CANCELLED.value, time.time(), user_oid, filename, *self.UNFINISHED),
+            )
+
+    def has_newer_job(self, job: UploadJob) -> bool:
+        """Returns whether the user uploaded the file again after this job was submitted (and didn't delete it again)"""
+        with self.lock:
+            row = self.connection.execute(
+                """
+                SELECT 1 FROM upload_jobs
+                WHERE user_oid = ? AND filename = ? AND created_at >= ? AND id != ? AND status != ?
+                LIMIT 1
+                """,
+                (job.user_oid, job.filename, job.created_at, job.id, UploadJobStatus.CANCELLED.value),
+            ).fetchone()
+        return row is not None
+
+    def renew(self, owner: str):
+        with self.lock:
+            self.connection.execute(
+                "UPDATE upload_jobs SET leased_at = ? WHERE owner = ? AND status IN (?, ?)",
+                (time.time(), owner, *self.UNFINISHED),
+            )
+
+    def claim_expired(self, owner: str, lease_seconds: float) -> list[UploadJob]:
+        """Claims the unfinished jobs whose lease has expired, because the process running them has stopped"""
+        now = time.time()
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT * FROM upload_jobs WHERE status IN (?, ?) AND leased_at < ?",
+                (*self.UNFINISHED, now - lease_seconds),
+            ).fetchall()
+            claimed = []
+            for row in rows:
+                # Only one process claims each job, even if several are recovering jobs at the same time
+                cursor = self.connection.execute(
+                    "UPDATE upload_jobs SET owner = ?, leased_at = ? WHERE id = ? AND owner IS ? AND leased_at = ?",
+                    (owner, now, row["id"], row["owner"], row["leased_at"]),
+                )
+                if cursor.rowcount:
+                    claimed.append(self.to_job(row))
+        return claimed
+
+    def prune(self, finished_before: float):
+        with self.lock:
+            self.connection.execute("DELETE FROM upload_jobs WHERE finished_at < ?", (finished_before,))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class UploadJobs:
+    """
+    Queue of uploaded files to ingest in the background, so that the upload request returns as soon as the file
+    is stored rather than once it has been parsed, embedded and indexed, and bursts of uploads are smoothed out.
+
+    A fixed number of workers ingest the queued files, and users take turns, so that one user uploading many files
+    doesn't hold up everyone else's. Files that fail to be ingested are retried with an exponential backoff,
+    up to MAX_ATTEMPTS times. Every job is recorded in the job log, along with its status, which is kept for
+    status_ttl_seconds after the job finishes.
+
+    When a file is deleted, its jobs are cancelled, in whichever process is running them. A job that was already
+    ingesting the file stops before it indexes the next batch of sections, and then `remove` is called to remove
+    whatever it indexed, unless the file has been uploaded again since, as that would remove the new upload.
+    """
+
+    MAX_ATTEMPTS = 3
+    # How long a process can go without renewing the lease of its unfinished jobs before another process claims them
+    LEASE_SECONDS = 60.0
+
+    def __init__(
+        self,
+        ingest: Callable[[UploadJob], Awaitable[None]],
+        remove: Optional[Callable[[UploadJob], Awaitable[None]]] = None,
+        workers: int = 2,
+        log_path: str = DEFAULT_JOB_LOG_PATH,
+        retry_backoff_seconds: float = 5.0,
+        status_ttl_seconds: float = 24 * 3600,
+    ):
+        self.ingest = ingest
+        self.remove = remove
+        self.workers = workers
+        self.log = UploadJobLog(log_path)
+        self.retry_backoff_seconds = retry_backoff_seconds
+        self.status_ttl_seconds = status_ttl_seconds
+        # Identifies this process as the owner of the jobs it runs
+        self.owner = uuid.uuid4().hex
+        self.active: dict[str, UploadJob] = {}
+        # The queued jobs of each user, in the order the users take turns
+        self.pending: OrderedDict[str, deque[UploadJob]] = OrderedDict()
+        self.available = asyncio.Semaphore(0)
+        self.retries: dict[str, asyncio.TimerHandle] = {}
+        self.tasks: list[asyncio.Task] = []
+
+    async def start(self):
+        await asyncio.to_thread(self.log.prune, time.time() - self.status_ttl_seconds)
+        await self.recover()
+        self.tasks = [asyncio.create_task(self.work()) for _ in range(self.workers)]
+        self.tasks.append(asyncio.create_task(self.keep_leases()))
+
+    async def save(self, job: UploadJob) -> bool:
+        return await asyncio.to_thread(self.log.save, job, self.owner)
+
+    async def submit(self, user_oid: str, filename: str, url: Optional[str] = None) -> UploadJob:
+        job = UploadJob(user_oid=user_oid, filename=filename, url=url)
+        await self.save(job)
+        self.enqueue(job)
+        return job
+
+    def enqueue(self, job: UploadJob):
+        self.retries.pop(job.id, None)
+        self.active[job.id] = job
+        self.pending.setdefault(job.user_oid, deque()).append(job)
+        self.available.release()
+
+    def next_job(self) -> UploadJob:
+        user_oid, jobs = next(iter(self.pending.items()))
+        job = jobs.popleft()
+        if jobs:
+            self.pending.move_to_end(user_oid)
+        else:
+            del self.pending[user_oid]
+        return job
+
+    async def work(self):
+        while True:
+            await self.available.acquire()
+            job = self.next_job()
+            try:
+                await self.run(job)
+            except Exception:
+                logging.exception("Error running upload job %s", job.id)
+
+    async def run(self, job: UploadJob):
+        if job.status == UploadJobStatus.CANCELLED:
+            return
+        job.status = UploadJobStatus.RUNNING
+        job.attempts += 1
+        if not await self.save(job):
+            # The file was deleted while the job was queued, and another process cancelled the job
+            self.finish_cancelled(job)
+            return
+        try:
+            await self.ingest(job)
+        except Exception as error:
+            if await self.is_cancelled(job):
+                await self.remove_cancelled(job)
+                return
+            job.error = str(error) or type(error).__name__
+            # Files that were removed or belong to someone else won't be found by trying again
+            retryable = not isinstance(error, (FileNotFoundError, PermissionError))
+            if retryable and job.attempts < self.MAX_ATTEMPTS:
+                delay = self.retry_backoff_seconds * 2 ** (job.attempts - 1)
+                logging.warning("Error ingesting uploaded file %s, retrying in %s seconds", job.filename, delay)
+                job.status = UploadJobStatus.QUEUED
+                await self.save(job)
+                self.retries[job.id] = asyncio.get_running_loop().call_later(delay, self.enqueue, job)
+                return
+            logging.exception("Error ingesting uploaded file %s", job.filename)
+            job.status = UploadJobStatus.FAILED
+        else:
+            if await self.is_cancelled(job):
+                await self.remove_cancelled(job)
+                return
+            job.status = UploadJobStatus.SUCCEEDED
+            job.error = None
+        job.finished_at = time.time()
+        self.active.pop(job.id, None)
+        if not await self.save(job):
+            # The file was deleted just as the job finished
+            await self.remove_cancelled(job)
+            return
+        await asyncio.to_thread(self.log.prune, job.finished_at - self.status_ttl_seconds)
+
+    async def cancel(self, user_oid: str, filename: str):
+        """
+        Cancels the user's jobs for the file, such as when the file is deleted: queued jobs won't run,
+        and jobs that are running won't index the file, or have what they indexed removed once they finish
+        """
+        for job in list(self.active.values()):
+            if job.user_oid == user_oid and job.filename == filename:
+                if handle := self.retries.pop(job.id, None):
+                    handle.cancel()
+                if job.status == UploadJobStatus.QUEUED:
+                    # The worker that picks it up from the queue passes over it
+                    self.finish_cancelled(job)
+                else:
+                    # The worker running the job finishes it
+                    job.status = UploadJobStatus.CANCELLED
+        # Jobs running in other processes find out from the job log
+        await asyncio.to_thread(self.log.cancel, user_oid, filename)
+
+    async def is_cancelled(self, job: UploadJob) -> bool:
+        if job.status == UploadJobStatus.CANCELLED:
+            return True
+        saved = await asyncio.to_thread(self.log.get, job.id)
+        return saved is not None and saved.status == UploadJobStatus.CANCELLED
+
+    def finish_cancelled(self, job: UploadJob):
+        job.status = UploadJobStatus.CANCELLED
+        job.finished_at = job.finished_at or time.time()
+        self.active.pop(job.id, None)
+
+    async def remove_cancelled(self, job: UploadJob):
+        self.finish_cancelled(job)
+        if self.remove is None:
+            return
+        # The file's content in the index is shared with any later upload of the same file
+        if await asyncio.to_thread(self.log.has_newer_job, job):
+            logging.info("Upload job for %s was cancelled, and the file has been uploaded again", job.filename)
+            return
+        logging.info("Upload job for %s was cancelled, removing what it ingested", job.filename)
+        await self.remove(job)
+
+    async def recover(self):
+        """Resumes the unfinished jobs of processes that have stopped, such as a previous run of the app"""
+        for job in await asyncio.to_thread(self.log.claim_expired, self.owner, self.LEASE_SECONDS):
+            if job.id in self.active:
+                # Our own lease expired, such as while the event loop was blocked
+                continue
+            if job.status == UploadJobStatus.RUNNING and job.attempts >= self.MAX_ATTEMPTS:
+                job.status = UploadJobStatus.FAILED
+                job.error = "Interrupted"
+                job.finished_at = time.time()
+                await self.save(job)
+            else:
+                logging.info("Resuming upload job for %s", job.filename)
+                job.status = UploadJobStatus.QUEUED
+                await self.save(job)
+                self.enqueue(job)
+
+    async def keep_leases(self):
+        while True:
+            await asyncio.sleep(self.LEASE_SECONDS / 3)
+            try:
+                await asyncio.to_thread(self.log.renew, self.owner)
+                await self.recover()
+            except Exception:
+                logging.exception("Error renewing the leases of upload jobs")
+
+    async def get(self, job_id: str, user_oid: str) -> Optional[UploadJob]:
+        """Returns the job, if it was submitted by the given user"""
+        job = self.active.get(job_id) or await asyncio.to_thread(self.log.get, job_id)
+        if job is None or job.user_oid != user_oid:
+            return None
+        return job
+
+    async def close(self):
+        # Unfinished jobs are left in the job log, to be resumed once their lease expires
+        for handle in self.retries.values():
+            handle.cancel()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.log.close()
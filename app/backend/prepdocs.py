@@ -22,7 +22,7 @@ from prepdocslib.embeddings import (
 )
 from prepdocslib.patentsberta_embeddings import PatentsBertaEmbeddings
 from prepdocslib.fileprocessor import FileProcessor
-from prepdocslib.filestrategy import FileStrategy
+from prepdocslib.filestrategy import FileStrategy, IngestionConcurrency
 from prepdocslib.htmlparser import LocalHTMLParser
 from prepdocslib.integratedvectorizerstrategy import (
     IntegratedVectorizerStrategy,
@@ -432,6 +432,19 @@ if __name__ == "__main__":
         help="Optional. Use this Azure Document Intelligence account key instead of the current user identity to login (use az login to set current user for Azure)",
     )
 
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Optional. Parse and split files in this many worker processes, to use more than one core (default: 0, parse and split in the main process)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=IngestionConcurrency.parse_option,
+        default=IngestionConcurrency(),
+        help="Optional. Number of files to process at once in each stage of ingestion, either one number for all stages or numbers per stage, such as upload=8,parse=4,embed=4,index=2 (default: 1)",
+    )
+
     parser.add_argument("--verbose", "-v", action="store_true", help="Verbose output")
     args = parser.parse_args()
 
@@ -618,6 +631,8 @@ if __name__ == "__main__":
             category=args.category,
             use_content_understanding=use_content_understanding,
             content_understanding_endpoint=os.getenv("AZURE_CONTENTUNDERSTANDING_ENDPOINT"),
+            workers=args.workers,
+            concurrency=args.concurrency,
         )
 
     try:
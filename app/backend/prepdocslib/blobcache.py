@@ -0,0 +1,334 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Awaitable
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Optional, cast
+
+from azure.core.exceptions import ResourceNotModifiedError
+from opentelemetry import metrics
+
+if TYPE_CHECKING:
+    from .blobmanager import BlobProperties
+
+logger = logging.getLogger("scripts")
+
+meter = metrics.get_meter(__name__)
+blob_cache_lookups = meter.create_counter(
+    "blob_cache.lookups",
+    description="Blob cache lookups, labelled by result (hit, revalidated or miss) and tier (memory or disk)",
+)
+blob_cache_bytes = meter.create_counter(
+    "blob_cache.bytes",
+    unit="By",
+    description="Bytes of blob content served, labelled by source (memory, disk or storage)",
+)
+
+# Identifies a blob by its storage endpoint, container and path
+BlobCacheKey = tuple[str, str, str]
+
+
+@dataclass
+class CachedBlob:
+    content: bytes
+    properties: "BlobProperties"
+
+    @property
+    def etag(self) -> str:
+        return self.properties["etag"]
+
+
+class BlobCache:
+    """
+    Caches the content of frequently downloaded blobs, such as the documents and figures cited by many answers,
+    so that they're served from memory instead of being downloaded from storage for every request.
+
+    Blobs are keyed by storage endpoint, container and path, and stored along with their ETag.
+    The most recently used blobs are kept in memory up to max_bytes, and blobs larger than max_blob_bytes
+    aren't cached at all. With a directory, blobs are also written to disk (up to max_disk_bytes),
+    so that blobs evicted from memory, or cached by a previous run of the app, don't need to be downloaded again.
+
+    A cached blob is served without checking storage for revalidate_seconds after it was downloaded or last checked.
+    After that, it's requested again with its ETag, and storage only sends the content if the blob has changed.
+    The cache is not thread-safe, and is meant to be shared by coroutines running on a single event loop.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 64 * 1024 * 1024,
+        max_blob_bytes: int = 8 * 1024 * 1024,
+        revalidate_seconds: float = 60,
+        directory: Optional[str] = None,
+        max_disk_bytes: int = 1024 * 1024 * 1024,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        self.max_bytes = max_bytes
+        self.max_blob_bytes = min(max_blob_bytes, max_bytes)
+        self.revalidate_seconds = revalidate_seconds
+        self.max_disk_bytes = max_disk_bytes
+        self.timer = timer
+        self.memory: OrderedDict[BlobCacheKey, CachedBlob] = OrderedDict()
+        self.memory_bytes = 0
+        # When each cached blob was last known to be current, by the time of its download or conditional request
+        self.checked_at: dict[BlobCacheKey, float] = {}
+        self.directory = Path(directory) if directory else None
+        # Maps each blob on disk to its size, from the least to the most recently used
+        self.disk: OrderedDict[BlobCacheKey, int] = OrderedDict()
+        self.disk_bytes = 0
+        if self.directory:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self.load_disk_index()
+
+    def get_disk_path(self, key: BlobCacheKey) -> Path:
+        if self.directory is None:
+            raise ValueError("The blob cache has no directory")
+        return self.directory / hashlib.sha256("\n".join(key).encode()).hexdigest()
+
+    def load_disk_index(self):
+        """Indexes the blobs written to the directory by previous runs, which need to be revalidated before use"""
+        if self.directory is None:
+            return
+        metadata_paths = sorted(self.directory.glob("*.json"), key=lambda path: path.stat().st_mtime)
+        for metadata_path in metadata_paths:
+            try:
+                metadata = json.loads(metadata_path.read_text())
+                key: BlobCacheKey = tuple(metadata["key"])  # type: ignore[assignment]
+                size = metadata_path.with_suffix(".blob").stat().st_size
+            except (OSError, ValueError, KeyError):
+                logger.warning("Ignoring unreadable blob cache entry %s", metadata_path)
+                continue
+            self.disk[key] = size
+            self.disk_bytes += size
+        self.evict_from_disk()
+
+    @staticmethod
+    def dump_properties(properties: "BlobProperties") -> dict[str, Any]:
+        metadata: dict[str, Any] = dict(properties)
+        if last_modified := properties.get("last_modified"):
+            metadata["last_modified"] = last_modified.isoformat()
+        return metadata
+
+    @staticmethod
+    def load_properties(metadata: dict[str, Any]) -> "BlobProperties":
+        properties = cast("BlobProperties", {key: value for key, value in metadata.items() if key != "key"})
+        if last_modified := metadata.get("last_modified"):
+            properties["last_modified"] = datetime.fromisoformat(last_modified)
+        return properties
+
+    def read_from_disk(self, key: BlobCacheKey) -> CachedBlob:
+        path = self.get_disk_path(key)
+        metadata = json.loads(path.with_suffix(".json").read_text())
+        return CachedBlob(content=path.with_suffix(".blob").read_bytes(), properties=self.load_properties(metadata))
+
+    def write_to_disk(self, key: BlobCacheKey, blob: CachedBlob):
+        path = self.get_disk_path(key)
+        # Files are written under temporary names and then renamed, so that readers (including other workers
+        # sharing the directory) never see partial files
+        for suffix, data in (
+            (".blob", blob.content),
+            (".json", json.dumps({"key": key, **self.dump_properties(blob.properties)}).encode()),
+        ):
+            temporary_path = path.with_suffix(f"{suffix}.{os.getpid()}.tmp")
+            temporary_path.write_bytes(data)
+            os.replace(temporary_path, path.with_suffix(suffix))
+
+    def remove_from_disk(self, key: BlobCacheKey):
+        path = self.get_disk_path(key)
+        for suffix in (".json", ".blob"):
+            path.with_suffix(suffix).unlink(missing_ok=True)
+
+    def evict_from_disk(self):
+        while self.disk_bytes > self.max_disk_bytes:
+            key, size = self.disk.popitem(last=False)
+            self.disk_bytes -= size
+            if key not in self.memory:
+                self.checked_at.pop(key, None)
+            self.remove_from_disk(key)
+
+    def set_in_memory(self, key: BlobCacheKey, blob: CachedBlob):
+        if (previous := self.memory.pop(key, None)) is not None:
+            self.memory_bytes -= len(previous.content)
+        self.memory[key] = blob
+        self.memory_bytes += len(blob.content)
+        while self.memory_bytes > self.max_bytes:
+            evicted_key, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= len(evicted.content)
+            if evicted_key not in self.disk:
+                self.checked_at.pop(evicted_key, None)
+
+    async def get(self, key: BlobCacheKey) -> Optional[tuple[CachedBlob, str]]:
+        """Returns the cached blob, from memory or else from disk, and the tier it was found in"""
+        if (blob := self.memory.get(key)) is not None:
+            self.memory.move_to_end(key)
+            return blob, "memory"
+        if key not in self.disk:
+            return None
+        try:
+            blob = await asyncio.to_thread(self.read_from_disk, key)
+        except (OSError, ValueError, KeyError):
+            logger.warning("Removing unreadable blob cache entry for %s", key[2])
+            await self.pop(key)
+            return None
+        self.disk.move_to_end(key)
+        self.set_in_memory(key, blob)
+        return blob, "disk"
+
+    async def set(self, key: BlobCacheKey, blob: CachedBlob):
+        if len(blob.content) > self.max_blob_bytes or not blob.properties.get("etag"):
+            return
+        self.set_in_memory(key, blob)
+        self.checked_at[key] = self.timer()
+        if self.directory is not None:
+            try:
+                await asyncio.to_thread(self.write_to_disk, key, blob)
+            except OSError:
+                logger.warning("Couldn't write blob cache entry for %s", key[2], exc_info=True)
+                return
+            self.disk_bytes += len(blob.content) - self.disk.pop(key, 0)
+            self.disk[key] = len(blob.content)
+            self.evict_from_disk()
+
+    async def pop(self, key: BlobCacheKey):
+        if (blob := self.memory.pop(key, None)) is not None:
+            self.memory_bytes -= len(blob.content)
+        self.checked_at.pop(key, None)
+        if key in self.disk:
+            self.disk_bytes -= self.disk.pop(key)
+            await asyncio.to_thread(self.remove_from_disk, key)
+
+    async def pop_prefix(self, prefix: BlobCacheKey):
+        """Removes all the cached blobs in the container whose paths start with the prefix's path"""
+        endpoint, container, path = prefix
+        for key in [*self.memory, *self.disk]:
+            if key[0] == endpoint and key[1] == container and key[2].startswith(path):
+                await self.pop(key)
+
+    def is_fresh(self, key: BlobCacheKey) -> bool:
+        checked_at = self.checked_at.get(key)
+        return checked_at is not None and self.timer() - checked_at < self.revalidate_seconds
+
+    async def get_fresh(self, key: BlobCacheKey) -> Optional[CachedBlob]:
+        """Returns the cached blob if it doesn't need to be revalidated yet"""
+        if not self.is_fresh(key):
+            return None
+        cached = await self.get(key)
+        return cached[0] if cached else None
+
+    async def get_or_download(
+        self,
+        key: BlobCacheKey,
+        download: Callable[[Optional[str]], Awaitable[Optional[tuple[bytes, "BlobProperties"]]]],
+    ) -> Optional[tuple[bytes, "BlobProperties"]]:
+        """
+        Returns the content and properties of the blob, from the cache if it's still current.
+
+        Args:
+            key: Identifies the blob
+            download: Downloads the blob, or None if not found. When it's passed the ETag of the cached blob,
+                it raises ResourceNotModifiedError if the blob still has that ETag.
+        """
+        cached = await self.get(key)
+        if cached is not None:
+            blob, tier = cached
+            if self.is_fresh(key):
+                self.record_hit("hit", tier, len(blob.content))
+                return blob.content, blob.properties
+            try:
+                result = await download(blob.etag)
+            except ResourceNotModifiedError:
+                self.checked_at[key] = self.timer()
+                self.record_hit("revalidated", tier, len(blob.content))
+                return blob.content, blob.properties
+            # The blob has changed or been removed
+            await self.pop(key)
+        else:
+            result = await download(None)
+
+        blob_cache_lookups.add(1, {"result": "miss"})
+        if result is None:
+            return None
+        content, properties = result
+        blob_cache_bytes.add(len(content), {"source": "storage"})
+        # So that the cached blob can also serve ranges
+        properties.setdefault("size", len(content))
+        await self.set(key, CachedBlob(content=content, properties=properties))
+        return result
+
+    async def open(
+        self,
+        key: BlobCacheKey,
+        offset: Optional[int],
+        length: Optional[int],
+        open_blob: Callable[[Optional[str]], Awaitable[Optional[tuple[AsyncIterator[bytes], "BlobProperties"]]]],
+    ) -> Optional[tuple[AsyncIterator[bytes], "BlobProperties"]]:
+        """
+        Returns the chunks of the blob (or a range of it) and its properties, from the cache if it's still current.
+        Blobs that aren't cached are streamed from storage, and stored once a small enough blob has been read in full.
+
+        Args:
+            key: Identifies the blob
+            offset: The start of the range to read, in bytes (optional)
+            length: The number of bytes to read from offset (optional)
+            open_blob: Starts downloading the blob (or the range), like get_or_download's download
+        """
+        cached = await self.get(key)
+        if cached is not None:
+            blob, tier = cached
+            content = self.get_range(blob.content, offset, length)
+            if self.is_fresh(key):
+                self.record_hit("hit", tier, len(content))
+                return self.iterate(content), blob.properties
+            try:
+                result = await open_blob(blob.etag)
+            except ResourceNotModifiedError:
+                self.checked_at[key] = self.timer()
+                self.record_hit("revalidated", tier, len(content))
+                return self.iterate(content), blob.properties
+            await self.pop(key)
+        else:
+            result = await open_blob(None)
+
+        blob_cache_lookups.add(1, {"result": "miss"})
+        if result is None:
+            return None
+        chunks, properties = result
+        size = properties.get("size")
+        if offset is None and size is not None and size <= self.max_blob_bytes:
+            chunks = self.store_when_read(key, chunks, properties)
+        return self.count_storage_bytes(chunks), properties
+
+    @staticmethod
+    def get_range(content: bytes, offset: Optional[int], length: Optional[int]) -> bytes:
+        if offset is None:
+            return content
+        return content[offset:] if length is None else content[offset : offset + length]
+
+    @staticmethod
+    async def iterate(content: bytes) -> AsyncIterator[bytes]:
+        yield content
+
+    @staticmethod
+    async def count_storage_bytes(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        async for chunk in chunks:
+            blob_cache_bytes.add(len(chunk), {"source": "storage"})
+            yield chunk
+
+    async def store_when_read(
+        self, key: BlobCacheKey, chunks: AsyncIterator[bytes], properties: "BlobProperties"
+    ) -> AsyncIterator[bytes]:
+        parts = []
+        async for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+        # Only reached once the whole blob has been read, and not if the client stops reading it
+        await self.set(key, CachedBlob(content=b"".join(parts), properties=properties))
+
+    def record_hit(self, result: str, tier: str, served_bytes: int):
+        blob_cache_lookups.add(1, {"result": result, "tier": tier})
+        blob_cache_bytes.add(served_bytes, {"source": tier})
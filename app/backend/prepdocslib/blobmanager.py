@@ -2,28 +2,45 @@ import io
 import logging
 import os
 import re
+import time
+from collections import OrderedDict
+from collections.abc import AsyncIterator
+from datetime import datetime
 from pathlib import Path
-from typing import IO, Any, Optional, TypedDict, Union
+from typing import IO, Any, Callable, Optional, TypedDict, Union
 from urllib.parse import unquote
 
+from azure.core import MatchConditions
 from azure.core.credentials_async import AsyncTokenCredential
-from azure.core.exceptions import ResourceNotFoundError
-from azure.storage.blob.aio import BlobServiceClient
+from azure.core.exceptions import (
+    ResourceExistsError,
+    ResourceNotFoundError,
+    ResourceNotModifiedError,
+)
+from azure.storage.blob import StorageErrorCode
+from azure.storage.blob.aio import BlobClient, BlobServiceClient, ContainerClient
 from azure.storage.filedatalake.aio import (
     DataLakeDirectoryClient,
     FileSystemClient,
 )
 from PIL import Image, ImageDraw, ImageFont
 
+from .blobcache import BlobCache
 from .listfilestrategy import File
 
 logger = logging.getLogger("scripts")
 
 
 class BlobProperties(TypedDict, total=False):
-    """Properties of a blob, with optional fields for content settings"""
+    """
+    Properties of a blob, with optional fields for content settings, the entity tag of the blob's current version,
+    when it was last modified and its size in bytes
+    """
 
     content_settings: dict[str, Any]
+    etag: str
+    last_modified: datetime
+    size: int
 
 
 class BaseBlobManager:
@@ -118,6 +135,93 @@ class BaseBlobManager:
         """
         raise NotImplementedError("Subclasses must implement this method")
 
+    async def open_blob(
+        self, blob_path: str, user_oid: Optional[str] = None, offset: Optional[int] = None, length: Optional[int] = None
+    ) -> Optional[tuple[AsyncIterator[bytes], BlobProperties]]:
+        """
+        Starts downloading a blob (or a range of it) from Azure Storage, to be read in chunks rather than all at once.
+
+        Args:
+            blob_path: The path to the blob in the storage
+            user_oid: The user's object ID (optional)
+            offset: The start of the range to download, in bytes (optional)
+            length: The number of bytes to download from offset (optional)
+
+        Returns:
+            Optional[tuple[AsyncIterator[bytes], BlobProperties]]:
+                - A tuple containing an iterator over the chunks of the content and the properties of the whole blob
+                - None if blob not found or access denied
+        """
+        raise NotImplementedError("Subclasses must implement this method")
+
+    async def get_blob_properties(self, blob_path: str, user_oid: Optional[str] = None) -> Optional[BlobProperties]:
+        """
+        Gets the properties of a blob, without downloading its content.
+
+        Args:
+            blob_path: The path to the blob in the storage
+            user_oid: The user's object ID (optional)
+
+        Returns:
+            Optional[BlobProperties]: The properties, or None if blob not found or access denied
+        """
+        raise NotImplementedError("Subclasses must implement this method")
+
+    @staticmethod
+    def get_download_args(
+        etag: Optional[str] = None, offset: Optional[int] = None, length: Optional[int] = None
+    ) -> dict[str, Any]:
+        """
+        The keyword arguments for downloading a range of a blob (if offset is set), and only if it no longer has the
+        given ETag (if etag is set), in which case the download raises ResourceNotModifiedError
+        """
+        download_args: dict[str, Any] = {}
+        if offset is not None:
+            download_args.update(offset=offset, length=length)
+        if etag is not None:
+            download_args.update(etag=etag, match_condition=MatchConditions.IfModified)
+        return download_args
+
+    @staticmethod
+    async def read_chunks(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        # The chunk iterators of the SDKs define __iter__ just to raise an error, which trips up callers (like Quart
+        # responses) that accept both sync and async iterables, so they're wrapped in a plain async generator
+        async for chunk in chunks:
+            yield chunk
+
+    @staticmethod
+    def to_blob_properties(properties: Any) -> BlobProperties:
+        """Converts the properties returned by the Blob Storage or Data Lake SDKs to our BlobProperties format"""
+        content_settings = getattr(properties, "content_settings", None)
+        blob_properties: BlobProperties = {
+            "content_settings": {
+                "content_type": getattr(content_settings, "content_type", None) or "application/octet-stream"
+            }
+        }
+        if etag := getattr(properties, "etag", None):
+            blob_properties["etag"] = etag
+        if last_modified := getattr(properties, "last_modified", None):
+            blob_properties["last_modified"] = last_modified
+        # The properties of a ranged download have the size of the range, and the size of the blob in the content range
+        content_range = getattr(properties, "content_range", None)
+        size = int(content_range.rsplit("/", 1)[1]) if content_range else getattr(properties, "size", None)
+        if size is not None:
+            blob_properties["size"] = size
+        return blob_properties
+
+    async def get_blob_etag(self, blob_path: str, user_oid: Optional[str] = None) -> Optional[str]:
+        """
+        Gets the entity tag of the blob's current version, without downloading its content.
+
+        Args:
+            blob_path: The path to the blob in the storage
+            user_oid: The user's object ID (optional)
+
+        Returns:
+            Optional[str]: The entity tag, or None if blob not found or access denied
+        """
+        raise NotImplementedError("Subclasses must implement this method")
+
 
 class AdlsBlobManager(BaseBlobManager):
     """
@@ -126,7 +230,21 @@ class AdlsBlobManager(BaseBlobManager):
     Images are stored in a separate images subdirectory for better organization.
     """
 
-    def __init__(self, endpoint: str, container: str, credential: AsyncTokenCredential):
+    # Files are uploaded in blocks of this size, several at a time, so that large uploads are sent in parallel
+    # while only a few blocks are held in memory (the SDK's default is a single 100MB block at a time)
+    UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+    UPLOAD_MAX_CONCURRENCY = 4
+    DIRECTORY_CACHE_MAX_ENTRIES = 10000
+
+    def __init__(
+        self,
+        endpoint: str,
+        container: str,
+        credential: AsyncTokenCredential,
+        blob_cache: Optional[BlobCache] = None,
+        directory_cache_ttl_seconds: float = 300,
+        timer: Callable[[], float] = time.monotonic,
+    ):
         """
         Initializes the AdlsBlobManager with the necessary parameters.
 
@@ -134,10 +252,18 @@ class AdlsBlobManager(BaseBlobManager):
             endpoint: The ADLS endpoint URL
             container: The name of the container (file system)
             credential: The credential for accessing ADLS
+            blob_cache: Caches downloaded files (optional)
+            directory_cache_ttl_seconds: How long a directory is trusted to exist with its verified owner,
+                before its ownership is checked again (0 to check it every time)
         """
         self.endpoint = endpoint
         self.container = container
         self.credential = credential
+        self.blob_cache = blob_cache
+        self.directory_cache_ttl_seconds = directory_cache_ttl_seconds
+        self.timer = timer
+        # When each (directory, owner) pair was last verified or created, from the least to the most recent
+        self.verified_directories: OrderedDict[tuple[str, str], float] = OrderedDict()
         self.file_system_client = FileSystemClient(
             account_url=self.endpoint,
             file_system_name=self.container,
@@ -152,23 +278,45 @@ class AdlsBlobManager(BaseBlobManager):
         Ensures that a directory path exists and has proper permissions.
         Creates the entire path in a single operation if it doesn't exist.
 
+        Directories that were recently verified (or created) for the same owner aren't checked again,
+        until directory_cache_ttl_seconds have passed or they're invalidated with invalidate_directories.
+
         Args:
             directory_path: Full path of directory to create (e.g., 'user123/images/mydoc')
             user_oid: The owner to set for all created directories
         """
         directory_client = self.file_system_client.get_directory_client(directory_path)
+        key = (directory_path, user_oid)
+        verified_at = self.verified_directories.get(key)
+        if verified_at is not None and self.timer() - verified_at < self.directory_cache_ttl_seconds:
+            return directory_client
         try:
             await directory_client.get_directory_properties()
             # Check directory properties to ensure it has the correct owner
             props = await directory_client.get_access_control()
             if props.get("owner") != user_oid:
+                self.verified_directories.pop(key, None)
                 raise PermissionError(f"User {user_oid} does not have permission to access {directory_path}")
         except ResourceNotFoundError:
             logger.info("Creating directory path %s", directory_path)
             await directory_client.create_directory()
             await directory_client.set_access_control(owner=user_oid)
+        if self.directory_cache_ttl_seconds > 0:
+            self.verified_directories.pop(key, None)
+            self.verified_directories[key] = self.timer()
+            while len(self.verified_directories) > self.DIRECTORY_CACHE_MAX_ENTRIES:
+                self.verified_directories.popitem(last=False)
         return directory_client
 
+    def invalidate_directories(self, directory_path: Optional[str] = None):
+        """
+        Forgets the verified owners of a directory and its subdirectories (or of all directories, if not given),
+        such as when they're deleted or their ownership is changed, so that they're checked again on next use.
+        """
+        for key in list(self.verified_directories):
+            if directory_path is None or key[0] == directory_path or key[0].startswith(f"{directory_path}/"):
+                del self.verified_directories[key]
+
     async def upload_blob(self, file: Union[File, IO], filename: str, user_oid: str) -> str:
         """
         Uploads a file directly to the user's directory in ADLS (no subdirectory).
@@ -196,7 +344,14 @@ class AdlsBlobManager(BaseBlobManager):
         # Ensure the file is at the beginning
         file_io.seek(0)
 
-        await file_client.upload_data(file_io, overwrite=True)
+        await file_client.upload_data(
+            file_io,
+            overwrite=True,
+            chunk_size=self.UPLOAD_CHUNK_SIZE,
+            max_concurrency=self.UPLOAD_MAX_CONCURRENCY,
+        )
+        if self.blob_cache is not None:
+            await self.blob_cache.pop((self.endpoint, self.container, f"{user_oid}/{filename}"))
 
         # Reset the file position for any subsequent reads
         file_io.seek(0)
@@ -252,6 +407,8 @@ class AdlsBlobManager(BaseBlobManager):
         image_bytes = BaseBlobManager.add_image_citation(image_bytes, document_filename, image_filename, image_page_num)
         logger.info("Uploading document image '%s' to '%s'", image_filename, image_directory_path)
         await file_client.upload_data(image_bytes, overwrite=True, metadata={"UploadedBy": user_oid})
+        if self.blob_cache is not None:
+            await self.blob_cache.pop((self.endpoint, self.container, f"{image_directory_path}/{image_filename}"))
         return unquote(file_client.url)
 
     async def download_blob(
@@ -272,28 +429,25 @@ class AdlsBlobManager(BaseBlobManager):
         if user_oid is None:
             logger.warning("user_oid must be provided for Data Lake Storage operations.")
             return None
+        user_file_path = self._get_user_file_path(blob_path, user_oid)
+        if user_file_path is None:
+            return None
+        directory_path, filename = user_file_path
 
-        # Get the directory path and file name from the blob path
-        path_parts = blob_path.split("/")
-        if len(path_parts) < 2:
-            # If no slashes in path, we assume it's a file in the user's root directory
-            filename = blob_path
-            directory_path = user_oid
-        else:
-            # First verify that the root directory matches the user_oid
-            root_dir = path_parts[0]
-            if root_dir != user_oid:
-                logger.warning(f"User {user_oid} does not have permission to access {blob_path}")
-                return None
-
-            # Get the directory client for the full path except the filename
-            directory_path = "/".join(path_parts[:-1])
-            filename = path_parts[-1]
+        if self.blob_cache is not None:
+            return await self.blob_cache.get_or_download(
+                (self.endpoint, self.container, f"{directory_path}/{filename}"),
+                lambda etag: self._download_blob(directory_path, filename, user_oid, etag),
+            )
+        return await self._download_blob(directory_path, filename, user_oid)
 
+    async def _download_blob(
+        self, directory_path: str, filename: str, user_oid: str, etag: Optional[str] = None
+    ) -> Optional[tuple[bytes, BlobProperties]]:
         try:
             user_directory_client = await self._ensure_directory(directory_path=directory_path, user_oid=user_oid)
             file_client = user_directory_client.get_file_client(filename)
-            download_response = await file_client.download_file()
+            download_response = await file_client.download_file(**self.get_download_args(etag))
             content = await download_response.readall()
 
             # Convert FileProperties to our BlobProperties format
@@ -302,15 +456,123 @@ class AdlsBlobManager(BaseBlobManager):
                     "content_type": download_response.properties.get("content_type", "application/octet-stream")
                 }
             }
+            if etag := download_response.properties.get("etag"):
+                properties["etag"] = etag
 
             return content, properties
         except ResourceNotFoundError:
             logger.warning(f"Directory or file not found: {directory_path}/{filename}")
             return None
+        except ResourceNotModifiedError:
+            raise
         except Exception as e:
             logging.error(f"Error accessing directory {directory_path}: {str(e)}")
             return None
 
+    async def open_blob(
+        self, blob_path: str, user_oid: Optional[str] = None, offset: Optional[int] = None, length: Optional[int] = None
+    ) -> Optional[tuple[AsyncIterator[bytes], BlobProperties]]:
+        if user_oid is None:
+            logger.warning("user_oid must be provided for Data Lake Storage operations.")
+            return None
+        user_file_path = self._get_user_file_path(blob_path, user_oid)
+        if user_file_path is None:
+            return None
+        directory_path, filename = user_file_path
+
+        if self.blob_cache is not None:
+            return await self.blob_cache.open(
+                (self.endpoint, self.container, f"{directory_path}/{filename}"),
+                offset,
+                length,
+                lambda etag: self._open_blob(directory_path, filename, user_oid, offset, length, etag),
+            )
+        return await self._open_blob(directory_path, filename, user_oid, offset, length)
+
+    async def _open_blob(
+        self,
+        directory_path: str,
+        filename: str,
+        user_oid: str,
+        offset: Optional[int] = None,
+        length: Optional[int] = None,
+        etag: Optional[str] = None,
+    ) -> Optional[tuple[AsyncIterator[bytes], BlobProperties]]:
+        try:
+            user_directory_client = await self._ensure_directory(directory_path=directory_path, user_oid=user_oid)
+            file_client = user_directory_client.get_file_client(filename)
+            download_response = await file_client.download_file(**self.get_download_args(etag, offset, length))
+            return self.read_chunks(download_response.chunks()), self.to_blob_properties(download_response.properties)
+        except ResourceNotFoundError:
+            logger.warning(f"Directory or file not found: {directory_path}/{filename}")
+            return None
+        except PermissionError as e:
+            logger.warning(str(e))
+            return None
+
+    async def get_blob_properties(self, blob_path: str, user_oid: Optional[str] = None) -> Optional[BlobProperties]:
+        if user_oid is None:
+            logger.warning("user_oid must be provided for Data Lake Storage operations.")
+            return None
+        user_file_path = self._get_user_file_path(blob_path, user_oid)
+        if user_file_path is None:
+            return None
+        directory_path, filename = user_file_path
+
+        if self.blob_cache is not None:
+            cached = await self.blob_cache.get_fresh((self.endpoint, self.container, f"{directory_path}/{filename}"))
+            if cached is not None:
+                return cached.properties
+        try:
+            user_directory_client = await self._ensure_directory(directory_path=directory_path, user_oid=user_oid)
+            file_client = user_directory_client.get_file_client(filename)
+            return self.to_blob_properties(await file_client.get_file_properties())
+        except ResourceNotFoundError:
+            logger.warning(f"Directory or file not found: {directory_path}/{filename}")
+            return None
+        except PermissionError as e:
+            logger.warning(str(e))
+            return None
+
+    async def get_blob_etag(self, blob_path: str, user_oid: Optional[str] = None) -> Optional[str]:
+        if user_oid is None:
+            logger.warning("user_oid must be provided for Data Lake Storage operations.")
+            return None
+        user_file_path = self._get_user_file_path(blob_path, user_oid)
+        if user_file_path is None:
+            return None
+        directory_path, filename = user_file_path
+
+        try:
+            file_client = self.file_system_client.get_file_client(f"{directory_path}/{filename}")
+            file_properties = await file_client.get_file_properties()
+            return file_properties.etag
+        except ResourceNotFoundError:
+            logger.warning(f"Directory or file not found: {directory_path}/{filename}")
+            return None
+
+    def _get_user_file_path(self, blob_path: str, user_oid: str) -> Optional[tuple[str, str]]:
+        """
+        Splits the blob path into the directory path and file name, if the blob belongs to the user.
+
+        Returns:
+            Optional[tuple[str, str]]: The directory path and file name, or None if access denied
+        """
+        # Get the directory path and file name from the blob path
+        path_parts = blob_path.split("/")
+        if len(path_parts) < 2:
+            # If no slashes in path, we assume it's a file in the user's root directory
+            return user_oid, blob_path
+
+        # First verify that the root directory matches the user_oid
+        root_dir = path_parts[0]
+        if root_dir != user_oid:
+            logger.warning(f"User {user_oid} does not have permission to access {blob_path}")
+            return None
+
+        # Get the directory client for the full path except the filename
+        return "/".join(path_parts[:-1]), path_parts[-1]
+
     async def remove_blob(self, filename: str, user_oid: str) -> None:
         """
         Deletes a file from the user's directory in ADLS and any associated image directories.
@@ -333,6 +595,9 @@ class AdlsBlobManager(BaseBlobManager):
 
         # Try to delete any associated image directories
         image_directory_path = self._get_image_directory_path(filename, user_oid)
+        if self.blob_cache is not None:
+            await self.blob_cache.pop((self.endpoint, self.container, f"{user_oid}/{filename}"))
+            await self.blob_cache.pop_prefix((self.endpoint, self.container, f"{image_directory_path}/"))
         try:
             image_directory_client = await self._ensure_directory(
                 directory_path=image_directory_path, user_oid=user_oid
@@ -343,6 +608,8 @@ class AdlsBlobManager(BaseBlobManager):
             # It's okay if there was no image directory
             logger.debug(f"No image directory found at {image_directory_path}")
             pass
+        finally:
+            self.invalidate_directories(image_directory_path)
 
     async def list_blobs(self, user_oid: str) -> list[str]:
         """
@@ -398,6 +665,7 @@ class BlobManager(BaseBlobManager):
         account: Optional[str] = None,
         resource_group: Optional[str] = None,
         subscription_id: Optional[str] = None,
+        blob_cache: Optional[BlobCache] = None,
     ):
         self.endpoint = endpoint
         self.credential = credential
@@ -406,29 +674,80 @@ class BlobManager(BaseBlobManager):
         self.resource_group = resource_group
         self.subscription_id = subscription_id
         self.image_container = image_container
+        self.blob_cache = blob_cache
         self.blob_service_client = BlobServiceClient(
-            account_url=self.endpoint, credential=self.credential, max_single_put_size=4 * 1024 * 1024
+            account_url=self.endpoint,
+            credential=self.credential,
+            max_single_put_size=4 * 1024 * 1024,
+            # Downloads that are streamed (such as for the /content route) hold up to one chunk in memory at a time
+            max_single_get_size=4 * 1024 * 1024,
+            max_chunk_get_size=4 * 1024 * 1024,
         )
+        self.container_client: Optional[ContainerClient] = None
+        # Whether the container is known to exist, so that it's only checked until it's been seen (or created),
+        # and again after an operation finds that it's gone
+        self.container_exists = False
 
     async def close_clients(self):
         await self.blob_service_client.close()
 
+    def _get_container_client(self) -> ContainerClient:
+        if self.container_client is None:
+            self.container_client = self.blob_service_client.get_container_client(self.container)
+        return self.container_client
+
+    async def _ensure_container(self, create: bool = False) -> bool:
+        """
+        Checks that the container exists (creating it if create is True), unless it's already known to exist.
+
+        Returns:
+            bool: Whether the container exists
+        """
+        if self.container_exists:
+            return True
+        container_client = self._get_container_client()
+        if await container_client.exists():
+            self.container_exists = True
+        elif create:
+            try:
+                await container_client.create_container()
+            except ResourceExistsError:
+                # Created by another worker or process since it was checked
+                pass
+            self.container_exists = True
+        return self.container_exists
+
+    def _check_container_not_found(self, error: ResourceNotFoundError):
+        """Marks the container as missing when an operation failed because of it, rather than a missing blob"""
+        if getattr(error, "error_code", None) == StorageErrorCode.CONTAINER_NOT_FOUND:
+            self.container_exists = False
+
+    async def _upload_to_container(self, blob_name: str, data: Union[bytes, IO]) -> BlobClient:
+        await self._ensure_container(create=True)
+        try:
+            return await self._get_container_client().upload_blob(blob_name, data, overwrite=True)
+        except ResourceNotFoundError as error:
+            self._check_container_not_found(error)
+            if self.container_exists:
+                raise
+            logger.info("Container %s no longer exists, creating it again", self.container)
+            await self._ensure_container(create=True)
+            if not isinstance(data, bytes):
+                data.seek(0)
+            return await self._get_container_client().upload_blob(blob_name, data, overwrite=True)
+
     def get_managedidentity_connectionstring(self):
         if not self.account or not self.resource_group or not self.subscription_id:
             raise ValueError("Account, resource group, and subscription ID must be set to generate connection string.")
         return f"ResourceId=/subscriptions/{self.subscription_id}/resourceGroups/{self.resource_group}/providers/Microsoft.Storage/storageAccounts/{self.account};"
 
     async def upload_blob(self, file: File) -> str:
-        container_client = self.blob_service_client.get_container_client(self.container)
-        if not await container_client.exists():
-            await container_client.create_container()
-
         # Re-open and upload the original file
         if file.url is None:
             with open(file.content.name, "rb") as reopened_file:
                 blob_name = self.blob_name_from_file_name(file.content.name)
                 logger.info("Uploading blob for document '%s'", blob_name)
-                blob_client = await container_client.upload_blob(blob_name, reopened_file, overwrite=True)
+                blob_client = await self._upload_to_container(blob_name, reopened_file)
                 file.url = blob_client.url
 
         return unquote(file.url)
@@ -449,13 +768,10 @@ class BlobManager(BaseBlobManager):
             raise ValueError(
                 "user_oid is not supported for BlobManager. Use AdlsBlobManager for user-specific operations."
             )
-        container_client = self.blob_service_client.get_container_client(self.container)
-        if not await container_client.exists():
-            await container_client.create_container()
         image_bytes = self.add_image_citation(image_bytes, document_filename, image_filename, image_page_num)
         blob_name = f"{self.blob_name_from_file_name(document_filename)}/page{image_page_num}/{image_filename}"
         logger.info("Uploading blob for document image '%s'", blob_name)
-        blob_client = await container_client.upload_blob(blob_name, image_bytes, overwrite=True)
+        blob_client = await self._upload_to_container(blob_name, image_bytes)
         return blob_client.url
 
     async def download_blob(
@@ -480,16 +796,24 @@ class BlobManager(BaseBlobManager):
             raise ValueError(
                 "user_oid is not supported for BlobManager. Use AdlsBlobManager for user-specific operations."
             )
-        container_client = self.blob_service_client.get_container_client(self.container)
-        if not await container_client.exists():
+        if self.blob_cache is not None and len(blob_path) > 0:
+            return await self.blob_cache.get_or_download(
+                (self.endpoint, self.container, blob_path), lambda etag: self._download_blob(blob_path, etag)
+            )
+        return await self._download_blob(blob_path)
+
+    async def _download_blob(
+        self, blob_path: str, etag: Optional[str] = None
+    ) -> Optional[tuple[bytes, BlobProperties]]:
+        if not await self._ensure_container():
             return None
         if len(blob_path) == 0:
             logger.warning("Blob path is empty")
             return None
 
-        blob_client = container_client.get_blob_client(blob_path)
+        blob_client = self._get_container_client().get_blob_client(blob_path)
         try:
-            download_response = await blob_client.download_blob()
+            download_response = await blob_client.download_blob(**self.get_download_args(etag))
             if not download_response.properties:
                 logger.warning(f"No blob exists for {blob_path}")
                 return None
@@ -511,28 +835,108 @@ class BlobManager(BaseBlobManager):
                     )
                 }
             }
+            if etag := getattr(download_response.properties, "etag", None):
+                properties["etag"] = etag
 
             return content, properties
+        except ResourceNotFoundError as error:
+            self._check_container_not_found(error)
+            logger.warning("Blob not found: %s", blob_path)
+            return None
+
+    async def open_blob(
+        self, blob_path: str, user_oid: Optional[str] = None, offset: Optional[int] = None, length: Optional[int] = None
+    ) -> Optional[tuple[AsyncIterator[bytes], BlobProperties]]:
+        if user_oid is not None:
+            raise ValueError(
+                "user_oid is not supported for BlobManager. Use AdlsBlobManager for user-specific operations."
+            )
+        if len(blob_path) == 0:
+            logger.warning("Blob path is empty")
+            return None
+        if self.blob_cache is not None:
+            return await self.blob_cache.open(
+                (self.endpoint, self.container, blob_path),
+                offset,
+                length,
+                lambda etag: self._open_blob(blob_path, offset, length, etag),
+            )
+        return await self._open_blob(blob_path, offset, length)
+
+    async def _open_blob(
+        self, blob_path: str, offset: Optional[int] = None, length: Optional[int] = None, etag: Optional[str] = None
+    ) -> Optional[tuple[AsyncIterator[bytes], BlobProperties]]:
+        blob_client = self._get_container_client().get_blob_client(blob_path)
+        try:
+            download_response = await blob_client.download_blob(**self.get_download_args(etag, offset, length))
+        except ResourceNotFoundError as error:
+            self._check_container_not_found(error)
+            logger.warning("Blob not found: %s", blob_path)
+            return None
+        if not download_response.properties:
+            logger.warning(f"No blob exists for {blob_path}")
+            return None
+        return self.read_chunks(download_response.chunks()), self.to_blob_properties(download_response.properties)
+
+    async def get_blob_properties(self, blob_path: str, user_oid: Optional[str] = None) -> Optional[BlobProperties]:
+        if user_oid is not None:
+            raise ValueError(
+                "user_oid is not supported for BlobManager. Use AdlsBlobManager for user-specific operations."
+            )
+        if len(blob_path) == 0:
+            logger.warning("Blob path is empty")
+            return None
+        if self.blob_cache is not None:
+            cached = await self.blob_cache.get_fresh((self.endpoint, self.container, blob_path))
+            if cached is not None:
+                return cached.properties
+        blob_client = self._get_container_client().get_blob_client(blob_path)
+        try:
+            return self.to_blob_properties(await blob_client.get_blob_properties())
+        except ResourceNotFoundError:
+            logger.warning("Blob not found: %s", blob_path)
+            return None
+
+    async def get_blob_etag(self, blob_path: str, user_oid: Optional[str] = None) -> Optional[str]:
+        if user_oid is not None:
+            raise ValueError(
+                "user_oid is not supported for BlobManager. Use AdlsBlobManager for user-specific operations."
+            )
+        if len(blob_path) == 0:
+            logger.warning("Blob path is empty")
+            return None
+        blob_client = self._get_container_client().get_blob_client(blob_path)
+        try:
+            blob_properties = await blob_client.get_blob_properties()
+            return blob_properties.etag
         except ResourceNotFoundError:
             logger.warning("Blob not found: %s", blob_path)
             return None
 
     async def remove_blob(self, path: Optional[str] = None):
-        container_client = self.blob_service_client.get_container_client(self.container)
-        if not await container_client.exists():
+        if not await self._ensure_container():
             return
+        container_client = self._get_container_client()
         if path is None:
             prefix = None
             blobs = container_client.list_blob_names()
         else:
             prefix = os.path.splitext(os.path.basename(path))[0]
             blobs = container_client.list_blob_names(name_starts_with=os.path.splitext(os.path.basename(prefix))[0])
-        async for blob_path in blobs:
-            # This still supports PDFs split into individual pages, but we could remove in future to simplify code
-            if (
-                prefix is not None
-                and (not re.match(rf"{prefix}-\d+\.pdf", blob_path) or not re.match(rf"{prefix}-\d+\.png", blob_path))
-            ) or (path is not None and blob_path == os.path.basename(path)):
-                continue
-            logger.info("Removing blob %s", blob_path)
-            await container_client.delete_blob(blob_path)
+        try:
+            async for blob_path in blobs:
+                # This still supports PDFs split into individual pages, but we could remove in future to simplify code
+                if (
+                    prefix is not None
+                    and (
+                        not re.match(rf"{prefix}-\d+\.pdf", blob_path) or not re.match(rf"{prefix}-\d+\.png", blob_path)
+                    )
+                ) or (path is not None and blob_path == os.path.basename(path)):
+                    continue
+                logger.info("Removing blob %s", blob_path)
+                await container_client.delete_blob(blob_path)
+        except ResourceNotFoundError as error:
+            self._check_container_not_found(error)
+            if self.container_exists:
+                raise
+            # The container was deleted since it was last seen, so there's nothing left to remove
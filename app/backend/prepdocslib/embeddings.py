@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from abc import ABC
 from collections.abc import Awaitable
@@ -12,12 +13,15 @@ from azure.identity.aio import get_bearer_token_provider
 from openai import AsyncAzureOpenAI, AsyncOpenAI, RateLimitError
 from tenacity import (
     AsyncRetrying,
+    RetryCallState,
     retry_if_exception_type,
     stop_after_attempt,
     wait_random_exponential,
 )
 from typing_extensions import TypedDict
 
+from .ratelimiter import RateLimiter
+
 logger = logging.getLogger("scripts")
 
 
@@ -38,9 +42,12 @@ class ExtraArgs(TypedDict, total=False):
 class OpenAIEmbeddings(ABC):
     """
     Contains common logic across both OpenAI and Azure OpenAI embedding services
-    Can split source text into batches for more efficient embedding calls
+    Can split source text into batches for more efficient embedding calls, and send several batches at once.
+    Requests are paced by a RateLimiter, which by default is shared by every client of the same deployment in the process.
     """
 
+    MAX_CONCURRENT_BATCHES = 4
+
     SUPPORTED_BATCH_AOAI_MODEL = {
         "text-embedding-ada-002": {"token_limit": 8100, "max_batch_size": 16},
         "text-embedding-3-small": {"token_limit": 8100, "max_batch_size": 16},
@@ -52,17 +59,52 @@ class OpenAIEmbeddings(ABC):
         "text-embedding-3-large": True,
     }
 
-    def __init__(self, open_ai_model_name: str, open_ai_dimensions: int, disable_batch: bool = False):
+    def __init__(
+        self,
+        open_ai_model_name: str,
+        open_ai_dimensions: int,
+        disable_batch: bool = False,
+        rate_limiter: Optional[RateLimiter] = None,
+    ):
         self.open_ai_model_name = open_ai_model_name
         self.open_ai_dimensions = open_ai_dimensions
         self.disable_batch = disable_batch
+        self._rate_limiter = rate_limiter
 
     async def create_client(self) -> AsyncOpenAI:
         raise NotImplementedError
 
+    def rate_limit_key(self) -> str:
+        """Identifies the deployment whose rate limits the requests count against"""
+        return self.open_ai_model_name
+
+    @property
+    def rate_limiter(self) -> RateLimiter:
+        if self._rate_limiter is None:
+            self._rate_limiter = RateLimiter.shared(self.rate_limit_key())
+        return self._rate_limiter
+
     def before_retry_sleep(self, retry_state):
         logger.info("Rate limited on the OpenAI embeddings API, sleeping before retrying...")
 
+    def wait_before_retry(self, retry_state: RetryCallState) -> float:
+        # When the service said how long to wait, the rate limiter holds back the retry (and every other request)
+        # for that long. Otherwise, back off for a random while.
+        error = retry_state.outcome.exception() if retry_state.outcome else None
+        if isinstance(error, RateLimitError) and self.rate_limiter.retry_after(error.response.headers) is not None:
+            return 0
+        return wait_random_exponential(min=15, max=60)(retry_state)
+
+    async def create_embedding_response(
+        self, client: AsyncOpenAI, input: Union[str, list[str]], token_length: int, dimensions_args: ExtraArgs
+    ):
+        await self.rate_limiter.acquire(token_length)
+        raw_response = await client.embeddings.with_raw_response.create(
+            model=self.open_ai_model_name, input=input, **dimensions_args
+        )
+        self.rate_limiter.update(raw_response.headers)
+        return raw_response.parse()
+
     def calculate_token_length(self, text: str):
         encoding = tiktoken.encoding_for_model(self.open_ai_model_name)
         return len(encoding.encode(text))
@@ -100,40 +142,43 @@ class OpenAIEmbeddings(ABC):
 
     async def create_embedding_batch(self, texts: list[str], dimensions_args: ExtraArgs) -> list[list[float]]:
         batches = self.split_text_into_batches(texts)
-        embeddings = []
         client = await self.create_client()
-        for batch in batches:
-            async for attempt in AsyncRetrying(
-                retry=retry_if_exception_type(RateLimitError),
-                wait=wait_random_exponential(min=15, max=60),
-                stop=stop_after_attempt(15),
-                before_sleep=self.before_retry_sleep,
-            ):
-                with attempt:
-                    emb_response = await client.embeddings.create(
-                        model=self.open_ai_model_name, input=batch.texts, **dimensions_args
-                    )
-                    embeddings.extend([data.embedding for data in emb_response.data])
-                    logger.info(
-                        "Computed embeddings in batch. Batch size: %d, Token count: %d",
-                        len(batch.texts),
-                        batch.token_length,
-                    )
-
-        return embeddings
+        batch_slots = asyncio.Semaphore(self.MAX_CONCURRENT_BATCHES)
+
+        async def embed_batch(batch: EmbeddingBatch) -> list[list[float]]:
+            async with batch_slots:
+                async for attempt in AsyncRetrying(
+                    retry=retry_if_exception_type(RateLimitError),
+                    wait=self.wait_before_retry,
+                    stop=stop_after_attempt(15),
+                    before_sleep=self.before_retry_sleep,
+                ):
+                    with attempt:
+                        emb_response = await self.create_embedding_response(
+                            client, batch.texts, batch.token_length, dimensions_args
+                        )
+                        logger.info(
+                            "Computed embeddings in batch. Batch size: %d, Token count: %d",
+                            len(batch.texts),
+                            batch.token_length,
+                        )
+            return [data.embedding for data in emb_response.data]
+
+        batch_embeddings = await asyncio.gather(*(embed_batch(batch) for batch in batches))
+        return [embedding for embeddings in batch_embeddings for embedding in embeddings]
 
     async def create_embedding_single(self, text: str, dimensions_args: ExtraArgs) -> list[float]:
         client = await self.create_client()
         async for attempt in AsyncRetrying(
             retry=retry_if_exception_type(RateLimitError),
-            wait=wait_random_exponential(min=15, max=60),
+            wait=self.wait_before_retry,
             stop=stop_after_attempt(15),
             before_sleep=self.before_retry_sleep,
         ):
             with attempt:
-                emb_response = await client.embeddings.create(
-                    model=self.open_ai_model_name, input=text, **dimensions_args
-                )
+                # The token count is estimated as the service does for its rate limits, as the model may not be
+                # known to tiktoken
+                emb_response = await self.create_embedding_response(client, text, len(text) // 4 + 1, dimensions_args)
                 logger.info("Computed embedding for text section. Character count: %d", len(text))
 
         return emb_response.data[0].embedding
@@ -168,8 +213,9 @@ class AzureOpenAIEmbeddingService(OpenAIEmbeddings):
         credential: Union[AsyncTokenCredential, AzureKeyCredential],
         open_ai_custom_url: Union[str, None] = None,
         disable_batch: bool = False,
+        rate_limiter: Optional[RateLimiter] = None,
     ):
-        super().__init__(open_ai_model_name, open_ai_dimensions, disable_batch)
+        super().__init__(open_ai_model_name, open_ai_dimensions, disable_batch, rate_limiter)
         self.open_ai_service = open_ai_service
         if open_ai_service:
             self.open_ai_endpoint = f"https://{open_ai_service}.openai.azure.com"
@@ -181,6 +227,9 @@ class AzureOpenAIEmbeddingService(OpenAIEmbeddings):
         self.open_ai_api_version = open_ai_api_version
         self.credential = credential
 
+    def rate_limit_key(self) -> str:
+        return f"{self.open_ai_endpoint}/{self.open_ai_deployment}"
+
     async def create_client(self) -> AsyncOpenAI:
         class AuthArgs(TypedDict, total=False):
             api_key: str
@@ -217,11 +266,15 @@ class OpenAIEmbeddingService(OpenAIEmbeddings):
         credential: str,
         organization: Optional[str] = None,
         disable_batch: bool = False,
+        rate_limiter: Optional[RateLimiter] = None,
     ):
-        super().__init__(open_ai_model_name, open_ai_dimensions, disable_batch)
+        super().__init__(open_ai_model_name, open_ai_dimensions, disable_batch, rate_limiter)
         self.credential = credential
         self.organization = organization
 
+    def rate_limit_key(self) -> str:
+        return f"openai/{self.organization}/{self.open_ai_model_name}"
+
     async def create_client(self) -> AsyncOpenAI:
         return AsyncOpenAI(api_key=self.credential, organization=self.organization)
 
@@ -1,5 +1,12 @@
+import asyncio
+import io
 import logging
-from typing import Optional
+import os
+import tempfile
+from collections.abc import AsyncGenerator, Awaitable
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Optional
 
 from azure.core.credentials import AzureKeyCredential
 
@@ -8,12 +15,26 @@ from .embeddings import ImageEmbeddings, OpenAIEmbeddings
 from .fileprocessor import FileProcessor
 from .listfilestrategy import File, ListFileStrategy
 from .mediadescriber import ContentUnderstandingDescriber
+from .page import Chunk, Page
+from .pdfparser import LocalPdfParser
+from .pipeline import PipelineProgress, PipelineStage, run_pipeline
 from .searchmanager import SearchManager, Section
 from .strategy import DocumentAction, SearchInfo, Strategy
+from .textsplitter import TextSplitter
 
 logger = logging.getLogger("scripts")
 
 
+def _extract_pdf_pages(content: bytes) -> list[Page]:
+    """Extract the pages of a PDF with the local parser, in a worker process."""
+    return list(LocalPdfParser.extract_pages(io.BytesIO(content)))
+
+
+def _split_pages(splitter: TextSplitter, pages: list[Page]) -> list[Chunk]:
+    """Split pages into chunks, in a worker process."""
+    return list(splitter.split_pages(pages))
+
+
 async def parse_file(
     file: File,
     file_processors: dict[str, FileProcessor],
@@ -21,14 +42,26 @@ async def parse_file(
     blob_manager: Optional[BaseBlobManager] = None,
     image_embeddings_client: Optional[ImageEmbeddings] = None,
     user_oid: Optional[str] = None,
+    executor: Optional[Executor] = None,
 ) -> list[Section]:
+    """
+    Parses a file into sections.
+    If an executor is given, the CPU-bound work (local PDF text extraction and splitting) runs in it,
+    so that it doesn't block the event loop.
+    """
     key = file.file_extension().lower()
     processor = file_processors.get(key)
     if processor is None:
         logger.info("Skipping '%s', no parser found.", file.filename())
         return []
     logger.info("Ingesting '%s'", file.filename())
-    pages = [page async for page in processor.parser.parse(content=file.content)]
+    loop = asyncio.get_running_loop()
+    if executor is not None and isinstance(processor.parser, LocalPdfParser):
+        logger.info("Extracting text from '%s' using local PDF parser (pypdf) in a worker", file.filename())
+        file.content.seek(0)
+        pages = await loop.run_in_executor(executor, _extract_pdf_pages, file.content.read())
+    else:
+        pages = [page async for page in processor.parser.parse(content=file.content)]
     for page in pages:
         for image in page.images:
             if not blob_manager or not image_embeddings_client:
@@ -40,7 +73,13 @@ async def parse_file(
             if image_embeddings_client:
                 image.embedding = await image_embeddings_client.create_embedding_for_image(image.bytes)
     logger.info("Splitting '%s' into sections", file.filename())
-    sections = [Section(chunk, content=file, category=category) for chunk in processor.splitter.split_pages(pages)]
+    if executor is not None:
+        # The splitter only needs the text of the pages, so their images aren't sent to the worker
+        text_pages = [Page(page_num=page.page_num, offset=page.offset, text=page.text) for page in pages]
+        chunks = await loop.run_in_executor(executor, _split_pages, processor.splitter, text_pages)
+    else:
+        chunks = list(processor.splitter.split_pages(pages))
+    sections = [Section(chunk, content=file, category=category) for chunk in chunks]
     # For now, add the images back to each split chunk based off chunk.page_num
     for section in sections:
         section.chunk.images = [
@@ -49,9 +88,55 @@ async def parse_file(
     return sections
 
 
+@dataclass(frozen=True)
+class IngestionConcurrency:
+    """
+    The number of files that FileStrategy processes at once in each stage of ingestion
+    """
+
+    upload: int = 1
+    parse: int = 1
+    embed: int = 1
+    index: int = 1
+
+    @classmethod
+    def parse_option(cls, value: str) -> "IngestionConcurrency":
+        """
+        Parses either a single number for all stages (such as "4"),
+        or numbers for some of the stages (such as "upload=8,embed=4"), where the rest default to 1
+        """
+        if value.strip().isdigit():
+            count = int(value)
+            return cls(upload=count, parse=count, embed=count, index=count)
+        counts: dict[str, int] = {}
+        for part in value.split(","):
+            stage, _, number = part.partition("=")
+            stage = stage.strip()
+            if stage not in cls.__dataclass_fields__ or not number.strip().isdigit():
+                raise ValueError(
+                    f"Invalid concurrency '{part}', expected <stage>=<number> with stage one of upload, parse, embed or index"
+                )
+            counts[stage] = int(number)
+        return cls(**counts)
+
+    def __post_init__(self):
+        if min(self.upload, self.parse, self.embed, self.index) < 1:
+            raise ValueError("Concurrency must be at least 1 for every stage")
+
+
+@dataclass
+class _IngestedFile:
+    file: File
+    sections: list[Section] = field(default_factory=list)
+    document_batches: list[list[dict]] = field(default_factory=list)
+
+
 class FileStrategy(Strategy):
     """
     Strategy for ingesting documents into a search service from files stored either locally or in a data lake storage account
+    Files go through a pipeline of stages (upload, parse, embed and index), so that each stage can work on a different file,
+    with up to the given concurrency of files in each stage.
+    If workers is set, files are parsed and split in a pool of that many worker processes
     """
 
     def __init__(
@@ -69,6 +154,9 @@ class FileStrategy(Strategy):
         category: Optional[str] = None,
         use_content_understanding: bool = False,
         content_understanding_endpoint: Optional[str] = None,
+        workers: Optional[int] = None,
+        concurrency: Optional[IngestionConcurrency] = None,
+        progress_interval: float = 10,
     ):
         self.list_file_strategy = list_file_strategy
         self.blob_manager = blob_manager
@@ -83,6 +171,9 @@ class FileStrategy(Strategy):
         self.category = category
         self.use_content_understanding = use_content_understanding
         self.content_understanding_endpoint = content_understanding_endpoint
+        self.workers = workers
+        self.concurrency = concurrency or IngestionConcurrency()
+        self.progress_interval = progress_interval
 
     def setup_search_manager(self):
         self.search_manager = SearchManager(
@@ -112,18 +203,64 @@ class FileStrategy(Strategy):
     async def run(self):
         self.setup_search_manager()
         if self.document_action == DocumentAction.Add:
-            files = self.list_file_strategy.list()
-            async for file in files:
-                try:
-                    await self.blob_manager.upload_blob(file)
-                    sections = await parse_file(
-                        file, self.file_processors, self.category, self.blob_manager, self.image_embeddings
-                    )
-                    if sections:
-                        await self.search_manager.update_content(sections, url=file.url)
-                finally:
-                    if file:
-                        file.close()
+            executor = ProcessPoolExecutor(max_workers=self.workers) if self.workers else None
+            # Files that have been listed but not yet indexed, to close them if ingestion fails
+            open_files: set[File] = set()
+            progress = PipelineProgress()
+
+            async def list_files() -> AsyncGenerator[_IngestedFile, None]:
+                async for file in self.list_file_strategy.list():
+                    open_files.add(file)
+                    yield _IngestedFile(file)
+
+            def close(item: _IngestedFile):
+                item.file.close()
+                open_files.discard(item.file)
+
+            async def upload(item: _IngestedFile) -> _IngestedFile:
+                await self.blob_manager.upload_blob(item.file)
+                return item
+
+            async def parse(item: _IngestedFile) -> Optional[_IngestedFile]:
+                item.sections = await parse_file(
+                    item.file,
+                    self.file_processors,
+                    self.category,
+                    self.blob_manager,
+                    self.image_embeddings,
+                    executor=executor,
+                )
+                if not item.sections:
+                    close(item)
+                    return None
+                return item
+
+            async def embed(item: _IngestedFile) -> _IngestedFile:
+                item.document_batches = await self.search_manager.create_documents(item.sections, url=item.file.url)
+                return item
+
+            async def index(item: _IngestedFile) -> None:
+                await self.search_manager.upload_documents(item.document_batches)
+                progress.add("sections", len(item.sections))
+                close(item)
+
+            try:
+                await run_pipeline(
+                    list_files(),
+                    [
+                        PipelineStage("upload", self.concurrency.upload, upload),
+                        PipelineStage("parse", self.concurrency.parse, parse),
+                        PipelineStage("embed", self.concurrency.embed, embed),
+                        PipelineStage("index", self.concurrency.index, index),
+                    ],
+                    progress=progress,
+                    report_interval=self.progress_interval,
+                )
+            finally:
+                for file in list(open_files):
+                    file.close()
+                if executor is not None:
+                    executor.shutdown()
         elif self.document_action == DocumentAction.Remove:
             paths = self.list_file_strategy.list_paths()
             async for path in paths:
@@ -147,6 +284,7 @@ class UploadUserFileStrategy:
         search_field_name_embedding: Optional[str] = None,
         embeddings: Optional[OpenAIEmbeddings] = None,
         image_embeddings: Optional[ImageEmbeddings] = None,
+        on_content_changed: Optional[Callable[[], None]] = None,
     ):
         self.file_processors = file_processors
         self.embeddings = embeddings
@@ -161,15 +299,54 @@ class UploadUserFileStrategy:
             embeddings=self.embeddings,
             field_name_embedding=search_field_name_embedding,
             search_images=False,
+            on_content_changed=on_content_changed,
         )
         self.search_field_name_embedding = search_field_name_embedding
 
-    async def add_file(self, file: File, user_oid: str):
+    async def add_file(self, file: File, user_oid: str, is_cancelled: Optional[Callable[[], Awaitable[bool]]] = None):
         sections = await parse_file(
             file, self.file_processors, None, self.blob_manager, self.image_embeddings, user_oid=user_oid
         )
+        if sections and is_cancelled and await is_cancelled():
+            logger.info("Ingestion of '%s' was cancelled, skipping indexing", file.filename())
+            return
         if sections:
-            await self.search_manager.update_content(sections, url=file.url)
+            await self.search_manager.update_content(sections, url=file.url, is_cancelled=is_cancelled)
+
+    async def add_uploaded_file(
+        self,
+        filename: str,
+        user_oid: str,
+        url: Optional[str] = None,
+        is_cancelled: Optional[Callable[[], Awaitable[bool]]] = None,
+    ):
+        """
+        Ingests a file that the user has already uploaded, reading it back from their directory.
+        The file is streamed to a temporary file rather than into memory, so large files don't need to fit in memory
+        while they're parsed.
+
+        Args:
+            filename: The name of the file in the user's directory
+            user_oid: The user's object ID
+            url: The URL of the uploaded file, used as the source of the indexed content
+            is_cancelled: Checked before computing embeddings and before uploading each batch of sections to the index,
+                to stop indexing if the file was deleted while it was being ingested
+        """
+        result = await self.blob_manager.open_blob(filename, user_oid=user_oid)
+        if result is None:
+            raise FileNotFoundError(f"Uploaded file {filename} not found")
+        chunks, _ = result
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, os.path.basename(filename))
+            with open(path, "wb") as temporary_file:
+                async for chunk in chunks:
+                    temporary_file.write(chunk)
+            with open(path, "rb") as content:
+                await self.add_file(
+                    File(content=content, url=url, acls={"oids": [user_oid]}),
+                    user_oid=user_oid,
+                    is_cancelled=is_cancelled,
+                )
 
     async def remove_file(self, filename: str, oid: str):
         if filename is None or filename == "":
@@ -30,6 +30,10 @@ class Page:
     text: str
     images: list[ImageOnPage] = field(default_factory=list)
 
+    def __reduce__(self):
+        # Pickled as a tuple of its fields rather than its __dict__, as pages are sent to worker processes for splitting
+        return (Page, (self.page_num, self.offset, self.text, self.images))
+
 
 @dataclass
 class Chunk:
@@ -47,3 +51,7 @@ class Chunk:
     page_num: int
     text: str
     images: list[ImageOnPage] = field(default_factory=list)
+
+    def __reduce__(self):
+        # Pickled as a tuple of its fields rather than its __dict__, as chunks are sent back from worker processes
+        return (Chunk, (self.page_num, self.text, self.images))
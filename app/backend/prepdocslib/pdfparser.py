@@ -1,8 +1,9 @@
 import html
 import io
+import itertools
 import logging
 import uuid
-from collections.abc import AsyncGenerator
+from collections.abc import AsyncGenerator, Generator
 from enum import Enum
 from typing import IO, Optional, Union
 
@@ -41,6 +42,12 @@ class LocalPdfParser(Parser):
     async def parse(self, content: IO) -> AsyncGenerator[Page, None]:
         logger.info("Extracting text from '%s' using local PDF parser (pypdf)", content.name)
 
+        for page in LocalPdfParser.extract_pages(content):
+            yield page
+
+    @staticmethod
+    def extract_pages(content: IO) -> Generator[Page, None, None]:
+        """Extract the text of each page. This is CPU-bound, so it can also be run in a worker process."""
         reader = PdfReader(content)
         pages = reader.pages
         offset = 0
@@ -176,26 +183,28 @@ class DocumentAnalysisParser(Parser):
                 for table_idx, table in enumerate(tables_on_page):
                     for span in table.spans:
                         # replace all table spans with "table_id" in table_chars array
-                        for i in range(span.length):
-                            idx = span.offset - page_offset + i
-                            if idx >= 0 and idx < page_length:
-                                mask_chars[idx] = (ObjectType.TABLE, table_idx)
+                        start = max(span.offset - page_offset, 0)
+                        end = min(span.offset - page_offset + span.length, page_length)
+                        if start < end:
+                            mask_chars[start:end] = [(ObjectType.TABLE, table_idx)] * (end - start)
                 # mark all positions of the figure spans in the page
                 for figure_idx, figure in enumerate(figures_on_page):
                     for span in figure.spans:
                         # replace all figure spans with "figure_id" in figure_chars array
-                        for i in range(span.length):
-                            idx = span.offset - page_offset + i
-                            if idx >= 0 and idx < page_length:
-                                mask_chars[idx] = (ObjectType.FIGURE, figure_idx)
+                        start = max(span.offset - page_offset, 0)
+                        end = min(span.offset - page_offset + span.length, page_length)
+                        if start < end:
+                            mask_chars[start:end] = [(ObjectType.FIGURE, figure_idx)] * (end - start)
 
-                # build page text by replacing characters in table spans with table html
+                # build page text by replacing the runs of characters in table spans with table html
                 page_text = ""
                 added_objects = set()  # set of object types todo mypy
-                for idx, mask_char in enumerate(mask_chars):
+                idx = 0
+                for mask_char, run in itertools.groupby(mask_chars):
+                    run_length = len(list(run))
                     object_type, object_idx = mask_char
                     if object_type == ObjectType.NONE:
-                        page_text += analyze_result.content[page_offset + idx]
+                        page_text += analyze_result.content[page_offset + idx : page_offset + idx + run_length]
                     elif object_type == ObjectType.TABLE:
                         if object_idx is None:
                             raise ValueError("Expected object_idx to be set")
@@ -214,6 +223,7 @@ class DocumentAnalysisParser(Parser):
                             page_images.append(image_on_page)
                             page_text += image_on_page.description
                             added_objects.add(mask_char)
+                    idx += run_length
                 # We remove these comments since they are not needed and skew the page numbers
                 page_text = page_text.replace("<!-- PageBreak -->", "")
                 # We remove excess newlines at the beginning and end of the page
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import time
+from collections.abc import AsyncIterator, Awaitable
+from dataclasses import dataclass
+from typing import Callable, Generic, Optional, TypeVar
+
+logger = logging.getLogger("scripts")
+
+T = TypeVar("T")
+
+
+@dataclass
+class PipelineStage(Generic[T]):
+    """
+    A stage of a pipeline, which processes up to `concurrency` items at once.
+    `process` returns the item to pass on to the next stage, or None to drop it.
+    """
+
+    name: str
+    concurrency: int
+    process: Callable[[T], Awaitable[Optional[T]]]
+
+
+class PipelineProgress:
+    """
+    Counts the items completed by each stage of a pipeline (and any other counts added to it), to report throughput
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.counts: dict[str, int] = {}
+
+    def add(self, name: str, count: int = 1):
+        self.counts[name] = self.counts.get(name, 0) + count
+
+    def report(self, queues: Optional[dict[str, asyncio.Queue]] = None) -> str:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        report = f"{elapsed:.0f}s: " + ", ".join(
+            f"{name} {count} ({count / elapsed:.1f}/s)" for name, count in self.counts.items()
+        )
+        if queues:
+            report += "; waiting: " + ", ".join(f"{name} {queue.qsize()}" for name, queue in queues.items())
+        return report
+
+
+async def run_pipeline(
+    source: AsyncIterator[T],
+    stages: list[PipelineStage[T]],
+    progress: Optional[PipelineProgress] = None,
+    report_interval: float = 10,
+):
+    """
+    Passes each item of source through the stages, which run concurrently.
+    Each stage reads from a bounded queue, so a slow stage holds back the stages before it (and the source),
+    rather than letting items pile up in memory.
+    Progress is logged every report_interval seconds, and once all items are done.
+    If a stage fails, the pipeline is cancelled and the error is raised.
+    """
+    progress = progress or PipelineProgress()
+    queues: dict[str, asyncio.Queue[Optional[T]]] = {
+        stage.name: asyncio.Queue(maxsize=2 * stage.concurrency) for stage in stages
+    }
+
+    async def finish(stage_index: int):
+        # Each worker of the stage stops when it gets a None
+        if stage_index < len(stages):
+            for _ in range(stages[stage_index].concurrency):
+                await queues[stages[stage_index].name].put(None)
+
+    async def feed():
+        async for item in source:
+            await queues[stages[0].name].put(item)
+        await finish(0)
+
+    async def work(stage: PipelineStage[T], outbox: Optional[asyncio.Queue[Optional[T]]]):
+        inbox = queues[stage.name]
+        while (item := await inbox.get()) is not None:
+            result = await stage.process(item)
+            progress.add(stage.name)
+            if result is not None and outbox is not None:
+                await outbox.put(result)
+
+    async def run_stage(stage_index: int):
+        stage = stages[stage_index]
+        outbox = queues[stages[stage_index + 1].name] if stage_index + 1 < len(stages) else None
+        await asyncio.gather(*(work(stage, outbox) for _ in range(stage.concurrency)))
+        await finish(stage_index + 1)
+
+    async def report():
+        while True:
+            await asyncio.sleep(report_interval)
+            logger.info("Progress after %s", progress.report(queues))
+
+    tasks = [asyncio.ensure_future(feed())] + [asyncio.ensure_future(run_stage(i)) for i in range(len(stages))]
+    reporter = asyncio.ensure_future(report())
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    finally:
+        reporter.cancel()
+    logger.info("Finished after %s", progress.report())
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import re
+import time
+from collections.abc import Mapping
+from typing import Callable, Optional
+
+logger = logging.getLogger("scripts")
+
+# Durations in x-ratelimit-reset-* headers, such as "1s", "6m0s" or "20ms"
+DURATION_REGEX = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parses a duration such as "6m0s" into seconds, or returns None if it isn't one"""
+    if not value:
+        return None
+    parts = DURATION_REGEX.findall(value)
+    if not parts or "".join(number + unit for number, unit in parts) != value.strip():
+        return None
+    return sum(float(number) * DURATION_UNITS[unit] for number, unit in parts)
+
+
+def parse_number(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class RateBudget:
+    """
+    A budget of requests or tokens per minute.
+    Once the limit is known, the budget refills continuously at limit / 60 per second, up to the limit.
+    Until then, it only knows what the last response said was remaining, until the time that response said it resets.
+    """
+
+    # How long to wait when the budget is used up and there's no limit or reset time to tell when it refills
+    DEFAULT_WAIT = 1.0
+
+    def __init__(self, limit: Optional[float] = None):
+        self.limit = limit
+        self.available: Optional[float] = limit
+        self.reset_at: Optional[float] = None
+        self.updated = 0.0
+
+    def refill(self, now: float):
+        if self.available is not None:
+            if self.limit:
+                self.available = min(self.limit, self.available + (now - self.updated) * self.limit / 60)
+            elif self.reset_at is not None and now >= self.reset_at:
+                # Nothing is known about the new window until the next response
+                self.available = None
+                self.reset_at = None
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Returns how long to wait before the amount is available"""
+        self.refill(now)
+        if self.available is None:
+            return 0
+        if self.limit:
+            # An amount over the limit would never be available, so it waits for a full budget instead
+            amount = min(amount, self.limit)
+        if self.available >= amount:
+            return 0
+        if self.limit:
+            return (amount - self.available) / (self.limit / 60)
+        if self.reset_at is not None:
+            return max(self.reset_at - now, 0)
+        return self.DEFAULT_WAIT
+
+    def take(self, amount: float):
+        if self.available is not None:
+            self.available -= amount
+
+    def update(self, limit: Optional[float], remaining: Optional[float], reset: Optional[float], now: float):
+        self.refill(now)
+        if limit:
+            self.limit = limit
+            if self.available is None:
+                self.available = limit
+        if remaining is not None:
+            # Requests sent since the service counted this one aren't in its count, so never raise the budget
+            self.available = remaining if self.available is None else min(self.available, remaining)
+        if reset is not None:
+            self.reset_at = now + reset
+        elif remaining is not None and not self.limit:
+            # Without a limit or reset time, the remaining budget can't be tracked for long, so forget it soon
+            # rather than wait for a response that would update it
+            self.reset_at = now + self.DEFAULT_WAIT
+
+
+class RateLimiter:
+    """
+    Paces requests to a rate-limited API, such as an OpenAI deployment, to stay within its requests-per-minute
+    and tokens-per-minute limits, instead of sending requests until they fail.
+    The budgets are learned from the x-ratelimit-* headers of the responses (or given upfront),
+    and a retry-after on a rate-limited response holds back every request until it has passed.
+    """
+
+    _shared: dict[str, "RateLimiter"] = {}
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.requests = RateBudget(requests_per_minute)
+        self.tokens = RateBudget(tokens_per_minute)
+        self.blocked_until = 0.0
+        self.clock = clock
+
+    @classmethod
+    def shared(cls, key: str) -> "RateLimiter":
+        """
+        Returns the rate limiter for the given key (such as a deployment), which is shared across the process,
+        so that all the clients of one deployment draw from the same budget
+        """
+        if key not in cls._shared:
+            cls._shared[key] = cls()
+        return cls._shared[key]
+
+    async def acquire(self, tokens: float):
+        """Waits until a request with the given number of tokens can be sent, and takes it from the budget"""
+        while True:
+            now = self.clock()
+            wait = max(self.blocked_until - now, self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+            if wait <= 0:
+                self.requests.take(1)
+                self.tokens.take(tokens)
+                return
+            logger.debug("Waiting %.2fs for the rate limit", wait)
+            await asyncio.sleep(wait)
+
+    def update(self, headers: Mapping[str, str]):
+        """Updates the budgets from the x-ratelimit-* headers of a response"""
+        now = self.clock()
+        for budget, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+            budget.update(
+                limit=parse_number(headers.get(f"x-ratelimit-limit-{kind}")),
+                remaining=parse_number(headers.get(f"x-ratelimit-remaining-{kind}")),
+                reset=parse_duration(headers.get(f"x-ratelimit-reset-{kind}")),
+                now=now,
+            )
+
+    def retry_after(self, headers: Mapping[str, str]) -> Optional[float]:
+        """
+        Updates the budgets from the headers of a rate-limited response, and holds back all requests
+        for as long as its retry-after-ms or retry-after header says. Returns that delay, if any.
+        """
+        self.update(headers)
+        retry_after_ms = parse_number(headers.get("retry-after-ms"))
+        delay = retry_after_ms / 1000 if retry_after_ms is not None else parse_number(headers.get("retry-after"))
+        if delay is not None:
+            self.blocked_until = max(self.blocked_until, self.clock() + delay)
+        return delay
@@ -1,7 +1,8 @@
 import asyncio
 import logging
 import os
-from typing import Optional
+from collections.abc import Awaitable
+from typing import Callable, Optional
 
 from azure.search.documents.indexes.models import (
     AIServicesVisionParameters,
@@ -71,6 +72,7 @@ class SearchManager:
         embeddings: Optional[OpenAIEmbeddings] = None,
         field_name_embedding: Optional[str] = None,
         search_images: bool = False,
+        on_content_changed: Optional[Callable[[], None]] = None,
     ):
         self.search_info = search_info
         self.search_analyzer_name = search_analyzer_name
@@ -91,6 +93,8 @@ class SearchManager:
             self.embedding_dimensions = None
         self.field_name_embedding = field_name_embedding
         self.search_images = search_images
+        # Called after sections are uploaded to or removed from the index, such as to invalidate cached search results
+        self.on_content_changed = on_content_changed
 
     async def create_index(self):
         logger.info("Checking whether search index %s exists...", self.search_info.index_name)
@@ -495,50 +499,75 @@ class SearchManager:
 
             logger.info("Agent %s created successfully", self.search_info.agent_name)
 
-    async def update_content(self, sections: list[Section], url: Optional[str] = None):
+    async def update_content(
+        self,
+        sections: list[Section],
+        url: Optional[str] = None,
+        is_cancelled: Optional[Callable[[], Awaitable[bool]]] = None,
+    ):
+        await self.upload_documents(await self.create_documents(sections, url=url), is_cancelled=is_cancelled)
+
+    async def create_documents(self, sections: list[Section], url: Optional[str] = None) -> list[list[dict]]:
+        """
+        Creates the search documents for the sections, along with their embeddings, in batches for upload_documents.
+        This is separate from the upload so that ingestion can embed one file while it indexes another.
+        """
         MAX_BATCH_SIZE = 1000
         section_batches = [sections[i : i + MAX_BATCH_SIZE] for i in range(0, len(sections), MAX_BATCH_SIZE)]
 
-        async with self.search_info.create_search_client() as search_client:
-            for batch_index, batch in enumerate(section_batches):
-                documents = []
-                for section_index, section in enumerate(batch):
-                    image_fields = {}
-                    if self.search_images:
-                        image_fields = {
-                            "images": [
-                                {
-                                    "url": image.url,
-                                    "description": image.description,
-                                    "boundingbox": image.bbox,
-                                    "embedding": image.embedding,
-                                }
-                                for image in section.chunk.images
-                            ]
-                        }
-                    document = {
-                        "id": f"{section.content.filename_to_id()}-page-{section_index + batch_index * MAX_BATCH_SIZE}",
-                        "content": section.chunk.text,
-                        "category": section.category,
-                        "sourcepage": BlobManager.sourcepage_from_file_page(
-                            filename=section.content.filename(), page=section.chunk.page_num
-                        ),
-                        "sourcefile": section.content.filename(),
-                        **image_fields,
-                        **section.content.acls,
+        document_batches = []
+        for batch_index, batch in enumerate(section_batches):
+            documents = []
+            for section_index, section in enumerate(batch):
+                image_fields = {}
+                if self.search_images:
+                    image_fields = {
+                        "images": [
+                            {
+                                "url": image.url,
+                                "description": image.description,
+                                "boundingbox": image.bbox,
+                                "embedding": image.embedding,
+                            }
+                            for image in section.chunk.images
+                        ]
                     }
-                    documents.append(document)
-                if url:
-                    for document in documents:
-                        document["storageUrl"] = url
-                if self.embeddings:
-                    if self.field_name_embedding is None:
-                        raise ValueError("Embedding field name must be set")
-                    embeddings = await self.embeddings.create_embeddings(
-                        texts=[section.chunk.text for section in batch]
-                    )
-                    for i, document in enumerate(documents):
-                        document[self.field_name_embedding] = embeddings[i]
+                document = {
+                    "id": f"{section.content.filename_to_id()}-page-{section_index + batch_index * MAX_BATCH_SIZE}",
+                    "content": section.chunk.text,
+                    "category": section.category,
+                    "sourcepage": BlobManager.sourcepage_from_file_page(
+                        filename=section.content.filename(), page=section.chunk.page_num
+                    ),
+                    "sourcefile": section.content.filename(),
+                    **image_fields,
+                    **section.content.acls,
+                }
+                documents.append(document)
+            if url:
+                for document in documents:
+                    document["storageUrl"] = url
+            if self.embeddings:
+                if self.field_name_embedding is None:
+                    raise ValueError("Embedding field name must be set")
+                embeddings = await self.embeddings.create_embeddings(texts=[section.chunk.text for section in batch])
+                for i, document in enumerate(documents):
+                    document[self.field_name_embedding] = embeddings[i]
+            document_batches.append(documents)
+        return document_batches
+
+    async def upload_documents(
+        self, document_batches: list[list[dict]], is_cancelled: Optional[Callable[[], Awaitable[bool]]] = None
+    ):
+        """
+        Uploads the batches of documents to the index.
+        If is_cancelled is given, it's checked before each batch, and the remaining batches are skipped once it's true.
+        """
+        async with self.search_info.create_search_client() as search_client:
+            for batch_index, documents in enumerate(document_batches):
+                if is_cancelled and await is_cancelled():
+                    logger.info("Indexing was cancelled, skipping %d batches", len(document_batches) - batch_index)
+                    return
                 logger.info(
                     "Uploading batch %d with %d sections to search index '%s'",
                     batch_index + 1,
@@ -546,6 +575,8 @@ class SearchManager:
                     self.search_info.index_name,
                 )
                 await search_client.upload_documents(documents)
+                if self.on_content_changed:
+                    self.on_content_changed()
 
     async def remove_content(self, path: Optional[str] = None, only_oid: Optional[str] = None):
         logger.info(
@@ -580,3 +611,5 @@ class SearchManager:
                 logger.info("Removed %d sections from index", len(removed_docs))
                 # It can take a few seconds for search results to reflect changes, so wait a bit
                 await asyncio.sleep(2)
+                if self.on_content_changed:
+                    self.on_content_changed()
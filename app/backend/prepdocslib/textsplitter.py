@@ -1,9 +1,11 @@
+import functools
 import logging
 import re
+import string
 from abc import ABC
 from collections.abc import Generator
 from dataclasses import dataclass, field
-from typing import Optional
+from typing import Callable, Optional
 
 import tiktoken
 
@@ -84,6 +86,93 @@ bpe = tiktoken.encoding_for_model(ENCODING_MODEL)
 DEFAULT_OVERLAP_PERCENT = 10  # See semantic search article for 10% overlap performance
 DEFAULT_SECTION_LENGTH = 1000  # Roughly 400-500 tokens for English
 
+_ASCII_LETTERS = frozenset(string.ascii_letters)
+
+# Numbered / roman numeral list or section forms: '1. ', 'II) ', 'III. '
+_NUMBERED_HEADING_REGEX = re.compile(r"^(?:\d+|[IVXLCM]+)[.)]\s")
+
+
+def _char_class(chars: list[str]) -> "re.Pattern[str]":
+    """Compile a regex that matches any one of the given characters."""
+    return re.compile("[" + "".join(re.escape(ch) for ch in chars) + "]")
+
+
+def _span_regex(sentence_endings: list[str]) -> "re.Pattern[str]":
+    """Compile a regex whose matches are the sentence-like spans of a text: each runs up to and including
+    a sentence ending, and the last one may run to the end of the text without one."""
+    endings = "".join(re.escape(ch) for ch in sentence_endings)
+    return re.compile(f"[^{endings}]*[{endings}]|[^{endings}]+")
+
+
+def _nearest_match(pattern: "re.Pattern[str]", text: str, mid: int, reach: int) -> int:
+    """Return the index of the match of a single-character pattern nearest to mid, scanning outward
+    by up to reach - 1 characters on each side (the left match wins a tie), or -1 if there is none."""
+    right_match = pattern.search(text, mid, min(len(text), mid + reach))
+    right_distance = right_match.start() - mid if right_match else reach - 1
+    # A left match only wins if it's no further from mid than the right one, so search that far back
+    start = mid - right_distance
+    left_match = pattern.search(text[start : mid + 1][::-1])
+    if left_match:
+        return mid - left_match.start()
+    return right_match.start() if right_match else -1
+
+
+def _last_word_gap(text: str) -> int:
+    """Return the index of the last space between two ASCII letters in text, or 0 if there is none."""
+    index = text.rfind(" ", 1, len(text) - 1)
+    while index > 0:
+        if text[index - 1] in _ASCII_LETTERS and text[index + 1] in _ASCII_LETTERS:
+            return index
+        index = text.rfind(" ", 1, index)
+    return 0
+
+
+def _first_word_gap(text: str) -> int:
+    """Return the index of the first space between two ASCII letters in text, or len(text) if there is none."""
+    index = text.find(" ", 1, len(text) - 1)
+    while index > 0:
+        if text[index - 1] in _ASCII_LETTERS and text[index + 1] in _ASCII_LETTERS:
+            return index
+        index = text.find(" ", index + 1, len(text) - 1)
+    return len(text)
+
+
+class _TokenCounter:
+    """Counts tokens for the splitter without encoding the same text over and over.
+
+    - Counts are cached, as the same text is often counted again (such as a span that has to be split,
+      or a candidate chunk that is checked before and while shrinking it).
+    - The BPE encodes each piece of a text (such as a word along with its leading space) separately, and a piece
+      always ends between an ASCII letter and a space followed by another ASCII letter. So the token counts of the
+      text on either side of such a gap add up to the count of the whole text. When a fixed text is joined with one
+      that keeps changing, as in the loops that shrink an overlap or fragment until it fits, only the part of the
+      fixed text up to its nearest gap is encoded again along with the changing text.
+    """
+
+    def __init__(self, cache_size: int = 1024):
+        self.cache_size = cache_size
+        self.count: Callable[[str], int] = functools.lru_cache(maxsize=cache_size)(self.encode_count)
+
+    def __reduce__(self):
+        # The cache can't be pickled, so a splitter sent to a worker process starts with an empty one
+        return (_TokenCounter, (self.cache_size,))
+
+    @staticmethod
+    def encode_count(text: str) -> int:
+        return len(bpe.encode(text))
+
+    def with_prefix(self, prefix: str) -> Callable[[str], int]:
+        """Return a function that counts the tokens of prefix + text."""
+        gap = _last_word_gap(prefix)
+        head, tail = prefix[:gap], prefix[gap:]
+        return lambda text: self.count(head) + self.count(tail + text)
+
+    def with_suffix(self, suffix: str) -> Callable[[str], int]:
+        """Return a function that counts the tokens of text + suffix."""
+        gap = _first_word_gap(suffix)
+        head, tail = suffix[:gap], suffix[gap:]
+        return lambda text: self.count(text + head) + self.count(tail)
+
 
 def _safe_concat(a: str, b: str) -> str:
     """Concatenate two non-empty segments, inserting a space only when both sides
@@ -134,7 +223,7 @@ class _ChunkBuilder:
     """Accumulates sentence-like spans for a single page until size limits are reached.
 
     Responsibilities:
-    - Track appended text fragments and their approximate token length.
+    - Track appended text fragments and their running character and token lengths.
     - Decide if a new span can be added without exceeding character or token thresholds.
     - Flush accumulated content into an output list as a `Chunk`.
     - Allow a figure block to be force-appended (even if it overflows) so that headings + figure stay together.
@@ -148,25 +237,26 @@ class _ChunkBuilder:
     max_chars: int
     max_tokens: int
     parts: list[str] = field(default_factory=list)
+    char_len: int = 0
     token_len: int = 0
 
     def can_fit(self, text: str, token_count: int) -> bool:
         if not self.parts:  # always allow first span
             return token_count <= self.max_tokens and len(text) <= self.max_chars
         # Character + token constraints
-        return (len("".join(self.parts)) + len(text) <= self.max_chars) and (
-            self.token_len + token_count <= self.max_tokens
-        )
+        return (self.char_len + len(text) <= self.max_chars) and (self.token_len + token_count <= self.max_tokens)
 
     def add(self, text: str, token_count: int) -> bool:
         if not self.can_fit(text, token_count):
             return False
         self.parts.append(text)
+        self.char_len += len(text)
         self.token_len += token_count
         return True
 
     def force_append(self, text: str):
         self.parts.append(text)
+        self.char_len += len(text)
 
     def flush_into(self, out: list[Chunk]):
         if self.parts:
@@ -174,6 +264,7 @@ class _ChunkBuilder:
             if chunk.strip():
                 out.append(Chunk(page_num=self.page_num, text=chunk))
         self.parts.clear()
+        self.char_len = 0
         self.token_len = 0
 
     # Convenience helpers for readability at call sites
@@ -202,6 +293,13 @@ class SentenceTextSplitter(TextSplitter):
         # - Between chunks on the same page.
         # - Across page boundary ONLY if semantic continuation heuristics pass.
         self.semantic_overlap_percent = 10
+        self.token_counter = _TokenCounter()
+        # Precompiled forms of the character lists above, so that scans run in the regex engine
+        self.sentence_ending_set = frozenset(self.sentence_endings)
+        self.sentence_ending_regex = _char_class(self.sentence_endings)
+        self.word_break_regex = _char_class(self.word_breaks)
+        self.boundary_regex = _char_class(self.word_breaks + self.sentence_endings)
+        self.span_regex = _span_regex(self.sentence_endings)
 
     def _find_split_pos(self, text: str) -> tuple[int, bool]:
         """Find a good split position near midpoint.
@@ -218,28 +316,17 @@ class SentenceTextSplitter(TextSplitter):
             return -1, True
         mid = length // 2
         window_limit = length // 3  # defines central region scan boundary
+        reach = mid - window_limit
 
         # 1. Sentence endings
-        pos = 0
-        while mid - pos > window_limit:
-            left = mid - pos
-            right = mid + pos
-            if left >= 0 and text[left] in self.sentence_endings:
-                return left, False
-            if right < length and text[right] in self.sentence_endings:
-                return right, False
-            pos += 1
+        pos = _nearest_match(self.sentence_ending_regex, text, mid, reach)
+        if pos != -1:
+            return pos, False
 
         # 2. Word breaks
-        pos = 0
-        while mid - pos > window_limit:
-            left = mid - pos
-            right = mid + pos
-            if left >= 0 and text[left] in self.word_breaks:
-                return left, False
-            if right < length and text[right] in self.word_breaks:
-                return right, False
-            pos += 1
+        pos = _nearest_match(self.word_break_regex, text, mid, reach)
+        if pos != -1:
+            return pos, False
 
         # 3. Fallback
         return -1, True
@@ -252,8 +339,7 @@ class SentenceTextSplitter(TextSplitter):
         2. Word-break character near midpoint (space/punctuation) to avoid mid-word cuts.
         3. Midpoint split with symmetric overlap (DEFAULT_OVERLAP_PERCENT).
         """
-        tokens = bpe.encode(text)
-        if len(tokens) <= self.max_tokens_per_section:
+        if self.token_counter.count(text) <= self.max_tokens_per_section:
             yield Chunk(page_num=page_num, text=text)
             return
 
@@ -280,10 +366,7 @@ class SentenceTextSplitter(TextSplitter):
         # Short Title Case or ALL CAPS lines (limited word count) often represent headings
         if len(line_str) <= 80 and (line_str.isupper() or (line_str.istitle() and len(line_str.split()) <= 12)):
             return True
-        import re as _re
-
-        # Numbered / roman numeral list or section forms: '1. ', 'II) ', 'III. '
-        if _re.match(r"^(?:\d+|[IVXLCM]+)[.)]\s", line_str):
+        if _NUMBERED_HEADING_REGEX.match(line_str):
             return True
         if line_str.startswith(("- ", "* ", "• ")):
             return True
@@ -295,7 +378,7 @@ class SentenceTextSplitter(TextSplitter):
         if "<figure" in prev.text.lower() or "<figure" in nxt.text[:40].lower():
             return False
         prev_last = prev.text.rstrip()[-1:] if prev.text.rstrip() else ""
-        if prev_last in self.sentence_endings:  # previous chunk ended cleanly
+        if prev_last in self.sentence_ending_set:  # previous chunk ended cleanly
             return False
         nxt_stripped = nxt.text.lstrip()
         if not nxt_stripped:
@@ -335,17 +418,17 @@ class SentenceTextSplitter(TextSplitter):
 
         # Grow prefix up to 2x target to reach a sentence end / word break boundary
         extension_limit = min(len(next_chunk.text), target * 2)
-        prefix = base_prefix
-        boundary_found = False
-        for i in range(target, extension_limit):
-            ch = next_chunk.text[i]
-            prefix += ch
-            if ch in self.sentence_endings:
-                boundary_found = True
-                break
-            if ch in self.word_breaks and i - target > 20:  # fallback boundary after some progress
-                boundary_found = True
-                break
+        boundaries = [
+            match.start()
+            for match in (
+                self.sentence_ending_regex.search(next_chunk.text, target, extension_limit),
+                # Word breaks are a fallback boundary after some progress
+                self.word_break_regex.search(next_chunk.text, target + 21, extension_limit),
+            )
+            if match
+        ]
+        boundary_found = bool(boundaries)
+        prefix = next_chunk.text[: min(boundaries) + 1 if boundaries else max(target, extension_limit)]
         if not boundary_found:
             # Trim trailing partial word if we stopped without boundary
             while prefix and prefix[-1].isalnum() and len(prefix) > target:
@@ -357,23 +440,21 @@ class SentenceTextSplitter(TextSplitter):
 
         candidate = prev_chunk.text + prefix
         max_chars = int(self.max_section_length * 1.2)
-        if len(candidate) > max_chars or len(bpe.encode(candidate)) > self.max_tokens_per_section:
+        # Only the end of the previous chunk is encoded again along with each (shrinking) prefix
+        count_after_prev = self.token_counter.with_prefix(prev_chunk.text)
+        if len(candidate) > max_chars or count_after_prev(prefix) > self.max_tokens_per_section:
             # Attempt to shrink prefix at word / sentence boundaries from its start
             shrink = prefix
             while shrink and (
-                len(prev_chunk.text + shrink) > max_chars
-                or len(bpe.encode(prev_chunk.text + shrink)) > self.max_tokens_per_section
+                len(prev_chunk.text + shrink) > max_chars or count_after_prev(shrink) > self.max_tokens_per_section
             ):
-                cut_index = 1
-                for i, ch in enumerate(shrink):
-                    if ch in self.word_breaks or ch in self.sentence_endings:
-                        cut_index = i + 1
-                        break
+                boundary = self.boundary_regex.search(shrink)
+                cut_index = boundary.start() + 1 if boundary else 1
                 shrink = shrink[:-cut_index] if cut_index < len(shrink) else ""
             if not shrink:
                 return prev_chunk
             candidate = prev_chunk.text + shrink
-            if len(candidate) > max_chars or len(bpe.encode(candidate)) > self.max_tokens_per_section:
+            if len(candidate) > max_chars or count_after_prev(shrink) > self.max_tokens_per_section:
                 return prev_chunk
         return Chunk(page_num=prev_chunk.page_num, text=candidate)
 
@@ -429,18 +510,8 @@ class SentenceTextSplitter(TextSplitter):
                     continue
 
                 # Process text block: split into sentence-like spans
-                spans: list[str] = []
-                current_chars: list[str] = []
-                for ch in btext:
-                    current_chars.append(ch)
-                    if ch in self.sentence_endings:
-                        spans.append("".join(current_chars))
-                        current_chars = []
-                if current_chars:  # remaining tail
-                    spans.append("".join(current_chars))
-
-                for span in spans:
-                    span_tokens = len(bpe.encode(span))
+                for span in self.span_regex.findall(btext):
+                    span_tokens = self.token_counter.count(span)
                     # If a single span itself exceeds token limit (rare, very long sentence), split it directly
                     if span_tokens > self.max_tokens_per_section:
                         builder.flush_into(page_chunks)
@@ -464,7 +535,7 @@ class SentenceTextSplitter(TextSplitter):
                 first_char = first_new_stripped[:1]
                 if (
                     prev_last_char
-                    and prev_last_char not in self.sentence_endings
+                    and prev_last_char not in self.sentence_ending_set
                     and not first_new_stripped.startswith("#")
                     and first_char
                     and first_char.islower()
@@ -472,7 +543,8 @@ class SentenceTextSplitter(TextSplitter):
                 ):
                     combined_text = _safe_concat(previous_chunk.text, first_new.text)
                     # Only merge if token limit respected (figures already handled earlier)
-                    if len(bpe.encode(combined_text)) <= self.max_tokens_per_section and len(combined_text) <= int(
+                    combined_tokens = self.token_counter.count(combined_text)
+                    if combined_tokens <= self.max_tokens_per_section and len(combined_text) <= int(
                         self.max_section_length * 1.2
                     ):
                         previous_chunk = Chunk(page_num=previous_chunk.page_num, text=combined_text)
@@ -490,13 +562,15 @@ class SentenceTextSplitter(TextSplitter):
                             # Budget calculations for prepending
                             max_chars = int(self.max_section_length * 1.2)
                             first_new_text = page_chunks[0].text
+                            # Only the start of the first new chunk is encoded again along with each fragment
+                            count_before_first = self.token_counter.with_suffix(first_new_text)
 
                             # Determine allowable fragment length (char + token)
                             def fits(candidate: str) -> bool:
                                 combined = candidate + first_new_text
                                 if len(combined) > max_chars:
                                     return False
-                                if len(bpe.encode(combined)) > self.max_tokens_per_section:
+                                if count_before_first(candidate) > self.max_tokens_per_section:
                                     return False
                                 return True
 
@@ -507,10 +581,7 @@ class SentenceTextSplitter(TextSplitter):
                                 # shrink until token constraints are satisfied.
                                 remaining_chars = max_chars - len(first_new_text)  # always > 0 given builder invariants
                                 move_fragment = move_fragment[:remaining_chars]
-                                while (
-                                    move_fragment
-                                    and len(bpe.encode(move_fragment + first_new_text)) > self.max_tokens_per_section
-                                ):
+                                while move_fragment and count_before_first(move_fragment) > self.max_tokens_per_section:
                                     move_fragment = (
                                         move_fragment[:-50] if len(move_fragment) > 50 else move_fragment[:-1]
                                     )
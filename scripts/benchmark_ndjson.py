@@ -0,0 +1,147 @@
+"""Micro-benchmark for the serialization of streamed chat responses.
+
+Compares the previous serialization of a /chat/stream response (converting each
+ChatCompletionChunk with model_dump, and encoding every event with json.dumps and
+dataclasses.asdict) with the current one (reading the chunk delta directly, and
+encoding the events with a per-stream app.NDJSONEncoder).
+
+The response has a context with text sources, base64 images and the full prompt,
+which is sent with the first event and again with the token usage at the end.
+
+Examples:
+  python scripts/benchmark_ndjson.py
+  python scripts/benchmark_ndjson.py --chunks 500 --images 4 --image-kb 500
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import dataclasses
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app", "backend"))
+
+from openai.types import CompletionUsage  # noqa: E402
+from openai.types.chat import ChatCompletionChunk  # noqa: E402
+
+import app  # noqa: E402
+from approaches.approach import DataPoints, ExtraInfo, ThoughtStep  # noqa: E402
+
+
+class AsdictJSONEncoder(json.JSONEncoder):
+    def default(self, o):
+        if dataclasses.is_dataclass(o) and not isinstance(o, type):
+            return dataclasses.asdict(o)
+        return super().default(o)
+
+
+def build_extra_info(num_sources: int, num_images: int, image_kb: int) -> ExtraInfo:
+    text_sources = [
+        f"Benefit_Options-{i}.pdf#page={i}: Northwind Health Plus covers preventive care, prescriptions and vision. "
+        * 8
+        for i in range(num_sources)
+    ]
+    images = [
+        "data:image/png;base64," + base64.b64encode(os.urandom(image_kb * 1024)).decode() for _ in range(num_images)
+    ]
+    prompt = [
+        {"role": "system", "content": "Assistant helps the company employees with their healthcare plan questions."},
+        {
+            "role": "user",
+            "content": [{"type": "text", "text": "\n".join(text_sources)}]
+            + [{"type": "image_url", "image_url": {"url": image}} for image in images],
+        },
+    ]
+    return ExtraInfo(
+        DataPoints(
+            text=text_sources, images=images, citations=[f"Benefit_Options-{i}.pdf" for i in range(num_sources)]
+        ),
+        thoughts=[
+            ThoughtStep("Search using generated search query", "health plan coverage", {"top": num_sources}),
+            ThoughtStep("Prompt to generate answer", prompt, {"model": "gpt-4.1-mini"}),
+        ],
+    )
+
+
+def build_chunks(num_chunks: int) -> list[ChatCompletionChunk]:
+    return [
+        ChatCompletionChunk.model_validate(
+            {
+                "id": "chatcmpl-1",
+                "object": "chat.completion.chunk",
+                "created": 0,
+                "model": "gpt-4.1-mini",
+                "choices": [{"index": 0, "delta": {"role": "assistant", "content": f"token{i} "}}],
+            }
+        )
+        for i in range(num_chunks)
+    ]
+
+
+def previous_stream(extra_info: ExtraInfo, chunks: list[ChatCompletionChunk]) -> list[str]:
+    lines = [
+        json.dumps({"delta": {"role": "assistant"}, "context": extra_info}, ensure_ascii=False, cls=AsdictJSONEncoder)
+    ]
+    for chunk in chunks:
+        event = chunk.model_dump()
+        completion = {
+            "delta": {
+                "content": event["choices"][0]["delta"].get("content"),
+                "role": event["choices"][0]["delta"]["role"],
+            }
+        }
+        lines.append(json.dumps(completion, ensure_ascii=False, cls=AsdictJSONEncoder))
+    lines.append(
+        json.dumps({"delta": {"role": "assistant"}, "context": extra_info}, ensure_ascii=False, cls=AsdictJSONEncoder)
+    )
+    return lines
+
+
+def current_stream(extra_info: ExtraInfo, chunks: list[ChatCompletionChunk]) -> list[str]:
+    encoder = app.NDJSONEncoder()
+    lines = [encoder.encode({"delta": {"role": "assistant"}, "context": extra_info})]
+    for chunk in chunks:
+        delta = chunk.choices[0].delta
+        lines.append(encoder.encode({"delta": {"content": delta.content, "role": delta.role}}))
+    lines.append(encoder.encode({"delta": {"role": "assistant"}, "context": extra_info}))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the serialization of streamed chat responses.")
+    parser.add_argument("--chunks", type=int, default=300, help="Number of streamed completion chunks")
+    parser.add_argument("--sources", type=int, default=5, help="Number of text sources in the context")
+    parser.add_argument("--images", type=int, default=2, help="Number of images in the context")
+    parser.add_argument("--image-kb", type=int, default=200, help="Size of each image, in kilobytes")
+    parser.add_argument("--repeat", type=int, default=20, help="Number of times each stream is serialized")
+    args = parser.parse_args()
+
+    extra_info = build_extra_info(args.sources, args.images, args.image_kb)
+    chunks = build_chunks(args.chunks)
+    # The token usage is added to the last thought before the context is sent again
+    extra_info.thoughts[-1].update_token_usage(
+        CompletionUsage(prompt_tokens=1000, completion_tokens=300, total_tokens=1300)
+    )
+
+    previous_lines = previous_stream(extra_info, chunks)
+    current_lines = [line.rstrip("\n") for line in current_stream(extra_info, chunks)]
+    if previous_lines != current_lines:
+        sys.exit("The serialized streams differ")
+
+    for name, serialize in [("previous", previous_stream), ("current", current_stream)]:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            serialize(extra_info, chunks)
+        elapsed = (time.perf_counter() - start) / args.repeat
+        print(
+            f"{name:>8}: {elapsed * 1000:8.2f} ms per stream, "
+            f"{elapsed / (args.chunks + 2) * 1_000_000:8.2f} µs per event"
+        )
+
+
+if __name__ == "__main__":
+    main()
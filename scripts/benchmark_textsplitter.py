@@ -0,0 +1,103 @@
+"""Benchmark for splitting pages into chunks with the SentenceTextSplitter.
+
+Compares the previous token counting of the splitter (encoding the whole text for
+every check, including each candidate while shrinking an overlap or fragment to fit)
+with the current one (cached counts, and re-encoding only the text near the join).
+
+The corpus is made of the pages in tests/test-data, repeated with their words shuffled,
+so that no two pages are the same. The chunks of both splitters must be identical.
+
+Examples:
+  python scripts/benchmark_textsplitter.py
+  python scripts/benchmark_textsplitter.py --copies 100 --max-tokens 300
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app", "backend"))
+
+from prepdocslib.page import Page  # noqa: E402
+from prepdocslib.textsplitter import SentenceTextSplitter, _TokenCounter  # noqa: E402
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), "..", "tests", "test-data")
+
+
+class PreviousTokenCounter(_TokenCounter):
+    def count(self, text: str) -> int:  # type: ignore[override]
+        return self.encode_count(text)
+
+    def with_prefix(self, prefix):
+        return lambda text: self.encode_count(prefix + text)
+
+    def with_suffix(self, suffix):
+        return lambda text: self.encode_count(text + suffix)
+
+
+def shuffle_words(text: str, rng: random.Random) -> str:
+    # Figures are kept whole, and whitespace stays where it was
+    parts = re.split(r"(<figure.*?</figure>)", text, flags=re.IGNORECASE | re.DOTALL)
+    for index in range(0, len(parts), 2):
+        pieces = re.split(r"(\s+)", parts[index])
+        words = pieces[::2]
+        rng.shuffle(words)
+        pieces[::2] = words
+        parts[index] = "".join(pieces)
+    return "".join(parts)
+
+
+def build_pages(copies: int, seed: int) -> list[Page]:
+    base_pages = []
+    for file_name in ["pages_with_just_text.json", "pages_with_figures.json"]:
+        with open(os.path.join(TEST_DATA, file_name)) as f:
+            base_pages.extend(page["text"] for page in json.load(f))
+    rng = random.Random(seed)
+    pages = []
+    for copy in range(copies):
+        for text in base_pages:
+            text = text if copy == 0 else shuffle_words(text, rng)
+            pages.append(Page(page_num=len(pages), offset=0, text=text))
+    return pages
+
+
+def split(pages: list[Page], max_tokens: int, token_counter: _TokenCounter) -> tuple[list[tuple[int, str]], float]:
+    splitter = SentenceTextSplitter(max_tokens_per_section=max_tokens)
+    splitter.token_counter = token_counter
+    start = time.perf_counter()
+    chunks = [(chunk.page_num, chunk.text) for chunk in splitter.split_pages(pages)]
+    return chunks, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark splitting pages into chunks.")
+    parser.add_argument("--copies", type=int, default=20, help="Number of copies of the test pages in the corpus")
+    parser.add_argument("--max-tokens", type=int, default=500, help="Maximum number of tokens per chunk")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of times the corpus is split")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for shuffling the words of the copies")
+    args = parser.parse_args()
+
+    pages = build_pages(args.copies, args.seed)
+    print(f"{len(pages)} pages, {sum(len(page.text) for page in pages)} characters")
+
+    previous_chunks, _ = split(pages, args.max_tokens, PreviousTokenCounter())
+    current_chunks, _ = split(pages, args.max_tokens, _TokenCounter())
+    if previous_chunks != current_chunks:
+        sys.exit("The chunks differ")
+
+    for name, token_counter_class in [("previous", PreviousTokenCounter), ("current", _TokenCounter)]:
+        elapsed = min(split(pages, args.max_tokens, token_counter_class())[1] for _ in range(args.repeat))
+        print(
+            f"{name:>8}: {elapsed * 1000:8.1f} ms per corpus, "
+            f"{len(current_chunks) / elapsed:8.0f} chunks per second ({len(current_chunks)} chunks)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -717,6 +717,7 @@ async def auth_client(
     monkeypatch.setenv("AZURE_SEARCH_SERVICE", "test-search-service")
     monkeypatch.setenv("AZURE_OPENAI_CHATGPT_MODEL", "gpt-4.1-mini")
     monkeypatch.setenv("USE_USER_UPLOAD", "true")
+    monkeypatch.setenv("UPLOAD_JOB_LOG_PATH", ":memory:")
     monkeypatch.setenv("AZURE_USERSTORAGE_ACCOUNT", "test-userstorage-account")
     monkeypatch.setenv("AZURE_USERSTORAGE_CONTAINER", "test-userstorage-container")
     monkeypatch.setenv("USE_LOCAL_PDF_PARSER", "true")
@@ -756,6 +757,7 @@ async def auth_public_documents_client(
     monkeypatch.setenv("AZURE_SEARCH_SERVICE", "test-search-service")
     monkeypatch.setenv("AZURE_OPENAI_CHATGPT_MODEL", "gpt-4.1-mini")
     monkeypatch.setenv("USE_USER_UPLOAD", "true")
+    monkeypatch.setenv("UPLOAD_JOB_LOG_PATH", ":memory:")
     monkeypatch.setenv("AZURE_USERSTORAGE_ACCOUNT", "test-userstorage-account")
     monkeypatch.setenv("AZURE_USERSTORAGE_CONTAINER", "test-userstorage-container")
     monkeypatch.setenv("USE_LOCAL_PDF_PARSER", "true")
@@ -4,6 +4,7 @@ from io import BytesIO
 from typing import Optional
 
 import aiohttp
+import httpx
 import openai.types
 from azure.cognitiveservices.speech import ResultReason
 from azure.core.credentials_async import AsyncTokenCredential
@@ -68,6 +69,9 @@ class MockBlob:
     async def readinto(self, buffer: BytesIO):
         buffer.write(b"test")
 
+    async def chunks(self):
+        yield await self.readall()
+
 
 class MockAiohttpClientResponse404(aiohttp.ClientResponse):
     def __init__(self, url, body_bytes, headers=None):
@@ -324,13 +328,38 @@ class MockResponse:
             raise Exception(f"HTTP status {self.status}")
 
 
+class MockRawEmbeddingsResponse:
+    def __init__(self, response: openai.types.CreateEmbeddingResponse, headers: dict[str, str]):
+        self.response = response
+        self.headers = httpx.Headers(headers)
+
+    def parse(self) -> openai.types.CreateEmbeddingResponse:
+        return self.response
+
+
+class MockRawEmbeddingsClient:
+    def __init__(self, embeddings_client):
+        self.embeddings_client = embeddings_client
+
+    async def create(self, *args, **kwargs) -> MockRawEmbeddingsResponse:
+        response = await self.embeddings_client.create(*args, **kwargs)
+        return MockRawEmbeddingsResponse(response, getattr(self.embeddings_client, "headers", {}))
+
+
 class MockEmbeddingsClient:
-    def __init__(self, create_embedding_response: openai.types.CreateEmbeddingResponse):
+    def __init__(
+        self, create_embedding_response: openai.types.CreateEmbeddingResponse, headers: Optional[dict[str, str]] = None
+    ):
         self.create_embedding_response = create_embedding_response
+        self.headers = headers or {}
 
     async def create(self, *args, **kwargs) -> openai.types.CreateEmbeddingResponse:
         return self.create_embedding_response
 
+    @property
+    def with_raw_response(self) -> MockRawEmbeddingsClient:
+        return MockRawEmbeddingsClient(self)
+
 
 class MockClient:
     def __init__(self, embeddings_client):
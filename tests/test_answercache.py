@@ -0,0 +1,229 @@
+from typing import Any
+
+import pytest
+
+import app
+from approaches.answercache import (
+    AnswerCache,
+    InMemoryAnswerCacheBackend,
+    RedisAnswerCacheBackend,
+    normalize_question,
+    to_jsonable,
+)
+from approaches.approach import Document, ThoughtStep
+from core.cache import TTLCache
+
+
+class MockTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_ttlcache_evicts_least_recently_used():
+    cache: TTLCache[str, int] = TTLCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats.evictions == 1
+
+
+def test_ttlcache_expires_entries():
+    timer = MockTimer()
+    cache: TTLCache[str, int] = TTLCache(max_entries=10, ttl_seconds=5, timer=timer)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl_seconds=20)
+    timer.now = 10
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    assert list(cache.items()) == [("b", 2)]
+    assert cache.stats.as_dict() == {"hits": 1, "misses": 1, "evictions": 0, "hit_rate": 0.5}
+
+
+def test_ttlcache_invalid_max_entries():
+    with pytest.raises(ValueError):
+        TTLCache(max_entries=0)
+
+
+def test_normalize_question():
+    assert normalize_question("  What is  the capital of France?? ") == "what is the capital of france"
+
+
+def test_to_jsonable_serializes_search_results():
+    document = Document(id="1", content="Paris is the capital of France.", sourcepage="France.pdf#page=1")
+    assert to_jsonable({"thoughts": [ThoughtStep("Search results", [document])]}) == {
+        "thoughts": [{"title": "Search results", "description": [document.serialize_for_results()], "props": None}]
+    }
+
+
+def test_build_scope_separates_filters_and_past_messages():
+    overrides = {"top": 3, "use_answer_cache": True}
+    scope = AnswerCache.build_scope("ChatReadRetrieveReadApproach", [], overrides, "category eq 'a'")
+    assert scope == AnswerCache.build_scope("ChatReadRetrieveReadApproach", [], {"top": 3}, "category eq 'a'")
+    assert scope != AnswerCache.build_scope("ChatReadRetrieveReadApproach", [], overrides, "category eq 'b'")
+    assert scope != AnswerCache.build_scope("RetrieveThenReadApproach", [], overrides, "category eq 'a'")
+    assert scope != AnswerCache.build_scope(
+        "ChatReadRetrieveReadApproach", [{"role": "user", "content": "Hi"}], overrides, "category eq 'a'"
+    )
+    assert scope != AnswerCache.build_scope("ChatReadRetrieveReadApproach", [], overrides, "category eq 'a'", "oid")
+
+
+@pytest.mark.asyncio
+async def test_answer_cache_exact_match():
+    cache = AnswerCache(backend=InMemoryAnswerCacheBackend())
+    lookup = await cache.lookup("scope", "What is the capital of France?")
+    assert lookup.answer is None
+    await cache.store(lookup, {"message": {"role": "assistant", "content": "Paris"}})
+
+    lookup = await cache.lookup("scope", "what is the capital of france")
+    assert lookup.match == "exact"
+    assert lookup.answer == {"message": {"role": "assistant", "content": "Paris"}}
+
+    lookup = await cache.lookup("other-scope", "What is the capital of France?")
+    assert lookup.answer is None
+    assert cache.stats.hits == 1
+    assert cache.stats.misses == 2
+
+
+@pytest.mark.asyncio
+async def test_answer_cache_similarity_match():
+    vectors = {
+        "what is the capital of france": [1.0, 0.0],
+        "which city is the capital of france": [0.99, 0.1],
+        "what is the capital of spain": [0.0, 1.0],
+    }
+
+    async def embed(question: str) -> list[float]:
+        return vectors[question]
+
+    cache = AnswerCache(backend=InMemoryAnswerCacheBackend(), similarity_threshold=0.95)
+    lookup = await cache.lookup("scope", "What is the capital of France?", embed)
+    await cache.store(lookup, {"message": {"role": "assistant", "content": "Paris"}})
+
+    lookup = await cache.lookup("scope", "Which city is the capital of France?", embed)
+    assert lookup.match == "similar"
+    assert lookup.similarity == pytest.approx(0.995, abs=1e-3)
+    assert lookup.answer == {"message": {"role": "assistant", "content": "Paris"}}
+
+    lookup = await cache.lookup("scope", "What is the capital of Spain?", embed)
+    assert lookup.answer is None
+
+    lookup = await cache.lookup("other-scope", "Which city is the capital of France?", embed)
+    assert lookup.answer is None
+
+
+@pytest.mark.asyncio
+async def test_answer_cache_similarity_skips_expired_answers():
+    async def embed(question: str) -> list[float]:
+        return [1.0, 0.0]
+
+    backend = InMemoryAnswerCacheBackend()
+    cache = AnswerCache(backend=backend, similarity_threshold=0.9)
+    lookup = await cache.lookup("scope", "First question", embed)
+    await cache.store(lookup, {"message": {"role": "assistant", "content": "First answer"}})
+    await backend.delete(lookup.key)
+
+    lookup = await cache.lookup("scope", "Second question", embed)
+    assert lookup.answer is None
+    assert cache.similarity_index.get(lookup.scope) == {}
+
+
+@pytest.mark.asyncio
+async def test_answer_cache_invalidate():
+    async def embed(question: str) -> list[float]:
+        return [1.0, 0.0]
+
+    cache = AnswerCache(backend=InMemoryAnswerCacheBackend(), similarity_threshold=0.9)
+    lookup = await cache.lookup("scope", "What is the capital of France?", embed)
+    await cache.store(lookup, {"message": {"role": "assistant", "content": "Paris"}})
+    await cache.invalidate()
+
+    lookup = await cache.lookup("scope", "What is the capital of France?", embed)
+    assert lookup.answer is None
+    lookup = await cache.lookup("scope", "Which city is the capital of France?", embed)
+    assert lookup.answer is None
+
+
+class MockRedis:
+    def __init__(self):
+        self.values: dict[str, Any] = {}
+
+    async def get(self, key: str):
+        return self.values.get(key)
+
+    async def set(self, key: str, value: Any, px: int):
+        self.values[key] = value
+
+    async def incr(self, key: str):
+        self.values[key] = int(self.values.get(key, 0)) + 1
+
+
+@pytest.mark.asyncio
+async def test_answer_cache_invalidate_in_redis_reaches_every_worker():
+    redis = MockRedis()
+    worker_cache = AnswerCache(backend=RedisAnswerCacheBackend(redis))
+    other_worker_cache = AnswerCache(backend=RedisAnswerCacheBackend(redis))
+    lookup = await worker_cache.lookup("scope", "What is the capital of France?")
+    await worker_cache.store(lookup, {"message": {"role": "assistant", "content": "Paris"}})
+    assert (await other_worker_cache.lookup("scope", "What is the capital of France?")).match == "exact"
+
+    await worker_cache.invalidate()
+    assert (await other_worker_cache.lookup("scope", "What is the capital of France?")).answer is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("route", ["/chat", "/ask"])
+async def test_answer_cache_serves_repeated_question(client, route):
+    cache = AnswerCache(backend=InMemoryAnswerCacheBackend())
+    approach_key = app.CONFIG_CHAT_APPROACH if route == "/chat" else app.CONFIG_ASK_APPROACH
+    client.app.config[approach_key].answer_cache = cache
+    request = {
+        "messages": [{"content": "What is the capital of France?", "role": "user"}],
+        "context": {"overrides": {"retrieval_mode": "text"}},
+    }
+
+    response = await client.post(route, json=request)
+    assert response.status_code == 200
+    first = await response.get_json()
+
+    response = await client.post(route, json=request)
+    assert response.status_code == 200
+    second = await response.get_json()
+    assert second["message"] == first["message"]
+    assert second["context"]["data_points"] == first["context"]["data_points"]
+    assert second["context"]["thoughts"][-1]["title"] == "Answer served from cache"
+    assert second["context"]["thoughts"][-1]["props"] == {"match": "exact", "similarity": None}
+    assert cache.stats.hits == 1
+
+    request["context"]["overrides"]["use_answer_cache"] = False
+    response = await client.post(route, json=request)
+    third = await response.get_json()
+    assert third["context"]["thoughts"][-1]["title"] != "Answer served from cache"
+    assert cache.stats.hits == 1
+
+
+@pytest.mark.asyncio
+async def test_answer_cache_serves_repeated_question_streaming(client):
+    cache = AnswerCache(backend=InMemoryAnswerCacheBackend())
+    client.app.config[app.CONFIG_CHAT_APPROACH].answer_cache = cache
+    request = {
+        "messages": [{"content": "What is the capital of France?", "role": "user"}],
+        "context": {"overrides": {"retrieval_mode": "text"}},
+    }
+
+    response = await client.post("/chat/stream", json=request)
+    assert response.status_code == 200
+    first = await response.get_data()
+
+    response = await client.post("/chat/stream", json=request)
+    assert response.status_code == 200
+    second = await response.get_data()
+    assert b"Answer served from cache" in second
+    assert b"Answer served from cache" not in first
+    assert cache.stats.hits == 1
@@ -6,8 +6,10 @@ import pytest
 import quart.testing.app
 from httpx import Request, Response
 from openai import BadRequestError
+from openai.types import CompletionUsage
 
 import app
+from approaches.approach import DataPoints, Document, ExtraInfo, ThoughtStep
 
 
 def fake_response(http_code):
@@ -1119,3 +1121,106 @@ async def test_format_as_ndjson():
 
     result = [line async for line in app.format_as_ndjson(gen())]
     assert result == ['{"a": "I ❤️ 🐍"}\n', '{"b": "Newlines inside \\n strings are fine"}\n']
+
+
+@pytest.mark.asyncio
+async def test_format_as_ndjson_context_events():
+    prompt = [{"role": "user", "content": [{"type": "image_url", "image_url": {"url": "data:image/png;base64,abc"}}]}]
+    extra_info = ExtraInfo(
+        DataPoints(text=["Benefit_Options.pdf#page=1: Northwind Health Plus ❤️"], images=["data:image/png;base64,abc"]),
+        thoughts=[
+            ThoughtStep("Search using generated search query", "capital of France", {"top": 3}),
+            ThoughtStep("Prompt to generate answer", prompt, {"model": "gpt-4.1-mini"}),
+        ],
+    )
+    usage = CompletionUsage(prompt_tokens=10, completion_tokens=2, total_tokens=12)
+    context_event = {"delta": {"role": "assistant"}, "context": extra_info, "session_state": None}
+    followup_event = {
+        "delta": {"role": "assistant"},
+        "context": {"context": extra_info, "followup_questions": ["Spain?"]},
+    }
+    expected = []
+
+    async def gen():
+        for event in [context_event, {"delta": {"content": "Paris", "role": None}}, "usage", followup_event]:
+            if event == "usage":
+                extra_info.thoughts[-1].update_token_usage(usage)
+                event = context_event
+            # The expected line is encoded before the next event mutates the context
+            expected.append(json.dumps(event, ensure_ascii=False, cls=app.JSONEncoder) + "\n")
+            yield event
+
+    result = [line async for line in app.format_as_ndjson(gen())]
+    assert result == expected
+    assert json.loads(result[2])["context"]["thoughts"][-1]["props"]["token_usage"]["total_tokens"] == 12
+
+
+def test_ndjson_encoder_encodes_data_points_once(monkeypatch):
+    encoder = app.NDJSONEncoder()
+    data_points = DataPoints(text=["a.pdf#page=1: content"])
+    event = {"delta": {"role": "assistant"}, "context": ExtraInfo(data_points)}
+    first = encoder.encode(event)
+    monkeypatch.setattr(encoder.encoder, "encode", mock.Mock(side_effect=encoder.encoder.encode))
+    assert encoder.encode(event) == first
+    assert data_points not in [call.args[0] for call in encoder.encoder.encode.call_args_list]
+
+
+def test_json_encoder_serializes_search_results():
+    document = Document(id="1", content="Paris is the capital of France.", sourcepage="France.pdf#page=1")
+    thought = ThoughtStep("Search results", [document])
+    assert json.loads(json.dumps(thought, cls=app.JSONEncoder))["description"] == [document.serialize_for_results()]
+    assert json.loads(app.JSONProvider(app.create_app()).dumps(thought))["description"] == [
+        document.serialize_for_results()
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("route", ["/chat", "/ask"])
+async def test_exclude_thoughts(client, route):
+    response = await client.post(
+        route,
+        json={
+            "messages": [{"content": "What is the capital of France?", "role": "user"}],
+            "context": {"overrides": {"retrieval_mode": "text", "include_thoughts": False}},
+        },
+    )
+    assert response.status_code == 200
+    result = await response.get_json()
+    assert result["context"]["thoughts"] == []
+    assert result["context"]["data_points"]["text"]
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_exclude_thoughts(client):
+    response = await client.post(
+        "/chat/stream",
+        json={
+            "messages": [{"content": "What is the capital of France?", "role": "user"}],
+            "context": {"overrides": {"retrieval_mode": "text", "include_thoughts": False}},
+        },
+    )
+    assert response.status_code == 200
+    events = [json.loads(line) for line in (await response.get_data()).decode().splitlines()]
+    context_events = [event for event in events if "context" in event]
+    # Without thoughts, there's no token usage to send once the answer is complete
+    assert len(context_events) == 1
+    assert context_events[0]["context"]["thoughts"] == []
+
+
+@pytest.mark.asyncio
+async def test_chat_skip_query_rewrite(client):
+    response = await client.post(
+        "/chat",
+        json={
+            "messages": [{"content": "What is the capital of France?", "role": "user"}],
+            "context": {
+                "overrides": {"retrieval_mode": "text", "query_rewrite_mode": "first_turn"},
+            },
+        },
+    )
+    assert response.status_code == 200
+    result = await response.get_json()
+    assert result["context"]["thoughts"][0]["title"] == "Skipped search query generation"
+    assert result["context"]["thoughts"][1]["title"] == "Search using user query"
+    assert result["context"]["thoughts"][1]["description"] == "What is the capital of France?"
+    assert result["context"]["thoughts"][1]["props"]["query_rewrite"] == "skipped"
@@ -18,6 +18,7 @@ def minimal_env(monkeypatch):
         monkeypatch.setenv("AZURE_OPENAI_CHATGPT_MODEL", "gpt-4.1-mini")
         monkeypatch.setenv("AZURE_OPENAI_EMB_MODEL_NAME", "text-embedding-3-large")
         monkeypatch.setenv("AZURE_OPENAI_EMB_DIMENSIONS", "3072")
+        monkeypatch.setenv("UPLOAD_JOB_LOG_PATH", ":memory:")
         yield
 
 
@@ -68,6 +69,23 @@ async def test_app_user_upload_processors(monkeypatch, minimal_env):
         assert len(ingester.file_processors.keys()) == 6
 
 
+@pytest.mark.asyncio
+async def test_app_user_upload_jobs(monkeypatch, minimal_env, tmp_path):
+    monkeypatch.setenv("AZURE_USERSTORAGE_ACCOUNT", "test-user-storage-account")
+    monkeypatch.setenv("AZURE_USERSTORAGE_CONTAINER", "test-user-storage-container")
+    monkeypatch.setenv("USE_USER_UPLOAD", "true")
+    monkeypatch.setenv("UPLOAD_WORKERS", "3")
+    monkeypatch.setenv("UPLOAD_JOB_LOG_PATH", str(tmp_path / "upload_jobs.sqlite3"))
+
+    quart_app = app.create_app()
+    async with quart_app.test_app():
+        upload_jobs = quart_app.config[app.CONFIG_UPLOAD_JOBS]
+        assert upload_jobs.workers == 3
+        # The workers and the task that renews the leases of their jobs
+        assert len(upload_jobs.tasks) == 4
+    assert (tmp_path / "upload_jobs.sqlite3").exists()
+
+
 @pytest.mark.asyncio
 async def test_app_user_upload_processors_docint(monkeypatch, minimal_env):
     monkeypatch.setenv("AZURE_USERSTORAGE_ACCOUNT", "test-user-storage-account")
@@ -313,3 +331,110 @@ def test_app_enables_azure_monitor_when_connection_string_set(monkeypatch):
     mock_connection_string = "InstrumentationKey=12345678-1234-1234-1234-123456789012"
     monkeypatch.setenv("APPLICATIONINSIGHTS_CONNECTION_STRING", mock_connection_string)
     app.create_app()
+
+
+@pytest.mark.asyncio
+async def test_app_answer_cache(monkeypatch, minimal_env):
+    monkeypatch.setenv("USE_ANSWER_CACHE", "true")
+    monkeypatch.setenv("ANSWER_CACHE_TTL_SECONDS", "60")
+    monkeypatch.setenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.95")
+
+    quart_app = app.create_app()
+    async with quart_app.test_app():
+        answer_cache = quart_app.config[app.CONFIG_ANSWER_CACHE]
+        assert answer_cache.ttl_seconds == 60
+        assert answer_cache.similarity_threshold == 0.95
+        assert quart_app.config[app.CONFIG_CHAT_APPROACH].answer_cache is answer_cache
+        assert quart_app.config[app.CONFIG_ASK_APPROACH].answer_cache is answer_cache
+
+
+@pytest.mark.asyncio
+async def test_app_embedding_cache(monkeypatch, minimal_env):
+    quart_app = app.create_app()
+    async with quart_app.test_app():
+        assert quart_app.config[app.CONFIG_CHAT_APPROACH].embedding_cache is not None
+        assert quart_app.config[app.CONFIG_CHAT_APPROACH].embedding_cache.cache.max_entries == 1000
+
+    monkeypatch.setenv("USE_EMBEDDING_CACHE", "false")
+    quart_app = app.create_app()
+    async with quart_app.test_app():
+        assert quart_app.config[app.CONFIG_CHAT_APPROACH].embedding_cache is None
+        assert quart_app.config[app.CONFIG_ASK_APPROACH].embedding_cache is None
+
+
+@pytest.mark.asyncio
+async def test_app_speculative_retrieval(monkeypatch, minimal_env):
+    monkeypatch.setenv("USE_SPECULATIVE_RETRIEVAL", "true")
+    quart_app = app.create_app()
+    async with quart_app.test_app():
+        assert quart_app.config[app.CONFIG_CHAT_APPROACH].speculative_retrieval is True
+
+
+@pytest.mark.asyncio
+async def test_app_context_token_budget(monkeypatch, minimal_env):
+    quart_app = app.create_app()
+    async with quart_app.test_app():
+        assert quart_app.config[app.CONFIG_CHAT_APPROACH].context_packer is None
+
+    monkeypatch.setenv("CONTEXT_TOKEN_BUDGET", "6000")
+    quart_app = app.create_app()
+    async with quart_app.test_app():
+        assert quart_app.config[app.CONFIG_CHAT_APPROACH].context_packer.token_budget == 6000
+        assert quart_app.config[app.CONFIG_ASK_APPROACH].context_packer.token_budget == 6000
+
+
+@pytest.mark.asyncio
+async def test_app_search_cache(monkeypatch, minimal_env):
+    quart_app = app.create_app()
+    async with quart_app.test_app():
+        assert quart_app.config[app.CONFIG_CHAT_APPROACH].search_cache is None
+
+    monkeypatch.setenv("USE_SEARCH_CACHE", "true")
+    monkeypatch.setenv("SEARCH_CACHE_TTL_SECONDS", "10")
+    quart_app = app.create_app()
+    async with quart_app.test_app():
+        search_cache = quart_app.config[app.CONFIG_CHAT_APPROACH].search_cache
+        assert search_cache.cache.ttl_seconds == 10
+        assert quart_app.config[app.CONFIG_ASK_APPROACH].search_cache is search_cache
+
+
+@pytest.mark.asyncio
+async def test_app_include_stage_timings(monkeypatch, minimal_env):
+    quart_app = app.create_app()
+    async with quart_app.test_app():
+        assert quart_app.config[app.CONFIG_CHAT_APPROACH].include_stage_timings is False
+
+    monkeypatch.setenv("INCLUDE_STAGE_TIMINGS", "true")
+    quart_app = app.create_app()
+    async with quart_app.test_app():
+        assert quart_app.config[app.CONFIG_CHAT_APPROACH].include_stage_timings is True
+        assert quart_app.config[app.CONFIG_ASK_APPROACH].include_stage_timings is True
+
+
+@pytest.mark.asyncio
+async def test_app_path_auth_cache(monkeypatch, minimal_env):
+    quart_app = app.create_app()
+    async with quart_app.test_app():
+        assert quart_app.config[app.CONFIG_AUTH_CLIENT].path_auth_cache.ttl_seconds == 60
+
+    monkeypatch.setenv("PATH_AUTH_CACHE_TTL_SECONDS", "0")
+    quart_app = app.create_app()
+    async with quart_app.test_app():
+        assert quart_app.config[app.CONFIG_AUTH_CLIENT].path_auth_cache is None
+
+
+@pytest.mark.asyncio
+async def test_app_blob_cache(monkeypatch, minimal_env, tmp_path):
+    quart_app = app.create_app()
+    async with quart_app.test_app():
+        assert quart_app.config[app.CONFIG_GLOBAL_BLOB_MANAGER].blob_cache is None
+
+    monkeypatch.setenv("USE_BLOB_CACHE", "true")
+    monkeypatch.setenv("BLOB_CACHE_MAX_MB", "16")
+    monkeypatch.setenv("BLOB_CACHE_DIRECTORY", str(tmp_path / "blobs"))
+    quart_app = app.create_app()
+    async with quart_app.test_app():
+        blob_cache = quart_app.config[app.CONFIG_GLOBAL_BLOB_MANAGER].blob_cache
+        assert blob_cache.max_bytes == 16 * 1024 * 1024
+        assert blob_cache.directory == tmp_path / "blobs"
+        assert (tmp_path / "blobs").is_dir()
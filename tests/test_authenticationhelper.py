@@ -1,18 +1,24 @@
+import asyncio
 import base64
 import json
-import re
+import threading
 from datetime import datetime, timedelta, timezone
 
 import aiohttp
 import jwt
+import msal
 import pytest
 from azure.core.credentials import AzureKeyCredential
 from azure.search.documents.aio import SearchClient
 from azure.search.documents.indexes.models import SearchField, SearchIndex
-from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric import rsa
 
-from core.authentication import AuthenticationHelper, AuthError
+from core.authentication import (
+    AuthenticationHelper,
+    AuthError,
+    JwksCache,
+    build_groups_security_filter,
+)
 
 from .mocks import MockAsyncPageIterator, MockResponse
 
@@ -29,6 +35,7 @@ def create_authentication_helper(
     require_access_control: bool = False,
     enable_global_documents: bool = False,
     enable_unauthenticated_access: bool = False,
+    path_auth_cache_ttl_seconds: float = 0,
 ):
     return AuthenticationHelper(
         search_index=MockSearchIndex,
@@ -40,6 +47,7 @@ def create_authentication_helper(
         require_access_control=require_access_control,
         enable_global_documents=enable_global_documents,
         enable_unauthenticated_access=enable_unauthenticated_access,
+        path_auth_cache_ttl_seconds=path_auth_cache_ttl_seconds,
     )
 
 
@@ -102,6 +110,25 @@ async def test_get_auth_claims_overage_success(
     assert auth_claims.get("groups") == ["OVERAGE_GROUP_Y", "OVERAGE_GROUP_Z"]
 
 
+@pytest.mark.asyncio
+async def test_get_auth_claims_overage_cached(
+    mock_confidential_client_overage, mock_list_groups_success, mock_validate_token_success
+):
+    helper = create_authentication_helper()
+    auth_claims = await helper.get_auth_claims_if_enabled(headers={"Authorization": "Bearer Token"})
+    assert auth_claims.get("groups") == ["OVERAGE_GROUP_Y", "OVERAGE_GROUP_Z"]
+    assert helper.groups_cache.get("OID_X") == frozenset({"OVERAGE_GROUP_Y", "OVERAGE_GROUP_Z"})
+    # The mock only answers the first listing, so the second request must use the cached groups
+    auth_claims = await helper.get_auth_claims_if_enabled(headers={"Authorization": "Bearer OtherToken"})
+    assert auth_claims.get("groups") == ["OVERAGE_GROUP_Y", "OVERAGE_GROUP_Z"]
+
+    graph_session = helper.graph_session
+    assert graph_session is not None
+    await helper.close()
+    assert graph_session.closed
+    assert helper.graph_session is None
+
+
 @pytest.mark.asyncio
 async def test_get_auth_claims_overage_unauthorized(
     mock_confidential_client_overage, mock_list_groups_unauthorized, mock_validate_token_success
@@ -111,6 +138,58 @@ async def test_get_auth_claims_overage_unauthorized(
     assert len(auth_claims.keys()) == 0
 
 
+@pytest.mark.asyncio
+async def test_acquire_token_on_behalf_of_cached(monkeypatch, mock_confidential_client_success):
+    exchanges = []
+    release = threading.Event()
+
+    def mock_acquire_token_on_behalf_of(self, *args, **kwargs):
+        # Runs in a worker thread, so waiting here doesn't block the event loop
+        assert release.wait(timeout=5)
+        exchanges.append(kwargs["user_assertion"])
+        return {"access_token": "MockToken", "expires_in": 3600, "id_token_claims": {"oid": "OID_X"}}
+
+    monkeypatch.setattr(
+        msal.ConfidentialClientApplication, "acquire_token_on_behalf_of", mock_acquire_token_on_behalf_of
+    )
+    helper = create_authentication_helper()
+    first = asyncio.create_task(helper.acquire_token_on_behalf_of("Token"))
+    second = asyncio.create_task(helper.acquire_token_on_behalf_of("Token"))
+    await asyncio.sleep(0.01)
+    release.set()
+    assert (await first)["access_token"] == (await second)["access_token"] == "MockToken"
+    assert (await helper.acquire_token_on_behalf_of("Token"))["access_token"] == "MockToken"
+    assert exchanges == ["Token"]
+
+    await helper.acquire_token_on_behalf_of("OtherToken")
+    assert exchanges == ["Token", "OtherToken"]
+    # The cache is keyed by a hash of the token
+    assert all("Token" not in key for key, _ in helper.obo_token_cache.items())
+
+
+@pytest.mark.asyncio
+async def test_acquire_token_on_behalf_of_not_cached(monkeypatch, mock_confidential_client_success):
+    results = [
+        {"error": "invalid_grant"},
+        # Expires within the safety margin
+        {"access_token": "MockToken", "expires_in": AuthenticationHelper.OBO_TOKEN_EXPIRY_MARGIN_SECONDS},
+        {"access_token": "MockToken", "expires_in": 3600},
+    ]
+
+    def mock_acquire_token_on_behalf_of(self, *args, **kwargs):
+        return results.pop(0)
+
+    monkeypatch.setattr(
+        msal.ConfidentialClientApplication, "acquire_token_on_behalf_of", mock_acquire_token_on_behalf_of
+    )
+    helper = create_authentication_helper()
+    assert "error" in await helper.acquire_token_on_behalf_of("Token")
+    assert (await helper.acquire_token_on_behalf_of("Token"))["access_token"] == "MockToken"
+    assert (await helper.acquire_token_on_behalf_of("Token"))["access_token"] == "MockToken"
+    assert results == []
+    assert (await helper.acquire_token_on_behalf_of("Token"))["expires_in"] == 3600
+
+
 @pytest.mark.asyncio
 async def test_list_groups_success(mock_list_groups_success, mock_validate_token_success):
     groups = await AuthenticationHelper.list_groups(graph_resource_access_token={"access_token": "MockToken"})
@@ -161,6 +240,12 @@ def test_get_auth_token(mock_confidential_client_success, mock_validate_token_su
     AuthenticationHelper.get_token_auth_header({"x-ms-token-aad-access-token": "MockToken"}) == "MockToken"
 
 
+def test_build_groups_security_filter():
+    security_filter = build_groups_security_filter(frozenset({"GROUP_Z", "GROUP_Y"}))
+    assert security_filter == "groups/any(g:search.in(g, 'GROUP_Y, GROUP_Z'))"
+    assert build_groups_security_filter(frozenset(["GROUP_Y", "GROUP_Z"])) is security_filter
+
+
 def test_build_security_filters(mock_confidential_client_success, mock_validate_token_success):
     auth_helper = create_authentication_helper()
     auth_helper_require_access_control = create_authentication_helper(require_access_control=True)
@@ -458,6 +543,42 @@ async def test_check_path_auth_allowed_fragment(
     )
 
 
+@pytest.mark.asyncio
+async def test_check_path_auth_cached(monkeypatch, mock_confidential_client_success, mock_validate_token_success):
+    auth_helper = create_authentication_helper(require_access_control=True, path_auth_cache_ttl_seconds=60)
+    filters = []
+
+    async def mock_search(self, *args, **kwargs):
+        filters.append(kwargs.get("filter"))
+        await asyncio.sleep(0)
+        if "GROUP_Y" in kwargs.get("filter"):
+            return MockAsyncPageIterator(data=[{"sourcefile": "Benefit_Options.pdf"}])
+        return MockAsyncPageIterator(data=[])
+
+    monkeypatch.setattr(SearchClient, "search", mock_search)
+
+    async def check_path_auth(path="Benefit_Options.pdf#page=1", oid="OID_X", groups=["GROUP_Y", "GROUP_Z"]):
+        return await auth_helper.check_path_auth(
+            path=path, auth_claims={"oid": oid, "groups": groups}, search_client=create_search_client()
+        )
+
+    # The citations of an answer share a single check, and later requests reuse its decision
+    assert await asyncio.gather(check_path_auth(), check_path_auth("Benefit_Options.pdf#page=2")) == [True, True]
+    assert await check_path_auth(groups=["GROUP_Z", "GROUP_Y"]) is True
+    assert len(filters) == 1
+
+    # Decisions are cached for each user, groups and path
+    assert await check_path_auth(groups=["GROUP_Z"]) is False
+    assert await check_path_auth(groups=["GROUP_Z"]) is False
+    assert await check_path_auth(oid="OID_Y") is True
+    assert await check_path_auth(path="Northwind_Benefits.pdf") is True
+    assert len(filters) == 4
+
+    auth_helper.invalidate_path_auth()
+    assert await check_path_auth() is True
+    assert len(filters) == 5
+
+
 @pytest.mark.asyncio
 async def test_check_path_auth_allowed_without_access_control(
     monkeypatch, mock_confidential_client_success, mock_validate_token_success
@@ -518,93 +639,25 @@ async def test_check_path_auth_allowed_public_without_access_control(
     assert called_search is False
 
 
-@pytest.mark.asyncio
-async def test_create_pem_format(mock_confidential_client_success, mock_validate_token_success):
-    helper = create_authentication_helper()
-    mock_token, public_key, payload = create_mock_jwt(oid="OID_X")
-    _, other_public_key, _ = create_mock_jwt(oid="OID_Y")
-    mock_jwks = {
-        "keys": [
-            # Include a key with a different KID to ensure the correct key is selected
-            {
-                "kty": "RSA",
-                "kid": "other_mock_kid",
-                "use": "sig",
-                "n": base64.urlsafe_b64encode(
-                    other_public_key.public_numbers().n.to_bytes(
-                        (other_public_key.public_numbers().n.bit_length() + 7) // 8, byteorder="big"
-                    )
-                )
-                .decode("utf-8")
-                .rstrip("="),
-                "e": base64.urlsafe_b64encode(
-                    other_public_key.public_numbers().e.to_bytes(
-                        (other_public_key.public_numbers().e.bit_length() + 7) // 8, byteorder="big"
-                    )
-                )
-                .decode("utf-8")
-                .rstrip("="),
-            },
-            {
-                "kty": "RSA",
-                "kid": "mock_kid",
-                "use": "sig",
-                "n": base64.urlsafe_b64encode(
-                    public_key.public_numbers().n.to_bytes(
-                        (public_key.public_numbers().n.bit_length() + 7) // 8, byteorder="big"
-                    )
-                )
-                .decode("utf-8")
-                .rstrip("="),
-                "e": base64.urlsafe_b64encode(
-                    public_key.public_numbers().e.to_bytes(
-                        (public_key.public_numbers().e.bit_length() + 7) // 8, byteorder="big"
-                    )
-                )
-                .decode("utf-8")
-                .rstrip("="),
-            },
-        ]
-    }
-
-    pem_key = await helper.create_pem_format(mock_jwks, mock_token)
-
-    # Assert that the result is bytes
-    assert isinstance(pem_key, bytes), "create_pem_format should return bytes"
-
-    # Convert bytes to string for regex matching
-    pem_str = pem_key.decode("utf-8")
-
-    # Assert that the key starts and ends with the correct markers
-    assert pem_str.startswith("-----BEGIN PUBLIC KEY-----"), "PEM key should start with the correct marker"
-    assert pem_str.endswith("-----END PUBLIC KEY-----\n"), "PEM key should end with the correct marker"
-
-    # Assert that the format matches the structure of a PEM key
-    pem_regex = r"^-----BEGIN PUBLIC KEY-----\n([A-Za-z0-9+/\n]+={0,2})\n-----END PUBLIC KEY-----\n$"
-    assert re.match(pem_regex, pem_str), "PEM key format is incorrect"
-
-    # Verify that the key can be used to decode the token
-    try:
-        decoded = jwt.decode(
-            mock_token, key=pem_key, algorithms=["RS256"], audience=payload["aud"], issuer=payload["iss"]
+def create_jwk(kid: str, public_key: rsa.RSAPublicKey) -> dict:
+    def encode(number: int) -> str:
+        return (
+            base64.urlsafe_b64encode(number.to_bytes((number.bit_length() + 7) // 8, byteorder="big"))
+            .decode()
+            .rstrip("=")
         )
-        assert decoded["oid"] == payload["oid"], "Decoded token should contain correct OID"
-    except Exception as e:
-        pytest.fail(f"jwt.decode raised an unexpected exception: {str(e)}")
 
-    # Try to load the key using cryptography library to ensure it's a valid PEM format
-    try:
-        loaded_public_key = serialization.load_pem_public_key(pem_key)
-        assert isinstance(loaded_public_key, rsa.RSAPublicKey), "Loaded key should be an RSA public key"
-    except Exception as e:
-        pytest.fail(f"Failed to load PEM key: {str(e)}")
+    public_numbers = public_key.public_numbers()
+    return {"kty": "RSA", "use": "sig", "kid": kid, "n": encode(public_numbers.n), "e": encode(public_numbers.e)}
 
 
 @pytest.mark.asyncio
 async def test_validate_access_token(monkeypatch, mock_confidential_client_success):
     mock_token, public_key, payload = create_mock_jwt(oid="OID_X")
+    key_downloads = []
 
     def mock_get(*args, **kwargs):
+        key_downloads.append(kwargs["url"])
         return MockResponse(
             status=200,
             text=json.dumps(
@@ -620,16 +673,7 @@ async def test_validate_access_token(monkeypatch, mock_confidential_client_succe
                             "x5c": ["MIIC/jCC"],
                             "issuer": "https://login.microsoftonline.com/TENANT_ID/v2.0",
                         },
-                        {
-                            "kty": "RSA",
-                            "use": "sig",
-                            "kid": "MGLq",
-                            "x5t": "MGLq",
-                            "n": "yfNcG8",
-                            "e": "AQAB",
-                            "x5c": ["MIIC/jCC"],
-                            "issuer": "https://login.microsoftonline.com/TENANT_ID/v2.0",
-                        },
+                        create_jwk("mock_kid", public_key),
                     ]
                 }
             ),
@@ -637,15 +681,69 @@ async def test_validate_access_token(monkeypatch, mock_confidential_client_succe
 
     monkeypatch.setattr(aiohttp.ClientSession, "get", mock_get)
 
-    def mock_decode(*args, **kwargs):
-        return payload
+    helper = create_authentication_helper()
+    await helper.validate_access_token(mock_token)
+    # The keys are downloaded once, and reused for later tokens
+    other_token, _, _ = create_mock_jwt(oid="OID_Y")
+    with pytest.raises(AuthError, match="Unable to parse authorization token"):
+        # Signed with a different key that has the same key id
+        await helper.validate_access_token(other_token)
+    await helper.validate_access_token(mock_token)
+    assert key_downloads == ["https://login.microsoftonline.com/TENANT_ID/discovery/v2.0/keys"]
 
-    monkeypatch.setattr(jwt, "decode", mock_decode)
 
-    async def mock_create_pem_format(*args, **kwargs):
-        return public_key
+@pytest.mark.asyncio
+async def test_validate_access_token_unknown_key(monkeypatch, mock_confidential_client_success):
+    mock_token, public_key, _ = create_mock_jwt(kid="new_kid", oid="OID_X")
+    jwks = {"keys": []}
+    key_downloads = 0
 
-    monkeypatch.setattr(AuthenticationHelper, "create_pem_format", mock_create_pem_format)
+    def mock_get(*args, **kwargs):
+        nonlocal key_downloads
+        key_downloads += 1
+        return MockResponse(status=200, text=json.dumps(jwks))
 
+    monkeypatch.setattr(aiohttp.ClientSession, "get", mock_get)
+    now = 0.0
     helper = create_authentication_helper()
+    helper.jwks_cache.timer = lambda: now
+
+    with pytest.raises(AuthError, match="Unable to find appropriate key"):
+        await helper.validate_access_token(mock_token)
+    assert key_downloads == 1
+
+    # The keys were just downloaded, so an unknown key doesn't download them again yet
+    jwks = {"keys": [create_jwk("new_kid", public_key)]}
+    with pytest.raises(AuthError, match="Unable to find appropriate key"):
+        await helper.validate_access_token(mock_token)
+    assert key_downloads == 1
+
+    now += helper.jwks_cache.min_refresh_seconds
     await helper.validate_access_token(mock_token)
+    assert key_downloads == 2
+
+
+@pytest.mark.asyncio
+async def test_jwks_cache_refreshes_in_background(monkeypatch):
+    _, public_key, _ = create_mock_jwt(oid="OID_X")
+    key_downloads = 0
+
+    def mock_get(*args, **kwargs):
+        nonlocal key_downloads
+        key_downloads += 1
+        return MockResponse(status=200, text=json.dumps({"keys": [create_jwk("mock_kid", public_key)]}))
+
+    monkeypatch.setattr(aiohttp.ClientSession, "get", mock_get)
+    now = 0.0
+    jwks_cache = JwksCache("https://login.microsoftonline.com/TENANT_ID/discovery/v2.0/keys", timer=lambda: now)
+    key = await jwks_cache.get_key("mock_kid")
+    assert key is not None
+    assert key.public_numbers() == public_key.public_numbers()
+
+    # Stale keys are still used while they are refreshed
+    now += jwks_cache.refresh_seconds
+    assert await jwks_cache.get_key("mock_kid") is key
+    assert jwks_cache.background_refresh is not None
+    await jwks_cache.background_refresh
+    assert key_downloads == 2
+    assert jwks_cache.refreshed_at == now
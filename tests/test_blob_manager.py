@@ -3,6 +3,7 @@ import sys
 from tempfile import NamedTemporaryFile
 from unittest.mock import MagicMock
 
+import azure.core.exceptions
 import azure.storage.blob.aio
 import azure.storage.filedatalake.aio
 import pytest
@@ -419,3 +420,186 @@ async def test_adls_download_blob_with_permission(
 
     assert content.startswith(b"\x89PNG\r\n\x1a\n")
     assert properties["content_settings"]["content_type"] == "application/octet-stream"
+
+
+@pytest.mark.asyncio
+async def test_get_blob_etag(monkeypatch, mock_env, blob_manager):
+    async def mock_get_blob_properties(self, *args, **kwargs):
+        assert self.blob_name == "test_document.png"
+        return MagicMock(etag='"0x8DC"')
+
+    monkeypatch.setattr("azure.storage.blob.aio.BlobClient.get_blob_properties", mock_get_blob_properties)
+
+    assert await blob_manager.get_blob_etag("test_document.png") == '"0x8DC"'
+    assert await blob_manager.get_blob_etag("") is None
+    with pytest.raises(ValueError):
+        await blob_manager.get_blob_etag("test_document.png", user_oid="OID_X")
+
+
+@pytest.mark.asyncio
+async def test_get_blob_etag_not_found(monkeypatch, mock_env, blob_manager):
+    async def mock_get_blob_properties(self, *args, **kwargs):
+        raise azure.core.exceptions.ResourceNotFoundError()
+
+    monkeypatch.setattr("azure.storage.blob.aio.BlobClient.get_blob_properties", mock_get_blob_properties)
+
+    assert await blob_manager.get_blob_etag("test_document.png") is None
+
+
+@pytest.mark.asyncio
+async def test_adls_get_blob_etag(monkeypatch, adls_blob_manager):
+    async def mock_get_file_properties(self, *args, **kwargs):
+        assert self.path_name == "OID_X/images/document.pdf/page1/figure1_1.png"
+        return MagicMock(etag='"0x8DC"')
+
+    monkeypatch.setattr(
+        "azure.storage.filedatalake.aio.DataLakeFileClient.get_file_properties", mock_get_file_properties
+    )
+
+    assert await adls_blob_manager.get_blob_etag("OID_X/images/document.pdf/page1/figure1_1.png", "OID_X") == '"0x8DC"'
+    # Blobs of other users are never accessed
+    assert await adls_blob_manager.get_blob_etag("OID_Y/images/document.pdf/page1/figure1_1.png", "OID_X") is None
+    assert await adls_blob_manager.get_blob_etag("OID_X/images/document.pdf/page1/figure1_1.png", None) is None
+
+
+@pytest.mark.asyncio
+async def test_open_blob_range(monkeypatch, mock_env, blob_manager):
+    class MockDownloadResponse:
+        def __init__(self, offset, length):
+            self.properties = MagicMock(
+                content_settings=MagicMock(content_type="application/pdf"),
+                etag='"0x8DC"',
+                size=length,
+                content_range=f"bytes {offset}-{offset + length - 1}/1000",
+            )
+
+        async def chunks(self):
+            yield b"first"
+            yield b"second"
+
+    async def mock_download_blob(self, offset=None, length=None):
+        assert self.blob_name == "test_document.pdf"
+        return MockDownloadResponse(offset, length)
+
+    monkeypatch.setattr("azure.storage.blob.aio.BlobClient.download_blob", mock_download_blob)
+
+    result = await blob_manager.open_blob("test_document.pdf", offset=100, length=200)
+    assert result is not None
+    chunks, properties = result
+    assert [chunk async for chunk in chunks] == [b"first", b"second"]
+    # The size is the size of the whole blob, not of the range
+    assert properties["size"] == 1000
+    assert properties["etag"] == '"0x8DC"'
+    assert properties["content_settings"]["content_type"] == "application/pdf"
+
+
+@pytest.mark.asyncio
+async def test_adls_open_blob(
+    monkeypatch, mock_data_lake_service_client, mock_user_directory_client, adls_blob_manager
+):
+    result = await adls_blob_manager.open_blob("OID_X/document.pdf", "OID_X")
+    assert result is not None
+    chunks, properties = result
+    assert b"".join([chunk async for chunk in chunks]).startswith(b"\x89PNG\r\n\x1a\n")
+    assert properties["content_settings"]["content_type"] == "application/octet-stream"
+
+    assert await adls_blob_manager.open_blob("OID_Y/document.pdf", "OID_X") is None
+    assert await adls_blob_manager.open_blob("OID_X/document.pdf", None) is None
+
+
+@pytest.mark.asyncio
+async def test_container_existence_is_cached(monkeypatch, mock_env, blob_manager):
+    exists_checks = []
+    created = []
+    uploads = []
+
+    async def mock_exists(self, *args, **kwargs):
+        exists_checks.append(self.container_name)
+        return bool(created)
+
+    async def mock_create_container(self, *args, **kwargs):
+        created.append(self.container_name)
+
+    async def mock_upload_blob(self, name, data, *args, **kwargs):
+        uploads.append(name)
+        if len(uploads) == 2:
+            # The container was deleted after it was created
+            error = azure.core.exceptions.ResourceNotFoundError("The specified container does not exist.")
+            error.error_code = "ContainerNotFound"
+            raise error
+        return MagicMock(url=f"https://test.blob.core.windows.net/test/{name}")
+
+    async def mock_download_blob(self, *args, **kwargs):
+        raise azure.core.exceptions.ResourceNotFoundError("The specified blob does not exist.")
+
+    monkeypatch.setattr("azure.storage.blob.aio.ContainerClient.exists", mock_exists)
+    monkeypatch.setattr("azure.storage.blob.aio.ContainerClient.create_container", mock_create_container)
+    monkeypatch.setattr("azure.storage.blob.aio.ContainerClient.upload_blob", mock_upload_blob)
+    monkeypatch.setattr("azure.storage.blob.aio.BlobClient.download_blob", mock_download_blob)
+    monkeypatch.setattr(BlobManager, "add_image_citation", lambda *args: b"image")
+    blob_manager.image_container = "images"
+
+    await blob_manager.upload_document_image("doc.pdf", b"image", "figure1.png", 1)
+    assert exists_checks == [blob_manager.container]
+    assert len(created) == 1
+    assert blob_manager.container_client is blob_manager._get_container_client()
+
+    # The container is created again when an upload finds it's gone
+    await blob_manager.upload_document_image("doc.pdf", b"image", "figure2.png", 1)
+    assert uploads == ["doc.pdf/page1/figure1.png", "doc.pdf/page1/figure2.png", "doc.pdf/page1/figure2.png"]
+    assert len(exists_checks) == 2
+
+    # A missing blob isn't a reason to check the container again
+    assert await blob_manager.download_blob("missing.pdf") is None
+    assert await blob_manager.download_blob("missing.pdf") is None
+    assert len(exists_checks) == 2
+
+
+@pytest.mark.asyncio
+async def test_adls_directory_ownership_is_cached(monkeypatch, mock_data_lake_service_client):
+    checks = []
+
+    class MockDirectoryClient:
+        def __init__(self, path):
+            self.path = path
+
+        async def get_directory_properties(self, *args, **kwargs):
+            checks.append(self.path)
+
+        async def get_access_control(self, *args, **kwargs):
+            return {"owner": owners.get(self.path, "OID_X")}
+
+    owners: dict[str, str] = {}
+    monkeypatch.setattr(
+        azure.storage.filedatalake.aio.FileSystemClient,
+        "get_directory_client",
+        lambda self, path: MockDirectoryClient(path),
+    )
+    clock = [0.0]
+    adls_blob_manager = AdlsBlobManager(
+        endpoint="https://test-storage-account.dfs.core.windows.net",
+        container="test-storage-container",
+        credential=MockAzureCredential(),
+        directory_cache_ttl_seconds=60,
+        timer=lambda: clock[0],
+    )
+
+    await adls_blob_manager._ensure_directory("OID_X", "OID_X")
+    await adls_blob_manager._ensure_directory("OID_X", "OID_X")
+    await adls_blob_manager._ensure_directory("OID_X/images/a.pdf", "OID_X")
+    assert checks == ["OID_X", "OID_X/images/a.pdf"]
+    # The ownership verified for one user isn't reused for another
+    with pytest.raises(PermissionError):
+        await adls_blob_manager._ensure_directory("OID_X", "OID_Y")
+
+    clock[0] = 61
+    await adls_blob_manager._ensure_directory("OID_X", "OID_X")
+    assert checks[-1] == "OID_X"
+
+    # Directories are checked again once invalidated, such as when their owner changes
+    owners["OID_X"] = "OID_Z"
+    await adls_blob_manager._ensure_directory("OID_X/images/a.pdf", "OID_X")
+    adls_blob_manager.invalidate_directories("OID_X")
+    assert not adls_blob_manager.verified_directories
+    with pytest.raises(PermissionError):
+        await adls_blob_manager._ensure_directory("OID_X", "OID_X")
@@ -0,0 +1,206 @@
+from unittest.mock import MagicMock
+
+import pytest
+from azure.core.exceptions import ResourceNotModifiedError
+
+from prepdocslib.blobcache import BlobCache
+from prepdocslib.blobmanager import BlobManager
+
+from .mocks import MockAzureCredential
+
+KEY = ("https://account.blob.core.windows.net", "content", "Benefit_Options.pdf")
+
+
+class MockClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class MockBlobStorage:
+    def __init__(self, content: bytes = b"0123456789"):
+        self.content = content
+        self.etag = '"1"'
+        # The ETag that each download was conditional on, if any
+        self.downloads: list = []
+
+    def get_properties(self):
+        return {
+            "content_settings": {"content_type": "application/pdf"},
+            "etag": self.etag,
+            "size": len(self.content),
+        }
+
+    async def download(self, etag):
+        self.downloads.append(etag)
+        if etag == self.etag:
+            raise ResourceNotModifiedError()
+        return self.content, self.get_properties()
+
+    async def open(self, etag, offset=None, length=None):
+        self.downloads.append(etag)
+        if etag == self.etag:
+            raise ResourceNotModifiedError()
+
+        async def chunks():
+            content = self.content if offset is None else self.content[offset : offset + length]
+            yield content[:4]
+            yield content[4:]
+
+        return chunks(), self.get_properties()
+
+
+async def read(result):
+    chunks, properties = result
+    return b"".join([chunk async for chunk in chunks]), properties
+
+
+@pytest.mark.asyncio
+async def test_get_or_download_revalidates_with_etag():
+    clock = MockClock()
+    storage = MockBlobStorage()
+    cache = BlobCache(revalidate_seconds=60, timer=clock)
+
+    content, properties = await cache.get_or_download(KEY, storage.download)
+    assert content == b"0123456789"
+    assert properties["etag"] == '"1"'
+    assert (await cache.get_or_download(KEY, storage.download))[0] == b"0123456789"
+    assert storage.downloads == [None]
+
+    # Once stale, the blob is only downloaded again if its ETag has changed
+    clock.now = 61
+    assert (await cache.get_or_download(KEY, storage.download))[0] == b"0123456789"
+    assert storage.downloads == [None, '"1"']
+    assert (await cache.get_or_download(KEY, storage.download))[0] == b"0123456789"
+    assert len(storage.downloads) == 2
+
+    clock.now = 122
+    storage.content, storage.etag = b"new content", '"2"'
+    assert (await cache.get_or_download(KEY, storage.download))[0] == b"new content"
+    assert storage.downloads == [None, '"1"', '"1"']
+    assert cache.memory_bytes == len(b"new content")
+
+
+@pytest.mark.asyncio
+async def test_get_or_download_removes_deleted_blobs():
+    clock = MockClock()
+    storage = MockBlobStorage()
+    cache = BlobCache(revalidate_seconds=60, timer=clock)
+    await cache.get_or_download(KEY, storage.download)
+
+    async def not_found(etag):
+        return None
+
+    clock.now = 61
+    assert await cache.get_or_download(KEY, not_found) is None
+    assert KEY not in cache.memory
+
+
+@pytest.mark.asyncio
+async def test_cache_bounds_memory():
+    storage = MockBlobStorage()
+    cache = BlobCache(max_bytes=25, max_blob_bytes=10)
+    for path in ["a.pdf", "b.pdf", "c.pdf"]:
+        await cache.get_or_download((KEY[0], KEY[1], path), storage.download)
+    assert [key[2] for key in cache.memory] == ["b.pdf", "c.pdf"]
+    assert cache.memory_bytes == 20
+
+    # Blobs larger than max_blob_bytes aren't cached
+    storage.content = b"x" * 11
+    await cache.get_or_download((KEY[0], KEY[1], "large.pdf"), storage.download)
+    assert (KEY[0], KEY[1], "large.pdf") not in cache.memory
+
+
+@pytest.mark.asyncio
+async def test_open_serves_ranges_from_cache():
+    clock = MockClock()
+    storage = MockBlobStorage()
+    cache = BlobCache(revalidate_seconds=60, timer=clock)
+
+    # Ranges aren't cached, but whole blobs are once they've been read
+    content, _ = await read(await cache.open(KEY, 2, 3, lambda etag: storage.open(etag, 2, 3)))
+    assert content == b"234"
+    assert KEY not in cache.memory
+    content, properties = await read(await cache.open(KEY, None, None, storage.open))
+    assert content == b"0123456789"
+    assert KEY in cache.memory
+    assert storage.downloads == [None, None]
+
+    content, properties = await read(await cache.open(KEY, 2, 3, lambda etag: storage.open(etag, 2, 3)))
+    assert content == b"234"
+    assert properties["size"] == 10
+    clock.now = 61
+    content, _ = await read(await cache.open(KEY, 8, None, lambda etag: storage.open(etag, 8, None)))
+    assert content == b"89"
+    assert storage.downloads == [None, None, '"1"']
+
+    # Nothing is cached if the client stops reading the blob
+    other_key = (KEY[0], KEY[1], "other.pdf")
+    chunks, _ = await cache.open(other_key, None, None, storage.open)
+    assert await chunks.__anext__() == b"0123"
+    await chunks.aclose()
+    assert other_key not in cache.memory
+
+
+@pytest.mark.asyncio
+async def test_disk_tier(tmp_path):
+    clock = MockClock()
+    storage = MockBlobStorage()
+    cache = BlobCache(max_bytes=10, directory=str(tmp_path), max_disk_bytes=20, timer=clock)
+    for path in ["a.pdf", "b.pdf", "c.pdf"]:
+        await cache.get_or_download((KEY[0], KEY[1], path), storage.download)
+    assert [key[2] for key in cache.memory] == ["c.pdf"]
+    assert [key[2] for key in cache.disk] == ["b.pdf", "c.pdf"]
+    assert len(list(tmp_path.glob("*.blob"))) == 2
+
+    # Blobs evicted from memory are read back from disk
+    content, _ = await cache.get_or_download((KEY[0], KEY[1], "b.pdf"), storage.download)
+    assert content == b"0123456789"
+    assert len(storage.downloads) == 3
+
+    # Blobs cached on disk by a previous run are revalidated before they're served
+    restarted_cache = BlobCache(max_bytes=10, directory=str(tmp_path), max_disk_bytes=20, timer=clock)
+    assert set(restarted_cache.disk) == set(cache.disk)
+    content, properties = await restarted_cache.get_or_download((KEY[0], KEY[1], "c.pdf"), storage.download)
+    assert content == b"0123456789"
+    assert properties == storage.get_properties()
+    assert storage.downloads[-1] == '"1"'
+
+    await restarted_cache.pop_prefix((KEY[0], KEY[1], ""))
+    assert not restarted_cache.disk
+    assert not list(tmp_path.glob("*.blob"))
+
+
+@pytest.mark.asyncio
+async def test_blob_manager_download_blob_uses_cache(monkeypatch, mock_blob_container_client_exists):
+    conditions = []
+
+    class MockDownloadResponse:
+        def __init__(self):
+            self.properties = MagicMock(etag='"1"', content_settings=MagicMock(content_type="application/pdf"))
+
+        async def readall(self):
+            return b"test content"
+
+    async def mock_download_blob(self, etag=None, match_condition=None):
+        conditions.append(etag)
+        if etag == '"1"':
+            raise ResourceNotModifiedError()
+        return MockDownloadResponse()
+
+    monkeypatch.setattr("azure.storage.blob.aio.BlobClient.download_blob", mock_download_blob)
+    clock = MockClock()
+    blob_manager = BlobManager(
+        endpoint="https://test-storage-account.blob.core.windows.net",
+        credential=MockAzureCredential(),
+        container="test-storage-container",
+        blob_cache=BlobCache(revalidate_seconds=60, timer=clock),
+    )
+
+    assert (await blob_manager.download_blob("Benefit_Options.pdf"))[0] == b"test content"
+    assert (await blob_manager.download_blob("Benefit_Options.pdf"))[0] == b"test content"
+    clock.now = 61
+    assert (await blob_manager.download_blob("Benefit_Options.pdf"))[0] == b"test content"
+    assert conditions == [None, '"1"']
@@ -1,3 +1,4 @@
+import asyncio
 import json
 
 import pytest
@@ -255,3 +256,175 @@ async def test_compute_multimodal_embedding_no_client():
     # Test that calling compute_multimodal_embedding raises a ValueError
     with pytest.raises(ValueError, match="Approach is missing an image embeddings client for multimodal queries"):
         await chat_approach.compute_multimodal_embedding("What's in this image?")
+
+
+def test_get_query_overlap(chat_approach):
+    assert chat_approach.get_query_overlap("capital of France", "What is the capital of France?") == 1.0
+    assert chat_approach.get_query_overlap("Northwind Plus deductible", "How much is it?") == 0.0
+    assert chat_approach.get_query_overlap("capital France population", "Capital of France?") == pytest.approx(2 / 3)
+    assert chat_approach.get_query_overlap("", "Capital of France?") == 0.0
+
+
+@pytest.mark.asyncio
+async def test_compute_query_vectors_concurrently(chat_approach, monkeypatch):
+    started = []
+    both_started = asyncio.Event()
+
+    async def wait_for_other_embedding(kind):
+        started.append(kind)
+        if len(started) == 2:
+            both_started.set()
+        # Both embeddings must be in flight at the same time for this to complete
+        await asyncio.wait_for(both_started.wait(), timeout=1)
+
+    async def mock_compute_text_embedding(q):
+        await wait_for_other_embedding("text")
+        return VectorizedQuery(vector=[0.1], k_nearest_neighbors=50, fields="embedding3")
+
+    async def mock_compute_multimodal_embedding(q):
+        await wait_for_other_embedding("multimodal")
+        return VectorizedQuery(vector=[0.2], k_nearest_neighbors=50, fields="images/embedding")
+
+    monkeypatch.setattr(chat_approach, "compute_text_embedding", mock_compute_text_embedding)
+    monkeypatch.setattr(chat_approach, "compute_multimodal_embedding", mock_compute_multimodal_embedding)
+
+    vectors = await chat_approach.compute_query_vectors("query", True, True)
+    assert [vector.fields for vector in vectors] == ["embedding3", "images/embedding"]
+
+    assert await chat_approach.compute_query_vectors("query", False, False) == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "search_query, expected_outcome, expected_search_text",
+    [
+        ("capital of France", "kept", "What is the capital of France?"),
+        ("Paris population", "discarded", "Paris population"),
+    ],
+)
+async def test_run_search_approach_speculative_retrieval(
+    chat_approach, monkeypatch, search_query, expected_outcome, expected_search_text
+):
+    searches = []
+
+    async def mock_create_chat_completion(*args, **kwargs):
+        return ChatCompletion.model_validate(
+            {
+                "id": "test",
+                "object": "chat.completion",
+                "created": 0,
+                "model": "gpt-4.1-mini",
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": search_query},
+                    }
+                ],
+            }
+        )
+
+    async def record_and_mock_search(*args, **kwargs):
+        searches.append(kwargs.get("search_text"))
+        return await mock_search(*args, **kwargs)
+
+    monkeypatch.setattr(chat_approach, "create_chat_completion", mock_create_chat_completion)
+    monkeypatch.setattr(chat_approach, "get_search_query", lambda chat_completion, user_query: search_query)
+    monkeypatch.setattr(chat_approach, "build_filter", lambda overrides, auth_claims: None)
+    monkeypatch.setattr(SearchClient, "search", record_and_mock_search)
+
+    extra_info = await chat_approach.run_search_approach(
+        messages=[{"role": "user", "content": "What is the capital of France?"}],
+        overrides={"retrieval_mode": "text", "speculative_retrieval": True},
+        auth_claims={},
+    )
+
+    assert searches[-1] == expected_search_text
+    assert searches.count(search_query) == (1 if expected_outcome == "discarded" else 0)
+    search_thought = extra_info.thoughts[1]
+    assert search_thought.description == expected_search_text
+    assert search_thought.title == (
+        "Search using user query" if expected_outcome == "kept" else "Search using generated search query"
+    )
+    assert search_thought.props["speculative_retrieval"] == expected_outcome
+    assert search_thought.props["generated_search_query"] == search_query
+
+
+@pytest.mark.parametrize(
+    "messages, query_rewrite_mode, expected_reason",
+    [
+        ([{"role": "user", "content": "What is the capital of France?"}], "always", None),
+        ([{"role": "user", "content": "What is the capital of France?"}], "first_turn", "first_turn"),
+        ([{"role": "user", "content": "What is the capital of France?"}], "auto", "first_turn"),
+        (
+            [
+                {"role": "user", "content": "What is the capital of France?"},
+                {"role": "assistant", "content": "Paris."},
+                {"role": "user", "content": "What is the capital of Spain?"},
+            ],
+            "first_turn",
+            None,
+        ),
+        (
+            [
+                {"role": "user", "content": "What is the capital of France?"},
+                {"role": "assistant", "content": "Paris."},
+                {"role": "user", "content": "What is the capital of Spain?"},
+            ],
+            "auto",
+            "self_contained",
+        ),
+        (
+            [
+                {"role": "user", "content": "What is the capital of France?"},
+                {"role": "assistant", "content": "Paris."},
+                {"role": "user", "content": "How many people live there?"},
+            ],
+            "auto",
+            None,
+        ),
+        (
+            [
+                {"role": "user", "content": "What is the capital of France?"},
+                {"role": "assistant", "content": "Paris."},
+                {"role": "user", "content": "And Spain?"},
+            ],
+            "auto",
+            None,
+        ),
+    ],
+)
+def test_get_query_rewrite_skip_reason(chat_approach, messages, query_rewrite_mode, expected_reason):
+    assert (
+        chat_approach.get_query_rewrite_skip_reason(messages, messages[-1]["content"], query_rewrite_mode)
+        == expected_reason
+    )
+
+
+@pytest.mark.asyncio
+async def test_run_search_approach_skips_query_rewrite(chat_approach, monkeypatch):
+    searches = []
+
+    async def mock_create_chat_completion(*args, **kwargs):
+        raise AssertionError("The search query should not be generated")
+
+    async def record_and_mock_search(*args, **kwargs):
+        searches.append(kwargs.get("search_text"))
+        return await mock_search(*args, **kwargs)
+
+    monkeypatch.setattr(chat_approach, "create_chat_completion", mock_create_chat_completion)
+    monkeypatch.setattr(chat_approach, "build_filter", lambda overrides, auth_claims: None)
+    monkeypatch.setattr(SearchClient, "search", record_and_mock_search)
+
+    extra_info = await chat_approach.run_search_approach(
+        messages=[{"role": "user", "content": "What is the capital of France?"}],
+        overrides={"retrieval_mode": "text", "query_rewrite_mode": "first_turn"},
+        auth_claims={},
+    )
+
+    assert searches == ["What is the capital of France?"]
+    assert extra_info.thoughts[0].title == "Skipped search query generation"
+    assert extra_info.thoughts[0].props == {"query_rewrite": "skipped", "reason": "first_turn"}
+    assert extra_info.thoughts[1].title == "Search using user query"
+    assert extra_info.thoughts[1].description == "What is the capital of France?"
+    assert extra_info.thoughts[1].props["query_rewrite"] == "skipped"
@@ -174,3 +174,152 @@ async def test_content_file_useruploaded_notfound(
 
     response = await auth_client.get("/content/userdoc.pdf", headers={"Authorization": "Bearer test"})
     assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_content_file_useruploaded_wrong_owner(
+    monkeypatch, auth_client, mock_blob_container_client, mock_blob_container_client_exists
+):
+
+    class MockBlobClient:
+        async def download_blob(self):
+            raise ResourceNotFoundError(MockAiohttpClientResponse404("userdoc.pdf", b""))
+
+        async def get_blob_properties(self):
+            raise ResourceNotFoundError(MockAiohttpClientResponse404("userdoc.pdf", b""))
+
+    monkeypatch.setattr(
+        azure.storage.blob.aio.ContainerClient, "get_blob_client", lambda *args, **kwargs: MockBlobClient()
+    )
+
+    class MockDirectoryClient:
+        async def get_directory_properties(self):
+            return {"name": "test-directory"}
+
+        async def get_access_control(self):
+            # The directory belongs to another user
+            return {"owner": "OID_Y"}
+
+    monkeypatch.setattr(
+        azure.storage.filedatalake.aio.FileSystemClient,
+        "get_directory_client",
+        lambda *args, **kwargs: MockDirectoryClient(),
+    )
+
+    response = await auth_client.get("/content/userdoc.pdf", headers={"Authorization": "Bearer test"})
+    assert response.status_code == 404
+    # Range requests check the file's properties first
+    response = await auth_client.get(
+        "/content/userdoc.pdf", headers={"Authorization": "Bearer test", "Range": "bytes=0-9"}
+    )
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_content_file_range_and_conditional(
+    monkeypatch, mock_env, mock_acs_search, mock_blob_container_client_exists
+):
+    content = b"0123456789abcdefghijklmnopqr"
+    requests = []
+
+    class MockTransport(AsyncHttpTransport):
+        async def send(self, request: HttpRequest, **kwargs) -> AioHttpTransportResponse:
+            requests.append(request)
+            headers = {
+                "Content-Type": "application/pdf",
+                "ETag": '"0x8DC1"',
+                "Last-Modified": "Tue, 02 Jan 2024 03:04:05 GMT",
+            }
+            if request.method == "HEAD":
+                body = b""
+                headers["Content-Length"] = str(len(content))
+            else:
+                start, end = (int(part) for part in request.headers["x-ms-range"][len("bytes=") :].split("-"))
+                body = content[start : end + 1]
+                headers["Content-Length"] = str(len(body))
+                headers["Content-Range"] = f"bytes {start}-{start + len(body) - 1}/{len(content)}"
+            return AioHttpTransportResponse(request, MockAiohttpClientResponse(request.url, body, headers))
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *args):
+            pass
+
+        async def open(self):
+            pass
+
+        async def close(self):
+            pass
+
+    mock_blob_service_client = BlobServiceClient(
+        f"https://{os.environ['AZURE_STORAGE_ACCOUNT']}.blob.core.windows.net",
+        credential=MockAzureCredential(),
+        transport=MockTransport(),
+        retry_total=0,
+    )
+
+    quart_app = app.create_app()
+    async with quart_app.test_app() as test_app:
+        test_app.app.config[app.CONFIG_GLOBAL_BLOB_MANAGER].blob_service_client = mock_blob_service_client
+        client = test_app.test_client()
+
+        response = await client.get("/content/role_library.pdf")
+        assert response.status_code == 200
+        assert await response.get_data() == content
+        assert response.headers["Content-Length"] == "28"
+        assert response.headers["Accept-Ranges"] == "bytes"
+        assert response.headers["ETag"] == '"0x8DC1"'
+        assert response.headers["Last-Modified"] == "Tue, 02 Jan 2024 03:04:05 GMT"
+        assert [request.method for request in requests] == ["GET"]
+
+        requests.clear()
+        response = await client.get("/content/role_library.pdf", headers={"Range": "bytes=10-19"})
+        assert response.status_code == 206
+        assert await response.get_data() == b"abcdefghij"
+        assert response.headers["Content-Range"] == "bytes 10-19/28"
+        assert response.headers["Content-Length"] == "10"
+        assert requests[-1].headers["x-ms-range"] == "bytes=10-19"
+
+        response = await client.get("/content/role_library.pdf", headers={"Range": "bytes=-3"})
+        assert response.status_code == 206
+        assert await response.get_data() == b"pqr"
+        assert response.headers["Content-Range"] == "bytes 25-27/28"
+
+        response = await client.get("/content/role_library.pdf", headers={"Range": "bytes=50-60"})
+        assert response.status_code == 416
+        assert response.headers["Content-Range"] == "bytes */28"
+
+        # Multiple ranges aren't supported, so the whole file is returned
+        response = await client.get("/content/role_library.pdf", headers={"Range": "bytes=0-3,10-19"})
+        assert response.status_code == 200
+        assert await response.get_data() == content
+        assert "Content-Range" not in response.headers
+
+        # The range is ignored when the file has changed since the client got the first part of it
+        response = await client.get(
+            "/content/role_library.pdf", headers={"Range": "bytes=10-19", "If-Range": '"0x8DC0"'}
+        )
+        assert response.status_code == 200
+        assert await response.get_data() == content
+
+        requests.clear()
+        response = await client.get("/content/role_library.pdf", headers={"If-None-Match": '"0x8DC1"'})
+        assert response.status_code == 304
+        assert await response.get_data() == b""
+        assert response.headers["ETag"] == '"0x8DC1"'
+        assert [request.method for request in requests] == ["HEAD"]
+
+        response = await client.get("/content/role_library.pdf", headers={"If-None-Match": '"0x8DC0"'})
+        assert response.status_code == 200
+        assert await response.get_data() == content
+
+        response = await client.get(
+            "/content/role_library.pdf", headers={"If-Modified-Since": "Tue, 02 Jan 2024 03:04:05 GMT"}
+        )
+        assert response.status_code == 304
+
+        response = await client.get(
+            "/content/role_library.pdf", headers={"If-Modified-Since": "Mon, 01 Jan 2024 00:00:00 GMT"}
+        )
+        assert response.status_code == 200
@@ -0,0 +1,110 @@
+import pytest
+
+import app
+from approaches.approach import Document
+from approaches.contextpacker import ContextPacker, get_encoding
+
+SOURCE = (
+    "Northwind Health Plus covers preventive care, prescription drugs, mental health services and vision care. "
+    "Members can visit any in-network provider without a referral, and emergency services are covered worldwide. "
+    "The plan also includes a wellness program with discounts on gym memberships, smoking cessation support, "
+    "and nutrition counselling, as well as a nurse line that is available around the clock for urgent questions. "
+    "Out-of-network care is covered at a lower rate, after the annual deductible has been met by the member."
+)
+
+
+def test_get_encoding_falls_back_for_unknown_models():
+    assert get_encoding("gpt-35-turbo").name == "cl100k_base"
+    assert get_encoding("my-fine-tuned-model").name == "cl100k_base"
+
+
+def test_pack_fills_budget_by_score():
+    packer = ContextPacker(model="gpt-35-turbo", token_budget=1000)
+    sources = ["Benefit_Options.pdf#page=1: " + SOURCE, "Northwind_Standard.pdf#page=2: Dental care is not covered."]
+    tokens = [len(packer.encoding.encode(source)) for source in sources]
+
+    packed = packer.pack(sources, [1.5, 2.5])
+    assert packed.indexes == [1, 0]
+    assert packed.source_tokens == packed.packed_tokens == sum(tokens)
+    assert packed.tokens_saved == 0
+
+    # The lower scored source no longer fits
+    packed = packer.pack(sources, [1.5, 2.5], token_budget=tokens[1] + 1)
+    assert packed.indexes == [1]
+    assert packed.dropped == [0]
+    assert packed.tokens_saved == tokens[0]
+
+    # Smaller sources can still fill the rest of the budget
+    packed = packer.pack(sources, [2.5, 1.5], token_budget=tokens[1] + 1)
+    assert packed.indexes == [1]
+
+
+def test_pack_keeps_search_order_without_scores():
+    packer = ContextPacker(model="gpt-35-turbo", token_budget=1000)
+    packed = packer.pack(["a.pdf: first", "b.pdf: second", "c.pdf: third"], [None, 2.0, None])
+    assert packed.indexes == [1, 0, 2]
+
+
+def test_pack_skips_near_duplicates():
+    packer = ContextPacker(model="gpt-35-turbo", token_budget=1000)
+    first_half, second_half = SOURCE[:260], SOURCE[230:]
+    sources = [
+        "Benefit_Options.pdf#page=1: " + SOURCE,
+        # Chunks split from the same text, with an overlap between them
+        "Benefit_Options.pdf#page=1: " + first_half,
+        "Benefit_Options.pdf#page=2: " + second_half,
+        "Northwind_Standard.pdf#page=2: Dental care is not covered by Northwind Standard.",
+    ]
+    packed = packer.pack(sources, [3.0, 2.0, 1.0, 0.5])
+    assert packed.indexes == [0, 3]
+    assert packed.duplicates == [1, 2]
+    assert packed.dropped == []
+    assert packed.tokens_saved == sum(len(packer.encoding.encode(sources[i])) for i in (1, 2))
+
+
+def test_pack_keeps_chunks_with_small_overlap():
+    packer = ContextPacker(model="gpt-35-turbo", token_budget=1000)
+    packed = packer.pack([SOURCE[:260], SOURCE[230:]], [2.0, 1.0])
+    assert packed.indexes == [0, 1]
+
+
+def test_pack_sources(chat_approach):
+    chat_approach.context_packer = ContextPacker(model="gpt-35-turbo", token_budget=1000)
+    results = [
+        Document(id="1", sourcepage="Benefit_Options.pdf#page=1", content=SOURCE, reranker_score=2.0),
+        Document(id="2", sourcepage="Benefit_Options.pdf#page=2", content=SOURCE, reranker_score=3.0),
+        Document(id="3", sourcepage="Northwind_Standard.pdf#page=2", content="Dental care.", reranker_score=1.0),
+    ]
+
+    packed_results, thought = chat_approach.pack_sources(results, False, {"context_token_budget": 150})
+    assert [doc.id for doc in packed_results] == ["2", "3"]
+    assert thought is not None
+    assert thought.title == "Packed sources into the token budget"
+    assert thought.description == ["Benefit_Options.pdf#page=1"]
+    assert thought.props["token_budget"] == 150
+    assert thought.props["duplicate_sources"] == 1
+    assert thought.props["dropped_sources"] == 0
+    assert thought.props["tokens_saved"] == thought.props["source_tokens"] - thought.props["packed_tokens"] > 0
+
+    assert chat_approach.pack_sources(results, False, {"send_text_sources": False}) == (results, None)
+    chat_approach.context_packer = None
+    assert chat_approach.pack_sources(results, False, {}) == (results, None)
+
+
+@pytest.mark.asyncio
+async def test_chat_packs_sources(client):
+    client.app.config[app.CONFIG_CHAT_APPROACH].context_packer = ContextPacker(model="gpt-35-turbo", token_budget=1)
+    response = await client.post(
+        "/chat",
+        json={
+            "messages": [{"content": "What is the capital of France?", "role": "user"}],
+            "context": {"overrides": {"retrieval_mode": "text"}},
+        },
+    )
+    assert response.status_code == 200
+    result = await response.get_json()
+    assert result["context"]["data_points"]["text"] == []
+    thought = result["context"]["thoughts"][-2]
+    assert thought["title"] == "Packed sources into the token budget"
+    assert thought["props"]["packed_tokens"] == 0
+    assert thought["props"]["tokens_saved"] == thought["props"]["source_tokens"]
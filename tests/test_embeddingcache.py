@@ -0,0 +1,136 @@
+import asyncio
+
+import pytest
+from openai import AsyncOpenAI
+from openai.types.create_embedding_response import CreateEmbeddingResponse, Usage
+from openai.types.embedding import Embedding
+
+from approaches.embeddingcache import EmbeddingCache
+from core.cache import AsyncCoalescer
+from prepdocslib.embeddings import ImageEmbeddings
+
+
+@pytest.mark.asyncio
+async def test_coalescer_shares_in_flight_result():
+    calls = 0
+    release = asyncio.Event()
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return calls
+
+    coalescer: AsyncCoalescer[str, int] = AsyncCoalescer()
+    tasks = [asyncio.create_task(coalescer.run("key", compute)) for _ in range(3)]
+    await asyncio.sleep(0)
+    assert "key" in coalescer
+    release.set()
+    assert await asyncio.gather(*tasks) == [1, 1, 1]
+    assert calls == 1
+    assert len(coalescer) == 0
+
+
+@pytest.mark.asyncio
+async def test_coalescer_shares_exceptions():
+    release = asyncio.Event()
+
+    async def compute():
+        await release.wait()
+        raise ValueError("failed")
+
+    coalescer: AsyncCoalescer[str, int] = AsyncCoalescer()
+    tasks = [asyncio.create_task(coalescer.run("key", compute)) for _ in range(2)]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+    assert len(coalescer) == 0
+
+
+@pytest.mark.asyncio
+async def test_coalescer_retries_when_computing_caller_is_cancelled():
+    release = asyncio.Event()
+
+    async def slow_compute():
+        await release.wait()
+        return 1
+
+    async def fast_compute():
+        return 2
+
+    coalescer: AsyncCoalescer[str, int] = AsyncCoalescer()
+    first = asyncio.create_task(coalescer.run("key", slow_compute))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(coalescer.run("key", fast_compute))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert await second == 2
+    assert first.cancelled()
+
+
+@pytest.mark.asyncio
+async def test_embedding_cache_stores_float32_vectors():
+    calls = 0
+
+    async def create():
+        nonlocal calls
+        calls += 1
+        return [0.1, 0.2, 0.3]
+
+    cache = EmbeddingCache(max_entries=10)
+    assert await cache.get_or_create(("text", "model", "", "query"), create) == [0.1, 0.2, 0.3]
+    cached = await cache.get_or_create(("text", "model", "", "query"), create)
+    assert cached == pytest.approx([0.1, 0.2, 0.3], abs=1e-7)
+    assert calls == 1
+    assert cache.cache.get(("text", "model", "", "query")).typecode == "f"
+    assert cache.stats.hits == 2
+    assert cache.stats.misses == 1
+
+
+@pytest.mark.asyncio
+async def test_compute_text_embedding_uses_cache(monkeypatch, chat_approach):
+    requests = []
+
+    async def mock_create(*args, **kwargs):
+        requests.append(kwargs)
+        return CreateEmbeddingResponse(
+            object="list",
+            data=[Embedding(embedding=[0.5, -0.25], index=0, object="embedding")],
+            model="text-embedding-3-large",
+            usage=Usage(prompt_tokens=8, total_tokens=8),
+        )
+
+    chat_approach.openai_client = AsyncOpenAI(api_key="test")
+    monkeypatch.setattr(chat_approach.openai_client.embeddings, "create", mock_create)
+    chat_approach.embedding_cache = EmbeddingCache()
+
+    first, second, other = await asyncio.gather(
+        chat_approach.compute_text_embedding("capital of France"),
+        chat_approach.compute_text_embedding("capital of France"),
+        chat_approach.compute_text_embedding("capital of Spain"),
+    )
+    third = await chat_approach.compute_text_embedding("capital of France")
+    assert first.vector == second.vector == third.vector == [0.5, -0.25]
+    assert third.fields == "embedding3"
+    assert [request["input"] for request in requests] == ["capital of France", "capital of Spain"]
+    assert requests[0]["model"] == "embeddings"
+
+
+@pytest.mark.asyncio
+async def test_compute_multimodal_embedding_uses_cache(monkeypatch, chat_approach):
+    queries = []
+
+    async def mock_create_embedding_for_text(self, q: str):
+        queries.append(q)
+        return [0.5, 0.25]
+
+    monkeypatch.setattr(ImageEmbeddings, "create_embedding_for_text", mock_create_embedding_for_text)
+    chat_approach.image_embeddings_client = ImageEmbeddings(endpoint="https://mock-endpoint", token_provider=None)
+    chat_approach.embedding_cache = EmbeddingCache()
+
+    await chat_approach.compute_multimodal_embedding("What's in this image?")
+    result = await chat_approach.compute_multimodal_embedding("What's in this image?")
+    assert result.vector == [0.5, 0.25]
+    assert result.fields == "images/embedding"
+    assert queries == ["What's in this image?"]
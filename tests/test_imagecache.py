@@ -0,0 +1,145 @@
+import asyncio
+import base64
+
+import pytest
+
+from approaches.approach import Document
+from approaches.imagecache import ImageSourceCache
+from core.cache import TTLCache
+from prepdocslib.blobmanager import BlobManager
+
+from .mocks import MockAzureCredential
+
+
+def test_ttlcache_evicts_by_size():
+    cache: TTLCache[str, str] = TTLCache(max_entries=10, max_size=10, get_size=len)
+    cache.set("a", "aaaa")
+    cache.set("b", "bbbb")
+    cache.set("c", "cccc")
+    assert "a" not in cache
+    assert cache.size == 8
+    cache.set("b", "bb")
+    assert cache.size == 6
+    cache.set("d", "d" * 11)
+    assert "d" not in cache
+    cache.pop("c")
+    assert cache.size == 2
+    cache.clear()
+    assert cache.size == 0
+
+
+class MockImageStorage:
+    def __init__(self):
+        self.etag = '"1"'
+        self.downloads = 0
+        self.etag_checks = 0
+
+    async def get_etag(self):
+        self.etag_checks += 1
+        return self.etag
+
+    async def download(self):
+        self.downloads += 1
+        return f"data:image/png;base64,{self.etag}", self.etag
+
+
+@pytest.mark.asyncio
+async def test_image_cache_serves_fresh_images():
+    storage = MockImageStorage()
+    cache = ImageSourceCache(max_bytes=1000, revalidate_seconds=300)
+    key = ("", "https://account.blob.core.windows.net/images/figure.png")
+
+    assert await cache.get_or_download(key, storage.get_etag, storage.download) == 'data:image/png;base64,"1"'
+    assert await cache.get_or_download(key, storage.get_etag, storage.download) == 'data:image/png;base64,"1"'
+    assert storage.downloads == 1
+    assert storage.etag_checks == 0
+    assert cache.size == len('data:image/png;base64,"1"')
+
+
+@pytest.mark.asyncio
+async def test_image_cache_revalidates_etag():
+    storage = MockImageStorage()
+    cache = ImageSourceCache(max_bytes=1000, revalidate_seconds=0)
+    key = ("", "https://account.blob.core.windows.net/images/figure.png")
+
+    await cache.get_or_download(key, storage.get_etag, storage.download)
+    assert await cache.get_or_download(key, storage.get_etag, storage.download) == 'data:image/png;base64,"1"'
+    assert storage.downloads == 1
+    assert storage.etag_checks == 1
+
+    storage.etag = '"2"'
+    assert await cache.get_or_download(key, storage.get_etag, storage.download) == 'data:image/png;base64,"2"'
+    assert storage.downloads == 2
+    # The data URI of the previous version is dropped
+    assert len(cache.data_uris) == 1
+
+
+@pytest.mark.asyncio
+async def test_image_cache_skips_images_without_etag():
+    cache = ImageSourceCache(max_bytes=1000)
+    downloads = 0
+
+    async def download():
+        nonlocal downloads
+        downloads += 1
+        return "data:image/png;base64,abc", None
+
+    async def get_etag():
+        return None
+
+    for _ in range(2):
+        assert await cache.get_or_download(("", "figure.png"), get_etag, download) == "data:image/png;base64,abc"
+    assert downloads == 2
+
+
+@pytest.mark.asyncio
+async def test_get_sources_content_downloads_images_concurrently(chat_approach, monkeypatch):
+    in_flight = 0
+    max_in_flight = 0
+    downloaded = []
+
+    async def mock_download_blob(self, blob_path, user_oid=None):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        downloaded.append(blob_path)
+        return blob_path.encode(), {"etag": '"1"'}
+
+    monkeypatch.setattr(BlobManager, "download_blob", mock_download_blob)
+    chat_approach.global_blob_manager = BlobManager(
+        endpoint="https://test-globalstorage-account.blob.core.windows.net",
+        container="test-globalstorage-container",
+        credential=MockAzureCredential(),
+    )
+    chat_approach.image_cache = ImageSourceCache()
+    chat_approach.MAX_CONCURRENT_IMAGE_DOWNLOADS = 2
+    image_urls = [f"https://test-globalstorage-account.blob.core.windows.net/images/figure{i}.png" for i in range(4)]
+    results = [
+        Document(sourcepage="a.pdf#page=1", content="a", images=[{"url": url} for url in image_urls[:3]]),
+        Document(sourcepage="b.pdf#page=1", content="b", images=[{"url": url} for url in image_urls[2:]]),
+    ]
+
+    data_points = await chat_approach.get_sources_content(
+        results, use_semantic_captions=False, include_text_sources=True, download_image_sources=True
+    )
+    assert max_in_flight == 2
+    assert sorted(downloaded) == [f"figure{i}.png" for i in range(4)]
+    # Images keep the order of the search results
+    assert data_points.images == [
+        "data:image/png;base64," + base64.b64encode(f"figure{i}.png".encode()).decode() for i in range(4)
+    ]
+    assert data_points.citations == [
+        "a.pdf#page=1",
+        "a.pdf#page=1(figure0.png)",
+        "a.pdf#page=1(figure1.png)",
+        "a.pdf#page=1(figure2.png)",
+        "b.pdf#page=1",
+        "b.pdf#page=1(figure3.png)",
+    ]
+
+    await chat_approach.get_sources_content(
+        results, use_semantic_captions=False, include_text_sources=True, download_image_sources=True
+    )
+    assert len(downloaded) == 4
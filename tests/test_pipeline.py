@@ -0,0 +1,116 @@
+import asyncio
+import logging
+
+import pytest
+
+from prepdocslib.pipeline import PipelineProgress, PipelineStage, run_pipeline
+
+
+async def items(count: int, produced: list):
+    for item in range(count):
+        produced.append(item)
+        yield item
+
+
+@pytest.mark.asyncio
+async def test_run_pipeline_passes_items_through_stages_in_order():
+    produced: list = []
+    indexed: list = []
+
+    async def double(item):
+        return item * 2
+
+    async def drop_odd_halves(item):
+        return item if item % 4 == 0 else None
+
+    async def index(item):
+        indexed.append(item)
+
+    progress = PipelineProgress()
+    await run_pipeline(
+        items(10, produced),
+        [
+            PipelineStage("double", 1, double),
+            PipelineStage("filter", 1, drop_odd_halves),
+            PipelineStage("index", 1, index),
+        ],
+        progress=progress,
+    )
+
+    assert indexed == [0, 4, 8, 12, 16]
+    assert progress.counts == {"double": 10, "filter": 10, "index": 5}
+
+
+@pytest.mark.asyncio
+async def test_run_pipeline_limits_concurrency_per_stage():
+    running = {"slow": 0}
+    most_running = {"slow": 0}
+
+    async def slow(item):
+        running["slow"] += 1
+        most_running["slow"] = max(most_running["slow"], running["slow"])
+        await asyncio.sleep(0.01)
+        running["slow"] -= 1
+        return item
+
+    done: list = []
+
+    async def finish(item):
+        done.append(item)
+
+    await run_pipeline(items(20, []), [PipelineStage("slow", 3, slow), PipelineStage("finish", 1, finish)])
+
+    assert most_running["slow"] == 3
+    assert sorted(done) == list(range(20))
+
+
+@pytest.mark.asyncio
+async def test_run_pipeline_applies_backpressure_to_the_source():
+    produced: list = []
+    release = asyncio.Event()
+
+    async def blocked(item):
+        await release.wait()
+
+    pipeline = asyncio.ensure_future(run_pipeline(items(100, produced), [PipelineStage("blocked", 2, blocked)]))
+    await asyncio.sleep(0.05)
+    # 2 items in progress, plus a queue of 2 * 2, plus the one waiting to be queued
+    assert len(produced) == 7
+    release.set()
+    await pipeline
+    assert len(produced) == 100
+
+
+@pytest.mark.asyncio
+async def test_run_pipeline_cancels_the_other_stages_when_a_stage_fails():
+    cancelled = asyncio.Event()
+
+    async def fail(item):
+        if item == 3:
+            raise ValueError("bad item")
+        return item
+
+    async def wait_forever(item):
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    with pytest.raises(ValueError, match="bad item"):
+        await run_pipeline(items(10, []), [PipelineStage("fail", 1, fail), PipelineStage("wait", 1, wait_forever)])
+    assert cancelled.is_set()
+
+
+@pytest.mark.asyncio
+async def test_run_pipeline_reports_progress(caplog):
+    async def slow(item):
+        await asyncio.sleep(0.02)
+
+    with caplog.at_level(logging.INFO, logger="scripts"):
+        await run_pipeline(items(5, []), [PipelineStage("slow", 1, slow)], report_interval=0.03)
+
+    assert "Progress after" in caplog.text
+    assert "waiting: slow" in caplog.text
+    assert "Finished after" in caplog.text
+    assert "slow 5 (" in caplog.text
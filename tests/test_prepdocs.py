@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from unittest.mock import AsyncMock
 
@@ -13,27 +14,18 @@ from prepdocslib.embeddings import (
     ImageEmbeddings,
     OpenAIEmbeddingService,
 )
+from prepdocslib.ratelimiter import RateLimiter
 
 from .mocks import (
     MOCK_EMBEDDING_DIMENSIONS,
     MOCK_EMBEDDING_MODEL_NAME,
     MockAzureCredential,
+    MockClient,
+    MockEmbeddingsClient,
+    MockRawEmbeddingsClient,
 )
 
 
-class MockEmbeddingsClient:
-    def __init__(self, create_embedding_response: openai.types.CreateEmbeddingResponse):
-        self.create_embedding_response = create_embedding_response
-
-    async def create(self, *args, **kwargs) -> openai.types.CreateEmbeddingResponse:
-        return self.create_embedding_response
-
-
-class MockClient:
-    def __init__(self, embeddings_client):
-        self.embeddings = embeddings_client
-
-
 @pytest.mark.asyncio
 async def test_compute_embedding_success(monkeypatch):
     async def mock_create_client(*args, **kwargs):
@@ -138,6 +130,10 @@ class RateLimitMockEmbeddingsClient:
             message="Rate limited on the OpenAI embeddings API", response=fake_response(409), body=None
         )
 
+    @property
+    def with_raw_response(self) -> MockRawEmbeddingsClient:
+        return MockRawEmbeddingsClient(self)
+
 
 async def create_rate_limit_client(*args, **kwargs):
     return MockClient(embeddings_client=RateLimitMockEmbeddingsClient())
@@ -181,10 +177,101 @@ async def test_compute_embedding_ratelimiterror_single(monkeypatch, caplog):
         assert caplog.text.count("Rate limited on the OpenAI embeddings API") == 14
 
 
+class ConcurrentMockEmbeddingsClient:
+    """Embeds each text as its number, and records how many requests were in progress at once"""
+
+    def __init__(self):
+        self.in_progress = 0
+        self.most_in_progress = 0
+        self.calls = 0
+
+    async def create(self, *args, input, **kwargs) -> openai.types.CreateEmbeddingResponse:
+        self.calls += 1
+        self.in_progress += 1
+        self.most_in_progress = max(self.most_in_progress, self.in_progress)
+        await asyncio.sleep(0.01)
+        self.in_progress -= 1
+        return openai.types.CreateEmbeddingResponse(
+            object="list",
+            data=[
+                openai.types.Embedding(embedding=[float(text.split()[0])], index=index, object="embedding")
+                for index, text in enumerate(input)
+            ],
+            model=MOCK_EMBEDDING_MODEL_NAME,
+            usage=Usage(prompt_tokens=8, total_tokens=8),
+        )
+
+    @property
+    def with_raw_response(self) -> MockRawEmbeddingsClient:
+        return MockRawEmbeddingsClient(self)
+
+
+@pytest.mark.asyncio
+async def test_compute_embedding_batches_concurrently(monkeypatch):
+    embeddings_client = ConcurrentMockEmbeddingsClient()
+
+    async def mock_create_client(*args, **kwargs):
+        return MockClient(embeddings_client=embeddings_client)
+
+    embeddings = OpenAIEmbeddingService(
+        open_ai_model_name=MOCK_EMBEDDING_MODEL_NAME,
+        open_ai_dimensions=MOCK_EMBEDDING_DIMENSIONS,
+        credential="key",
+        rate_limiter=RateLimiter(),
+    )
+    monkeypatch.setattr(embeddings, "create_client", mock_create_client)
+
+    # Batches hold at most 16 texts, so this makes 7 batches
+    texts = [f"{number} text" for number in range(100)]
+    assert await embeddings.create_embeddings(texts=texts) == [[float(number)] for number in range(100)]
+    assert embeddings_client.calls == 7
+    assert embeddings_client.most_in_progress == OpenAIEmbeddingService.MAX_CONCURRENT_BATCHES
+
+
+class RetryAfterMockEmbeddingsClient(ConcurrentMockEmbeddingsClient):
+    async def create(self, *args, **kwargs) -> openai.types.CreateEmbeddingResponse:
+        if self.calls == 0:
+            self.calls += 1
+            response = Response(
+                429, request=Request(method="post", url="https://foo.bar/"), headers={"retry-after-ms": "10"}
+            )
+            raise openai.RateLimitError(message="Rate limited", response=response, body=None)
+        return await super().create(*args, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_compute_embedding_honours_retry_after(monkeypatch):
+    def fail_random_wait(self, retry_state):
+        raise AssertionError("Expected to wait for retry-after instead")
+
+    monkeypatch.setattr(tenacity.wait_random_exponential, "__call__", fail_random_wait)
+    embeddings_client = RetryAfterMockEmbeddingsClient()
+
+    async def mock_create_client(*args, **kwargs):
+        return MockClient(embeddings_client=embeddings_client)
+
+    rate_limiter = RateLimiter()
+    embeddings = OpenAIEmbeddingService(
+        open_ai_model_name=MOCK_EMBEDDING_MODEL_NAME,
+        open_ai_dimensions=MOCK_EMBEDDING_DIMENSIONS,
+        credential="key",
+        rate_limiter=rate_limiter,
+    )
+    monkeypatch.setattr(embeddings, "create_client", mock_create_client)
+
+    assert await embeddings.create_embeddings(texts=["1 text"]) == [[1.0]]
+    assert embeddings_client.calls == 2
+    assert rate_limiter.blocked_until > 0
+
+
 class AuthenticationErrorMockEmbeddingsClient:
     async def create(self, *args, **kwargs) -> openai.types.CreateEmbeddingResponse:
         raise openai.AuthenticationError(message="Bad things happened.", response=fake_response(403), body=None)
 
+    @property
+    def with_raw_response(self) -> MockRawEmbeddingsClient:
+        return MockRawEmbeddingsClient(self)
+
 
 async def create_auth_error_limit_client(*args, **kwargs):
     return MockClient(embeddings_client=AuthenticationErrorMockEmbeddingsClient())
@@ -1,17 +1,24 @@
+import asyncio
 import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
 
 import pytest
 from azure.search.documents.aio import SearchClient
 
 from prepdocslib.blobmanager import BlobManager
 from prepdocslib.fileprocessor import FileProcessor
-from prepdocslib.filestrategy import FileStrategy
+from prepdocslib.filestrategy import FileStrategy, IngestionConcurrency, parse_file
 from prepdocslib.listfilestrategy import (
     ADLSGen2ListFileStrategy,
+    File,
+    LocalListFileStrategy,
 )
+from prepdocslib.page import Chunk, Page
+from prepdocslib.pdfparser import LocalPdfParser
 from prepdocslib.strategy import SearchInfo
 from prepdocslib.textparser import TextParser
-from prepdocslib.textsplitter import SimpleTextSplitter
+from prepdocslib.textsplitter import SentenceTextSplitter, SimpleTextSplitter
 
 from .mocks import MockAzureCredential
 
@@ -100,3 +107,90 @@ async def test_file_strategy_adls2(monkeypatch, mock_env, mock_data_lake_service
             "storageUrl": "https://test.blob.core.windows.net/c.txt",
         },
     ]
+
+
+@pytest.mark.asyncio
+async def test_parse_file_in_worker_processes():
+    file_processors = {".pdf": FileProcessor(LocalPdfParser(), SentenceTextSplitter())}
+    path = os.path.join(os.path.dirname(__file__), "test-data", "en_An Occurrence at Owl Creek Bridge.pdf")
+
+    with open(path, "rb") as content:
+        sections = await parse_file(File(content=content), file_processors)
+    with open(path, "rb") as content, ProcessPoolExecutor(max_workers=2) as executor:
+        sections_from_workers = await parse_file(File(content=content), file_processors, executor=executor)
+
+    assert len(sections_from_workers) > 1
+    assert [(section.chunk.page_num, section.chunk.text) for section in sections_from_workers] == [
+        (section.chunk.page_num, section.chunk.text) for section in sections
+    ]
+
+
+def test_pages_and_chunks_pickle_as_tuples():
+    page = Page(page_num=1, offset=10, text="Some text")
+    chunk = Chunk(page_num=1, text="Some text")
+
+    assert pickle.loads(pickle.dumps(page)) == page
+    assert pickle.loads(pickle.dumps(chunk)) == chunk
+    assert b"offset" not in pickle.dumps(page)
+
+
+def test_ingestion_concurrency_parse_option():
+    assert IngestionConcurrency.parse_option("4") == IngestionConcurrency(upload=4, parse=4, embed=4, index=4)
+    assert IngestionConcurrency.parse_option("upload=8, embed=2") == IngestionConcurrency(upload=8, embed=2)
+    with pytest.raises(ValueError):
+        IngestionConcurrency.parse_option("download=2")
+    with pytest.raises(ValueError):
+        IngestionConcurrency.parse_option("parse=0")
+
+
+@pytest.mark.asyncio
+async def test_file_strategy_concurrent_pipeline(monkeypatch, tmp_path):
+    for index in range(10):
+        (tmp_path / f"file{index}.txt").write_text(f"text {index}")
+
+    class MockBlobManager:
+        def __init__(self):
+            self.uploaded: list[str] = []
+
+        async def upload_blob(self, file):
+            await asyncio.sleep(0.01)
+            self.uploaded.append(file.filename())
+
+    uploaded_to_search = []
+
+    async def mock_upload_documents(self, documents):
+        await asyncio.sleep(0.01)
+        uploaded_to_search.extend(documents)
+
+    monkeypatch.setattr(SearchClient, "upload_documents", mock_upload_documents)
+
+    listed_files = []
+    list_file_strategy = LocalListFileStrategy(path_pattern=str(tmp_path / "*"))
+    list_files = list_file_strategy.list
+
+    async def mock_list():
+        async for file in list_files():
+            listed_files.append(file)
+            yield file
+
+    monkeypatch.setattr(list_file_strategy, "list", mock_list)
+
+    blob_manager = MockBlobManager()
+    file_strategy = FileStrategy(
+        list_file_strategy=list_file_strategy,
+        blob_manager=blob_manager,  # type: ignore[arg-type]
+        search_info=SearchInfo(
+            endpoint="https://testsearchclient.blob.core.windows.net",
+            credential=MockAzureCredential(),
+            index_name="test",
+        ),
+        file_processors={".txt": FileProcessor(TextParser(), SimpleTextSplitter())},
+        concurrency=IngestionConcurrency(upload=4, parse=2, embed=2, index=2),
+    )
+
+    await file_strategy.run()
+
+    expected = sorted(f"file{index}.txt" for index in range(10))
+    assert sorted(blob_manager.uploaded) == expected
+    assert sorted(document["sourcefile"] for document in uploaded_to_search) == expected
+    assert all(file.content.closed for file in listed_files)
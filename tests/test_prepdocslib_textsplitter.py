@@ -6,13 +6,15 @@ import pytest
 import tiktoken
 
 from prepdocslib.listfilestrategy import LocalListFileStrategy
-from prepdocslib.page import Page
+from prepdocslib.page import Chunk, Page
 from prepdocslib.pdfparser import LocalPdfParser
 from prepdocslib.searchmanager import Section
 from prepdocslib.textsplitter import (
     ENCODING_MODEL,
     SentenceTextSplitter,
     SimpleTextSplitter,
+    _ChunkBuilder,
+    _TokenCounter,
 )
 
 # Deterministic single-token character used to create token pressure by repetition
@@ -197,6 +199,20 @@ def test_pages_with_figures(snapshot, file_name):
     snapshot.assert_match(chunks_json, "split_pages_with_figures.json")
 
 
+@pytest.mark.parametrize("file_name", ["pages_with_figures.json", "pages_with_just_text.json"])
+def test_token_counter_joined_counts_match_full_encoding(file_name):
+    with open(Path(__file__).parent / "test-data" / file_name) as f:
+        texts = [page["text"] for page in json.load(f)]
+    counter = _TokenCounter()
+    extra_texts = ["", " the", "a", "-word", "\nNew line", "。続く", "12 items"]
+    for text in [*texts, "plain words only", "no gaps here", "語 語"]:
+        for split in range(0, len(text) + 1, max(1, len(text) // 25)):
+            fixed, varying = text[:split], text[split:]
+            for extra in [varying, *extra_texts]:
+                assert counter.with_prefix(fixed)(extra) == len(_bpe_for_guard.encode(fixed + extra))
+                assert counter.with_suffix(varying)(extra) == len(_bpe_for_guard.encode(extra + varying))
+
+
 def test_large_figure_not_split():
     # Construct an intentionally large figure (repeated table rows) that would exceed token limits if split naively
     repeated_rows = "".join([f"<tr><td>{i}</td><td>Data {i}</td></tr>" for i in range(200)])
@@ -447,6 +463,32 @@ def test_sentence_boundary_left_midpoint_exact():
     assert chunks[0].text.endswith("."), "First chunk should end with midpoint period"
 
 
+def test_find_split_pos_prefers_nearest_boundary_left_on_tie():
+    """Boundaries equally far from the midpoint resolve to the left one; a nearer right one wins."""
+    splitter = SentenceTextSplitter()
+    # length 31, midpoint 15: periods at 12 and 18 are both 3 away
+    assert splitter._find_split_pos("a" * 12 + "." + "a" * 5 + "." + "a" * 12) == (12, False)
+    # period at 17 is nearer than the one at 11
+    assert splitter._find_split_pos("a" * 11 + "." + "a" * 5 + "." + "a" * 13) == (17, False)
+    # sentence endings anywhere in the window beat a word break at the midpoint
+    assert splitter._find_split_pos("a" * 15 + " " + "a" + "!" + "a" * 13) == (17, False)
+    # outside the central third nothing is found
+    assert splitter._find_split_pos("." + "a" * 29 + ".") == (-1, True)
+
+
+def test_chunk_builder_tracks_char_length():
+    builder = _ChunkBuilder(page_num=0, max_chars=10, max_tokens=100)
+    assert builder.add("abcd", 1)
+    assert builder.add("efgh", 1)
+    assert not builder.add("ijk", 1)
+    builder.force_append("<figure></figure>")
+    assert builder.char_len == len("".join(builder.parts))
+    chunks: list[Chunk] = []
+    builder.flush_into(chunks)
+    assert builder.char_len == 0
+    assert builder.add("ijklmnopqr", 1)
+
+
 def test_recursive_split_prefers_word_break_over_overlap():
     """Punctuation-free text with spaces should split at a word break (space) rather than arbitrary midpoint overlap duplication."""
     # Use deterministic single-token chars to guarantee token overflow.
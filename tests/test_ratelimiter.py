@@ -0,0 +1,135 @@
+import pytest
+
+from prepdocslib.ratelimiter import RateLimiter, parse_duration
+
+
+class MockClock:
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps: list[float] = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = MockClock()
+    monkeypatch.setattr("prepdocslib.ratelimiter.asyncio.sleep", clock.sleep)
+    return clock
+
+
+def test_parse_duration():
+    assert parse_duration("1s") == 1
+    assert parse_duration("6m0s") == 360
+    assert parse_duration("20ms") == 0.02
+    assert parse_duration("1h2m3.5s") == 3723.5
+    assert parse_duration("soon") is None
+    assert parse_duration(None) is None
+
+
+@pytest.mark.asyncio
+async def test_acquire_without_limits_does_not_wait(clock):
+    limiter = RateLimiter(clock=clock)
+    for _ in range(100):
+        await limiter.acquire(10000)
+    assert clock.sleeps == []
+
+
+@pytest.mark.asyncio
+async def test_acquire_paces_requests_to_tokens_per_minute(clock):
+    limiter = RateLimiter(tokens_per_minute=6000, clock=clock)
+    await limiter.acquire(4000)
+    assert clock.sleeps == []
+    # 2000 tokens are left, and the budget refills at 100 tokens per second
+    await limiter.acquire(3000)
+    assert clock.sleeps == [pytest.approx(10)]
+
+
+@pytest.mark.asyncio
+async def test_acquire_paces_requests_to_requests_per_minute(clock):
+    limiter = RateLimiter(requests_per_minute=2, clock=clock)
+    await limiter.acquire(1)
+    await limiter.acquire(1)
+    await limiter.acquire(1)
+    assert clock.sleeps == [pytest.approx(30)]
+
+
+@pytest.mark.asyncio
+async def test_acquire_more_than_the_limit_waits_for_a_full_budget(clock):
+    limiter = RateLimiter(tokens_per_minute=1000, clock=clock)
+    await limiter.acquire(1000)
+    await limiter.acquire(5000)
+    assert clock.sleeps == [pytest.approx(60)]
+
+
+@pytest.mark.asyncio
+async def test_update_learns_limits_from_headers(clock):
+    limiter = RateLimiter(clock=clock)
+    limiter.update(
+        {
+            "x-ratelimit-limit-requests": "60",
+            "x-ratelimit-limit-tokens": "60000",
+            "x-ratelimit-remaining-requests": "59",
+            "x-ratelimit-remaining-tokens": "1000",
+        }
+    )
+    await limiter.acquire(1000)
+    assert clock.sleeps == []
+    # The budget is empty, and refills at 1000 tokens per second
+    await limiter.acquire(2000)
+    assert clock.sleeps == [pytest.approx(2)]
+
+
+@pytest.mark.asyncio
+async def test_update_without_limit_waits_until_reset(clock):
+    limiter = RateLimiter(clock=clock)
+    limiter.update({"x-ratelimit-remaining-tokens": "100", "x-ratelimit-reset-tokens": "6s"})
+    await limiter.acquire(500)
+    assert clock.sleeps == [pytest.approx(6)]
+    # After the reset, nothing is known about the budget until the next response
+    await limiter.acquire(500)
+    assert clock.sleeps == [pytest.approx(6)]
+
+
+@pytest.mark.asyncio
+async def test_update_without_limit_or_reset_forgets_the_remaining_budget(clock):
+    limiter = RateLimiter(clock=clock)
+    limiter.update({"x-ratelimit-remaining-requests": "0"})
+    await limiter.acquire(1)
+    assert clock.sleeps == [pytest.approx(1)]
+
+
+@pytest.mark.asyncio
+async def test_update_never_raises_the_budget(clock):
+    limiter = RateLimiter(tokens_per_minute=6000, clock=clock)
+    await limiter.acquire(6000)
+    limiter.update({"x-ratelimit-remaining-tokens": "6000"})
+    await limiter.acquire(600)
+    assert clock.sleeps == [pytest.approx(6)]
+
+
+@pytest.mark.asyncio
+async def test_retry_after_holds_back_all_requests(clock):
+    limiter = RateLimiter(clock=clock)
+    assert limiter.retry_after({"retry-after": "12"}) == 12
+    assert limiter.retry_after({"retry-after-ms": "500"}) == 0.5
+    await limiter.acquire(1)
+    assert clock.sleeps == [pytest.approx(12)]
+    await limiter.acquire(1)
+    assert clock.sleeps == [pytest.approx(12)]
+
+
+def test_retry_after_without_header():
+    assert RateLimiter().retry_after({}) is None
+
+
+def test_shared_limiter_per_key():
+    assert RateLimiter.shared("https://a.openai.azure.com/emb") is RateLimiter.shared("https://a.openai.azure.com/emb")
+    assert RateLimiter.shared("https://a.openai.azure.com/emb") is not RateLimiter.shared(
+        "https://b.openai.azure.com/emb"
+    )
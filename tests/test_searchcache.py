@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+from azure.search.documents.aio import SearchClient
+from azure.search.documents.models import VectorizedQuery
+
+from approaches.searchcache import SearchResultCache, hash_vector_queries
+
+from .conftest import mock_search
+
+
+def test_hash_vector_queries():
+    vector = VectorizedQuery(vector=[0.1, 0.2], k_nearest_neighbors=50, fields="embedding")
+    assert hash_vector_queries([vector]) == hash_vector_queries(
+        [VectorizedQuery(vector=[0.1, 0.2], k_nearest_neighbors=50, fields="embedding")]
+    )
+    assert hash_vector_queries([vector]) != hash_vector_queries(
+        [VectorizedQuery(vector=[0.1, 0.3], k_nearest_neighbors=50, fields="embedding")]
+    )
+    assert hash_vector_queries([vector]) != hash_vector_queries(
+        [VectorizedQuery(vector=[0.1, 0.2], k_nearest_neighbors=50, fields="images/embedding")]
+    )
+    assert hash_vector_queries([vector]) != hash_vector_queries([])
+
+
+def test_build_key_separates_filters_and_options():
+    key = SearchResultCache.build_key("capital of France", "oids/any(g:search.in(g, 'a'))", [], top=3)
+    assert key == SearchResultCache.build_key("capital of France", "oids/any(g:search.in(g, 'a'))", [], top=3)
+    assert key != SearchResultCache.build_key("capital of France", "oids/any(g:search.in(g, 'b'))", [], top=3)
+    assert key != SearchResultCache.build_key("capital of France", "oids/any(g:search.in(g, 'a'))", [], top=5)
+    assert key != SearchResultCache.build_key("capital of Spain", "oids/any(g:search.in(g, 'a'))", [], top=3)
+
+
+@pytest.mark.asyncio
+async def test_get_or_search_caches_results():
+    searches = 0
+
+    async def search():
+        nonlocal searches
+        searches += 1
+        return ["result"]
+
+    cache: SearchResultCache[str] = SearchResultCache()
+    key = SearchResultCache.build_key("capital of France", None, [])
+    assert await cache.get_or_search(key, search) == ["result"]
+    results = await cache.get_or_search(key, search)
+    assert results == ["result"]
+    # Callers get their own list
+    results.append("other")
+    assert await cache.get_or_search(key, search) == ["result"]
+    assert searches == 1
+
+    cache.invalidate()
+    assert await cache.get_or_search(key, search) == ["result"]
+    assert searches == 2
+
+
+@pytest.mark.asyncio
+async def test_get_or_search_skips_results_from_before_invalidation():
+    release = asyncio.Event()
+
+    async def search():
+        await release.wait()
+        return ["stale"]
+
+    cache: SearchResultCache[str] = SearchResultCache()
+    key = SearchResultCache.build_key("capital of France", None, [])
+    task = asyncio.create_task(cache.get_or_search(key, search))
+    await asyncio.sleep(0)
+    cache.invalidate()
+    release.set()
+    assert await task == ["stale"]
+    assert key not in cache.cache
+
+
+@pytest.mark.asyncio
+async def test_search_uses_cache(monkeypatch, chat_approach):
+    searches = []
+
+    async def mock_counting_search(self, *args, **kwargs):
+        searches.append(kwargs)
+        return await mock_search(self, *args, **kwargs)
+
+    monkeypatch.setattr(SearchClient, "search", mock_counting_search)
+    chat_approach.search_cache = SearchResultCache()
+
+    async def search(query_text, filter=None, use_semantic_ranker=False):
+        return await chat_approach.search(
+            top=3,
+            query_text=query_text,
+            filter=filter,
+            vectors=[],
+            use_text_search=True,
+            use_vector_search=False,
+            use_semantic_ranker=use_semantic_ranker,
+            use_semantic_captions=False,
+        )
+
+    first, second = await asyncio.gather(search("capital of France"), search("capital of France"))
+    third = await search("capital of France")
+    assert first == second == third
+    assert first[0].content
+    assert len(searches) == 1
+
+    await search("capital of France", filter="category ne 'HR'")
+    await search("capital of France", use_semantic_ranker=True)
+    assert len(searches) == 3
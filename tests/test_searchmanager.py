@@ -210,6 +210,25 @@ async def test_update_content(monkeypatch, search_info):
     )
 
 
+@pytest.mark.asyncio
+async def test_update_content_calls_on_content_changed(monkeypatch, search_info):
+    events = []
+
+    async def mock_upload_documents(self, documents):
+        events.append("upload")
+
+    monkeypatch.setattr(SearchClient, "upload_documents", mock_upload_documents)
+
+    manager = SearchManager(search_info, on_content_changed=lambda: events.append("changed"))
+
+    test_io = io.BytesIO(b"test content")
+    test_io.name = "test/foo.pdf"
+    file = File(test_io)
+
+    await manager.update_content([Section(chunk=Chunk(page_num=0, text="test content"), content=file, category="test")])
+    assert events == ["upload", "changed"]
+
+
 @pytest.mark.asyncio
 async def test_update_content_many(monkeypatch, search_info):
     ids = []
@@ -245,6 +264,33 @@ async def test_update_content_many(monkeypatch, search_info):
     assert len(set(ids)) == 1500, "Document ids are not unique"
 
 
+@pytest.mark.asyncio
+async def test_update_content_stops_when_cancelled(monkeypatch, search_info):
+    uploaded_batches = []
+
+    async def mock_upload_documents(self, documents):
+        uploaded_batches.append(len(documents))
+
+    monkeypatch.setattr(SearchClient, "upload_documents", mock_upload_documents)
+
+    manager = SearchManager(search_info)
+    test_io = io.BytesIO(b"test page")
+    test_io.name = "test/foo.pdf"
+    file = File(test_io)
+    sections = [
+        Section(chunk=Chunk(page_num=page_num, text="test section"), content=file, category="test")
+        for page_num in range(2500)
+    ]
+
+    async def is_cancelled():
+        # The file is deleted once the first batch is indexed
+        return len(uploaded_batches) > 0
+
+    await manager.update_content(sections, is_cancelled=is_cancelled)
+
+    assert uploaded_batches == [1000]
+
+
 @pytest.mark.asyncio
 async def test_update_content_with_embeddings(monkeypatch, search_info):
     async def mock_create_client(*args, **kwargs):
@@ -0,0 +1,99 @@
+import asyncio
+import json
+
+import pytest
+
+import app
+from approaches.stagetimings import (
+    StageTimings,
+    current_stage_timings,
+    measure_stage,
+    start_stage_timings,
+)
+
+
+def test_as_props():
+    timings = StageTimings("ChatReadRetrieveReadApproach")
+    timings.record("search", 0.12345)
+    timings.record("embedding", 0.05)
+    timings.record("embedding", 0.025)
+    assert timings.as_props() == {"search": 123.5, "embedding": 75.0}
+
+
+@pytest.mark.asyncio
+async def test_measure_stage_records_into_current_timings():
+    async def embed():
+        with measure_stage("embedding"):
+            await asyncio.sleep(0.01)
+
+    async def answer():
+        timings = start_stage_timings("RetrieveThenReadApproach")
+        # Stages that run in other tasks still record into the timings of the request
+        await asyncio.gather(embed(), embed())
+        with measure_stage("search"):
+            pass
+        return timings
+
+    timings = await asyncio.create_task(answer())
+    assert set(timings.durations) == {"embedding", "search"}
+    assert timings.durations["embedding"] >= 0.02
+    # Each request has its own timings
+    assert current_stage_timings.get() is None
+
+
+def test_measure_stage_without_timings():
+    with measure_stage("search"):
+        pass
+    assert current_stage_timings.get() is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("route", ["/chat", "/ask"])
+async def test_stage_timings_in_thoughts(client, route):
+    response = await client.post(
+        route,
+        json={
+            "messages": [{"content": "What is the capital of France?", "role": "user"}],
+            "context": {"overrides": {"retrieval_mode": "hybrid"}},
+        },
+    )
+    result = await response.get_json()
+    assert "stage_timings_ms" not in result["context"]["thoughts"][-1]["props"]
+
+    client.app.config[app.CONFIG_CHAT_APPROACH].include_stage_timings = True
+    client.app.config[app.CONFIG_ASK_APPROACH].include_stage_timings = True
+    response = await client.post(
+        route,
+        json={
+            "messages": [{"content": "What is the capital of France?", "role": "user"}],
+            "context": {"overrides": {"retrieval_mode": "hybrid"}},
+        },
+    )
+    assert response.status_code == 200
+    result = await response.get_json()
+    stage_timings = result["context"]["thoughts"][-1]["props"]["stage_timings_ms"]
+    assert {"prompt_render", "embedding", "search", "source_assembly", "answer_completion", "total"} <= set(
+        stage_timings
+    )
+    assert ("query_rewrite" in stage_timings) == (route == "/chat")
+    assert all(duration >= 0 for duration in stage_timings.values())
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_stage_timings(client):
+    client.app.config[app.CONFIG_CHAT_APPROACH].include_stage_timings = True
+    response = await client.post(
+        "/chat/stream",
+        json={
+            "messages": [{"content": "What is the capital of France?", "role": "user"}],
+            "context": {"overrides": {"retrieval_mode": "text"}},
+        },
+    )
+    assert response.status_code == 200
+    events = [json.loads(line) for line in (await response.get_data()).decode().splitlines()]
+    context_events = [event for event in events if "context" in event]
+    assert "stage_timings_ms" not in context_events[0]["context"]["thoughts"][-1]["props"]
+    # The timings are sent with the context once the answer is complete
+    stage_timings = context_events[-1]["context"]["thoughts"][-1]["props"]["stage_timings_ms"]
+    assert {"query_rewrite", "search", "time_to_first_token", "stream", "total"} <= set(stage_timings)
+    assert "answer_completion" not in stage_timings
@@ -1,4 +1,6 @@
+import asyncio
 from io import BytesIO
+from unittest.mock import MagicMock
 
 import azure.core.exceptions
 import azure.storage.filedatalake
@@ -13,7 +15,11 @@ from openai.types.create_embedding_response import (
 )
 from quart.datastructures import FileStorage
 
+import app
+from core.uploadjobs import UploadJob
+from prepdocslib.blobmanager import AdlsBlobManager
 from prepdocslib.embeddings import AzureOpenAIEmbeddingService
+from prepdocslib.filestrategy import UploadUserFileStrategy
 
 from .mocks import MockClient, MockEmbeddingsClient
 
@@ -59,12 +65,30 @@ async def test_upload_file(auth_client, monkeypatch, mock_data_lake_service_clie
 
     directory_created = [False]
 
-    async def mock_upload_file(self, *args, **kwargs):
+    uploaded_data = []
+
+    async def mock_upload_file(self, data, *args, **kwargs):
         assert kwargs.get("overwrite") is True
+        # Large files are uploaded in several blocks at a time
+        assert kwargs.get("max_concurrency", 1) > 1
+        uploaded_data.append(data.read())
         return None
 
     monkeypatch.setattr(DataLakeFileClient, "upload_data", mock_upload_file)
 
+    class MockDownloader:
+        properties = MagicMock(etag='"1"', content_range=None, size=7)
+
+        async def chunks(self):
+            # The uploaded file is read back in chunks to be ingested
+            for chunk in [b"foo;", b"bar"]:
+                yield chunk
+
+    async def mock_download_file(self, *args, **kwargs):
+        return MockDownloader()
+
+    monkeypatch.setattr(DataLakeFileClient, "download_file", mock_download_file)
+
     async def mock_create_client(self, *args, **kwargs):
         # From https://platform.openai.com/docs/api-reference/embeddings/create
         return MockClient(
@@ -101,9 +125,21 @@ async def test_upload_file(auth_client, monkeypatch, mock_data_lake_service_clie
         headers={"Authorization": "Bearer test"},
         files={"file": FileStorage(BytesIO(b"foo;bar"), filename="a.txt")},
     )
-    message = (await response.get_json())["message"]
-    assert message == "File uploaded successfully"
-    assert response.status_code == 200
+    result = await response.get_json()
+    assert result["message"] == "File uploaded successfully"
+    assert response.status_code == 202
+    assert uploaded_data == [b"foo;bar"]
+
+    # The file is ingested in the background
+    for _ in range(100):
+        response = await auth_client.get(f"/upload_status/{result['job_id']}", headers={"Authorization": "Bearer test"})
+        assert response.status_code == 200
+        status = await response.get_json()
+        if status["status"] not in ("queued", "running"):
+            break
+        await asyncio.sleep(0.01)
+    assert status["status"] == "succeeded"
+    assert status["filename"] == "a.txt"
     assert len(documents_uploaded) == 1
     assert documents_uploaded[0]["id"] == "file-a_txt-612E7478747B276F696473273A205B274F49445F58275D7D-page-0"
     assert documents_uploaded[0]["sourcepage"] == "a.txt"
@@ -146,6 +182,19 @@ async def test_upload_file_error_wrong_directory_owner(auth_client, monkeypatch,
     assert response.status_code == 500
 
 
+@pytest.mark.asyncio
+async def test_upload_status_not_found(auth_client):
+    response = await auth_client.get("/upload_status/missing", headers={"Authorization": "Bearer test"})
+    assert response.status_code == 404
+
+    # Users can only see their own jobs
+    upload_jobs = auth_client.app.config[app.CONFIG_UPLOAD_JOBS]
+    job = UploadJob(user_oid="OID_Y", filename="a.txt")
+    upload_jobs.log.save(job, upload_jobs.owner)
+    response = await auth_client.get(f"/upload_status/{job.id}", headers={"Authorization": "Bearer test"})
+    assert response.status_code == 404
+
+
 @pytest.mark.asyncio
 async def test_list_uploaded(auth_client, monkeypatch, mock_data_lake_service_client):
     response = await auth_client.get("/list_uploaded", headers={"Authorization": "Bearer test"})
@@ -278,3 +327,46 @@ async def test_delete_uploaded(auth_client, monkeypatch, mock_data_lake_service_
     assert len(deleted_documents) == 1, "It should have only deleted the document solely owned by OID_X"
     assert deleted_documents[0]["id"] == "file-a_txt-7465737420646F63756D656E742E706466"
     assert len(deleted_directories) == 1, "It should have deleted the directory for the file"
+
+
+@pytest.mark.asyncio
+async def test_delete_uploaded_during_ingestion(auth_client, monkeypatch):
+    parsed = asyncio.Event()
+    release = asyncio.Event()
+    indexed = []
+    removed = []
+
+    async def mock_add_uploaded_file(self, filename, user_oid, url=None, is_cancelled=None):
+        parsed.set()
+        await release.wait()
+        if not await is_cancelled():
+            indexed.append(filename)
+
+    async def mock_remove_file(self, filename, oid):
+        removed.append(filename)
+
+    async def mock_remove_blob(self, filename, user_oid):
+        return None
+
+    monkeypatch.setattr(UploadUserFileStrategy, "add_uploaded_file", mock_add_uploaded_file)
+    monkeypatch.setattr(UploadUserFileStrategy, "remove_file", mock_remove_file)
+    monkeypatch.setattr(AdlsBlobManager, "remove_blob", mock_remove_blob)
+
+    upload_jobs = auth_client.app.config[app.CONFIG_UPLOAD_JOBS]
+    job = await upload_jobs.submit("OID_X", "a.txt")
+    await parsed.wait()
+    response = await auth_client.post(
+        "/delete_uploaded", headers={"Authorization": "Bearer test"}, json={"filename": "a.txt"}
+    )
+    assert response.status_code == 200
+    release.set()
+    for _ in range(100):
+        if job.id not in upload_jobs.active:
+            break
+        await asyncio.sleep(0.01)
+
+    # The job doesn't index the deleted file, and removes anything it might have indexed
+    assert indexed == []
+    assert removed == ["a.txt", "a.txt"]
+    response = await auth_client.get(f"/upload_status/{job.id}", headers={"Authorization": "Bearer test"})
+    assert (await response.get_json())["status"] == "cancelled"
@@ -0,0 +1,254 @@
+import asyncio
+
+import pytest
+
+from core.uploadjobs import UploadJob, UploadJobLog, UploadJobs, UploadJobStatus
+
+
+async def wait_for_jobs(upload_jobs: UploadJobs):
+    for _ in range(100):
+        if not upload_jobs.active:
+            return
+        await asyncio.sleep(0.01)
+    raise TimeoutError("Upload jobs didn't finish")
+
+
+@pytest.mark.asyncio
+async def test_users_take_turns():
+    ingested = []
+
+    async def ingest(job: UploadJob):
+        ingested.append(f"{job.user_oid}/{job.filename}")
+
+    upload_jobs = UploadJobs(ingest, workers=1, log_path=":memory:")
+    for filename in ["a.txt", "b.txt", "c.txt"]:
+        await upload_jobs.submit("OID_X", filename)
+    await upload_jobs.submit("OID_Y", "d.txt")
+    await upload_jobs.start()
+    await wait_for_jobs(upload_jobs)
+    # One user's burst of uploads doesn't hold up the others
+    assert ingested == ["OID_X/a.txt", "OID_Y/d.txt", "OID_X/b.txt", "OID_X/c.txt"]
+    await upload_jobs.close()
+
+
+@pytest.mark.asyncio
+async def test_status_from_job_log():
+    async def ingest(job: UploadJob):
+        pass
+
+    upload_jobs = UploadJobs(ingest, log_path=":memory:")
+    await upload_jobs.start()
+    job = await upload_jobs.submit("OID_X", "a.txt", url="https://test.dfs.core.windows.net/OID_X/a.txt")
+    assert (await upload_jobs.get(job.id, "OID_X")).status == UploadJobStatus.QUEUED
+    await wait_for_jobs(upload_jobs)
+
+    status = (await upload_jobs.get(job.id, "OID_X")).to_dict()
+    assert status["status"] == "succeeded"
+    assert status["attempts"] == 1
+    assert status["finished_at"] is not None
+    # Users can only see their own jobs
+    assert await upload_jobs.get(job.id, "OID_Y") is None
+    assert await upload_jobs.get("missing", "OID_X") is None
+    await upload_jobs.close()
+
+
+@pytest.mark.asyncio
+async def test_retry_with_backoff():
+    errors = [RuntimeError("Rate limited"), RuntimeError("Rate limited")]
+
+    async def ingest(job: UploadJob):
+        if job.filename == "missing.txt":
+            raise FileNotFoundError("Uploaded file missing.txt not found")
+        if errors:
+            raise errors.pop()
+
+    upload_jobs = UploadJobs(ingest, log_path=":memory:", retry_backoff_seconds=0.01)
+    await upload_jobs.start()
+    job = await upload_jobs.submit("OID_X", "a.txt")
+    missing = await upload_jobs.submit("OID_X", "missing.txt")
+    await wait_for_jobs(upload_jobs)
+    assert job.status == UploadJobStatus.SUCCEEDED
+    assert job.attempts == 3
+    assert job.error is None
+    # Missing files aren't retried
+    assert missing.status == UploadJobStatus.FAILED
+    assert missing.attempts == 1
+    assert missing.error == "Uploaded file missing.txt not found"
+
+    async def fail(job: UploadJob):
+        raise RuntimeError("Parsing failed")
+
+    upload_jobs.ingest = fail
+    job = await upload_jobs.submit("OID_X", "b.txt")
+    await wait_for_jobs(upload_jobs)
+    assert job.status == UploadJobStatus.FAILED
+    assert job.attempts == UploadJobs.MAX_ATTEMPTS
+    assert job.error == "Parsing failed"
+    await upload_jobs.close()
+
+
+@pytest.mark.asyncio
+async def test_cancel_jobs_for_deleted_file():
+    release = asyncio.Event()
+    ingested = []
+    removed = []
+
+    async def ingest(job: UploadJob):
+        if job.filename == "a.txt":
+            await release.wait()
+        ingested.append(job.filename)
+
+    async def remove(job: UploadJob):
+        removed.append(job.filename)
+
+    upload_jobs = UploadJobs(ingest, remove, workers=1, log_path=":memory:")
+    await upload_jobs.start()
+    running = await upload_jobs.submit("OID_X", "a.txt")
+    await asyncio.sleep(0.01)
+    queued = await upload_jobs.submit("OID_X", "a.txt")
+    other = await upload_jobs.submit("OID_X", "b.txt")
+    await upload_jobs.cancel("OID_X", "a.txt")
+    release.set()
+    await wait_for_jobs(upload_jobs)
+
+    # The running job finished ingesting the file, so what it indexed is removed, and the queued job never ran
+    assert ingested == ["a.txt", "b.txt"]
+    assert removed == ["a.txt"]
+    assert running.status == UploadJobStatus.CANCELLED
+    assert queued.status == UploadJobStatus.CANCELLED
+    assert queued.attempts == 0
+    assert other.status == UploadJobStatus.SUCCEEDED
+    assert (await upload_jobs.get(queued.id, "OID_X")).status == UploadJobStatus.CANCELLED
+    await upload_jobs.close()
+
+
+@pytest.mark.asyncio
+async def test_cancelled_job_keeps_the_file_uploaded_again():
+    release = asyncio.Event()
+    started: list[str] = []
+    removed = []
+
+    async def ingest(job: UploadJob):
+        started.append(job.id)
+        if len(started) == 1:
+            await release.wait()
+
+    async def remove(job: UploadJob):
+        removed.append(job.filename)
+
+    upload_jobs = UploadJobs(ingest, remove, workers=2, log_path=":memory:")
+    await upload_jobs.start()
+    old_job = await upload_jobs.submit("OID_X", "a.txt")
+    await asyncio.sleep(0.01)
+    # The file is deleted, and uploaded again while the old job is still ingesting it
+    await upload_jobs.cancel("OID_X", "a.txt")
+    new_job = await upload_jobs.submit("OID_X", "a.txt")
+    await asyncio.sleep(0.01)
+    assert new_job.status == UploadJobStatus.SUCCEEDED
+    release.set()
+    await wait_for_jobs(upload_jobs)
+
+    # Removing what the old job indexed would remove the new upload too
+    assert old_job.status == UploadJobStatus.CANCELLED
+    assert removed == []
+    await upload_jobs.close()
+
+
+@pytest.mark.asyncio
+async def test_cancel_job_waiting_to_retry():
+    async def ingest(job: UploadJob):
+        raise RuntimeError("Rate limited")
+
+    upload_jobs = UploadJobs(ingest, workers=1, log_path=":memory:", retry_backoff_seconds=0.05)
+    await upload_jobs.start()
+    job = await upload_jobs.submit("OID_X", "a.txt")
+    await asyncio.sleep(0.01)
+    assert job.id in upload_jobs.retries
+    await upload_jobs.cancel("OID_X", "a.txt")
+    await asyncio.sleep(0.1)
+    assert job.status == UploadJobStatus.CANCELLED
+    assert job.attempts == 1
+    assert upload_jobs.retries == {}
+    await upload_jobs.close()
+
+
+@pytest.mark.asyncio
+async def test_cancel_job_running_in_another_process(tmp_path):
+    log_path = str(tmp_path / "upload_jobs.sqlite3")
+    release = asyncio.Event()
+    removed = []
+
+    async def ingest(job: UploadJob):
+        await release.wait()
+
+    async def remove(job: UploadJob):
+        removed.append(job.filename)
+
+    upload_jobs = UploadJobs(ingest, remove, workers=1, log_path=log_path)
+    other_process_jobs = UploadJobs(ingest, remove, workers=1, log_path=log_path)
+    await upload_jobs.start()
+    job = await upload_jobs.submit("OID_X", "a.txt")
+    await asyncio.sleep(0.01)
+    # The file is deleted by a request to another process
+    await other_process_jobs.cancel("OID_X", "a.txt")
+    release.set()
+    await wait_for_jobs(upload_jobs)
+    assert job.status == UploadJobStatus.CANCELLED
+    assert removed == ["a.txt"]
+    assert (await other_process_jobs.get(job.id, "OID_X")).status == UploadJobStatus.CANCELLED
+    await upload_jobs.close()
+    await other_process_jobs.close()
+
+
+@pytest.mark.asyncio
+async def test_resume_unfinished_jobs(tmp_path, monkeypatch):
+    log_path = str(tmp_path / "upload_jobs.sqlite3")
+    release = asyncio.Event()
+    ingested = []
+
+    async def ingest(job: UploadJob):
+        await release.wait()
+        ingested.append(job.filename)
+
+    upload_jobs = UploadJobs(ingest, workers=1, log_path=log_path)
+    await upload_jobs.start()
+    running = await upload_jobs.submit("OID_X", "a.txt")
+    queued = await upload_jobs.submit("OID_X", "b.txt")
+    await asyncio.sleep(0.01)
+    assert running.status == UploadJobStatus.RUNNING
+    await upload_jobs.close()
+
+    # The jobs of a process that stopped are only resumed once their lease expires
+    monkeypatch.setattr(UploadJobs, "LEASE_SECONDS", 0.3)
+    await asyncio.sleep(0.35)
+    release.set()
+    restarted_jobs = UploadJobs(ingest, workers=1, log_path=log_path)
+    await restarted_jobs.start()
+    await wait_for_jobs(restarted_jobs)
+    assert sorted(ingested) == ["a.txt", "b.txt"]
+    assert (await restarted_jobs.get(running.id, "OID_X")).attempts == 2
+    assert (await restarted_jobs.get(queued.id, "OID_X")).status == UploadJobStatus.SUCCEEDED
+    await restarted_jobs.close()
+
+
+def test_claim_expired_once(tmp_path):
+    log_path = str(tmp_path / "upload_jobs.sqlite3")
+    first_log, second_log = UploadJobLog(log_path), UploadJobLog(log_path)
+    job = UploadJob(user_oid="OID_X", filename="a.txt")
+    first_log.save(job, "stopped-process")
+    # Only one of the processes resuming jobs claims each job
+    assert [claimed.id for claimed in first_log.claim_expired("first", lease_seconds=-1)] == [job.id]
+    assert second_log.claim_expired("second", lease_seconds=0.5) == []
+    first_log.close()
+    second_log.close()
+
+
+def test_cancelled_job_stays_cancelled():
+    log = UploadJobLog(":memory:")
+    job = UploadJob(user_oid="OID_X", filename="a.txt")
+    assert log.save(job, "owner")
+    log.cancel("OID_X", "a.txt")
+    job.status = UploadJobStatus.SUCCEEDED
+    assert not log.save(job, "owner")
+    assert log.get(job.id).status == UploadJobStatus.CANCELLED
+    log.close()